@@ -0,0 +1,293 @@
+import argparse
+import contextlib
+import functools
+import io
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+EXPERIMENTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.extend([
+    os.path.join(EXPERIMENTS_PATH, 'exploratory', 'distribution algorithms'),
+    os.path.join(EXPERIMENTS_PATH, 'recommendation_algorithm', 'rec_algorithms'),
+])
+
+import algorithms  # noqa: E402
+import datastructures  # noqa: E402
+import evaluation  # noqa: E402
+import multilevel  # noqa: E402
+import preprocess_data  # noqa: E402
+import scoring  # noqa: E402
+import snapshot  # noqa: E402
+from hybrid_rec_system import HybridRecommendationSystem  # noqa: E402
+from rec_services.dataset import Dataset  # noqa: E402
+from rec_services.graph import Graph  # noqa: E402
+from rec_services.model import RecommendationModel  # noqa: E402
+from rec_services.user import User  # noqa: E402
+from synthetic_data import load_profile, write_dataset  # noqa: E402
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def _rss() -> int:
+    """Current resident set size in bytes, or the peak one if psutil is not installed."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def measure(fn, interval: float = 0.01) -> dict:
+    """Runs `fn` and returns its wall time and the peak RSS sampled while it was running."""
+    baseline = _rss()
+    peak = baseline
+    done = threading.Event()
+
+    def sample():
+        nonlocal peak
+        while not done.wait(interval):
+            peak = max(peak, _rss())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            fn()
+    finally:
+        wall_time = time.perf_counter() - start
+        done.set()
+        sampler.join()
+    peak = max(peak, _rss())
+    return {
+        'wall_time': wall_time,
+        'peak_rss_mb': peak / 2 ** 20,
+        'rss_delta_mb': (peak - baseline) / 2 ** 20,
+    }
+
+
+class Context:
+    """Lazily prepared inputs of the stages for one data graph, preparation is never timed."""
+
+    def __init__(self, data_path: str, seed: int = 0):
+        self.data_path = data_path
+        self.seed = seed
+
+    @functools.cached_property
+    def frames(self) -> (pd.DataFrame, pd.DataFrame):
+        answers = pd.read_json(os.path.join(self.data_path, 'answers.json'))
+        participants = pd.read_json(os.path.join(self.data_path, 'participants.json'))
+        return answers, participants
+
+    @functools.cached_property
+    def dataset(self) -> Dataset:
+        return Dataset(*self.frames)
+
+    @functools.cached_property
+    def user(self) -> User:
+        user_id = self.dataset.answers_pivot.index[0]
+        return User(
+            user_id,
+            self.dataset.get_user_vector(user_id),
+            list(self.dataset.participants.loc[user_id]['subscription_ids']),
+        )
+
+    @functools.cached_property
+    def recommender(self) -> HybridRecommendationSystem:
+        return HybridRecommendationSystem(self.user, model=_model(self.dataset))
+
+    def close(self):
+        """Stops the thread pool of the recommender if it was built."""
+        if 'recommender' in self.__dict__:
+            self.recommender.model.close()
+
+    @functools.cached_property
+    def info_df(self) -> pd.DataFrame:
+        return preprocess_data.get_info_df(self.data_path)
+
+    @functools.cached_property
+    def answer_codes(self):
+        return preprocess_data.get_answer_codes(self.data_path)
+
+    @functools.cached_property
+    def knn_graph(self):
+        return algorithms.build_knn_graph(self.info_df, 10, max_hops=2)
+
+    def rooms(self) -> list[datastructures.Room]:
+        random.seed(self.seed)
+        return datastructures.create_random_room_list(len(self.info_df) + 10)
+
+
+def _score_layouts(ctx: Context, n_layouts: int = 1000):
+    """Prepares the scoring of random assignments of the nodes of the kNN graph to the rooms."""
+    rooms = ctx.rooms()
+    scorer = scoring.RoomScorer.from_graph(ctx.knn_graph, len(rooms))
+    layouts = np.random.default_rng(ctx.seed).integers(0, len(rooms), (n_layouts, scorer.n_nodes))
+    return lambda: (scorer.mean_satisfaction(layouts), scorer.edges_saved(layouts))
+
+
+def _model(dataset: Dataset) -> RecommendationModel:
+    # the searches do not use personalized PageRank, no vectors are pushed
+    return RecommendationModel(dataset, precompute_ppr=False)
+
+
+def _recommender_init(ctx: Context):
+    """Times building a recommender, the thread pool of its model is stopped after every run."""
+    return lambda: HybridRecommendationSystem(ctx.user, model=_model(ctx.dataset)).model.close()
+
+
+def _search(ctx: Context, queries: int = 100):
+    """Builds the recommender outside of the measurement, only the searches are timed."""
+    recommender = ctx.recommender
+
+    def search():
+        for _ in range(queries):
+            ctx.user.get_similar_users(recommender.index, 11)
+
+    return search
+
+
+def _load_info_df(ctx: Context):
+    """Compiles or validates the snapshot outside of the measurement, so the warm load is timed."""
+    snapshot.load_snapshot(ctx.data_path)
+    return lambda: preprocess_data.get_info_df(ctx.data_path)
+
+
+# name: (prepares the timed callable, maximum number of participants or None)
+STAGES = {
+    'load_json': (lambda ctx: lambda: Context(ctx.data_path).frames, None),
+    'dataset': (lambda ctx: lambda: Dataset(*ctx.frames), None),
+    'graph': (lambda ctx: lambda: Graph(ctx.dataset.participants, ctx.dataset.nan_responses), None),
+    'recommender_init': (_recommender_init, None),
+    'recommender_search': (_search, None),
+    'info_df_json': (lambda ctx: lambda: preprocess_data.get_info_df(ctx.data_path, use_snapshot=False), None),
+    'compile_snapshot': (lambda ctx: lambda: snapshot.compile_snapshot(ctx.data_path), None),
+    'info_df': (_load_info_df, None),
+    'content_similarity_matrix': (lambda ctx: lambda: evaluation.get_content_similarity_matrix(ctx.info_df), 20000),
+    'binary_content_similarity_matrix': (
+        lambda ctx: (lambda codes: lambda: evaluation.get_content_similarity_matrix(ctx.info_df, codes=codes))(
+            ctx.answer_codes), 20000),
+    'graph_similarity_matrix': (lambda ctx: lambda: evaluation.get_graph_similarity_matrix(ctx.info_df), 20000),
+    'hybrid_similarity_matrix': (lambda ctx: lambda: evaluation.get_hybrid_similarity_matrix(ctx.info_df), 20000),
+    'knn_graph': (lambda ctx: lambda: algorithms.build_knn_graph(ctx.info_df, 10, max_hops=2), 100000),
+    'score_layouts': (_score_layouts, 20000),
+    'divide_by_rooms': (
+        lambda ctx: (lambda g, rooms: lambda: algorithms.divide_by_rooms(ctx.info_df, g, rooms))(
+            ctx.knn_graph, ctx.rooms()), 250),
+    'divide_by_rooms_sparse': (
+        lambda ctx: (lambda g, rooms: lambda: algorithms.divide_by_rooms_sparse(ctx.info_df, g, rooms))(
+            ctx.knn_graph, ctx.rooms()), 100000),
+    'divide_by_rooms_multilevel': (
+        lambda ctx: (lambda g, rooms: lambda: multilevel.divide_by_rooms_multilevel(ctx.info_df, g, rooms))(
+            ctx.knn_graph, ctx.rooms()), 100000),
+}
+# divide_by_rooms loops forever when no cluster fits into a free room, so it only runs on request
+DEFAULT_STAGES = [stage for stage in STAGES if stage != 'divide_by_rooms']
+
+
+def run_benchmarks(sizes: list[int], stages: list[str], data_root: str, seed: int = 0,
+                   ignore_limits: bool = False) -> dict:
+    """
+    Generates a synthetic data graph for every size and measures every stage on it.
+
+    Stages that fail or exceed their size limit are recorded with an `error` or `skipped` field,
+    so reports of different runs always contain the same rows.
+    """
+    profile = load_profile()
+    results = []
+    for size in sizes:
+        data_path = os.path.join(data_root, str(size))
+        if not os.path.exists(os.path.join(data_path, 'answers.json')):
+            write_dataset(data_path, size, seed, profile)
+        ctx = Context(data_path, seed)
+        try:
+            for stage in stages:
+                prepare, max_size = STAGES[stage]
+                row = {'size': size, 'stage': stage}
+                if max_size is not None and size > max_size and not ignore_limits:
+                    row['skipped'] = f'size limit {max_size}'
+                else:
+                    try:
+                        row.update(measure(prepare(ctx)))
+                        row['throughput'] = size / row['wall_time'] if row['wall_time'] else None
+                    except Exception as e:
+                        row['error'] = f'{type(e).__name__}: {e}'
+                results.append(row)
+                print(json.dumps(row), flush=True)
+        finally:
+            ctx.close()
+    return {'meta': _meta(seed), 'results': results}
+
+
+def _meta(seed: int) -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=EXPERIMENTS_PATH).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'seed': seed,
+    }
+
+
+def compare(report: dict, baseline: dict, tolerance: float = 1.2) -> list[dict]:
+    """Returns the stages whose wall time or peak RSS grew by more than `tolerance` times."""
+    previous = {(row['size'], row['stage']): row for row in baseline['results']}
+    regressions = []
+    for row in report['results']:
+        old = previous.get((row['size'], row['stage']))
+        if old is None:
+            continue
+        for metric in ('wall_time', 'peak_rss_mb'):
+            if metric in row and metric in old and old[metric] and row[metric] / old[metric] > tolerance:
+                regressions.append({'size': row['size'], 'stage': row['stage'], 'metric': metric,
+                                    'baseline': old[metric], 'current': row[metric]})
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Measure how the pipeline scales with the number of participants.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), default=DEFAULT_STAGES)
+    parser.add_argument('--data-root', default=None, help='Where synthetic data graphs are cached.')
+    parser.add_argument('--output', default='benchmark_report.json')
+    parser.add_argument('--baseline', default=None, help='Report to compare the results with.')
+    parser.add_argument('--tolerance', type=float, default=1.2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--ignore-limits', action='store_true', help='Run stages above their size limit.')
+    args = parser.parse_args()
+
+    with contextlib.ExitStack() as stack:
+        data_root = args.data_root or stack.enter_context(tempfile.TemporaryDirectory())
+        report = run_benchmarks(args.sizes, args.stages, data_root, args.seed, args.ignore_limits)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"Regression in {regression['stage']} at {regression['size']} participants: "
+                  f"{regression['metric']} {regression['baseline']:.3f} -> {regression['current']:.3f}")
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,112 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import normalize
+
+EXPERIMENTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(EXPERIMENTS_PATH, 'recommendation_algorithm', 'rec_algorithms'))
+
+from rec_services.dataset import Dataset  # noqa: E402
+from rec_services.index import build_index  # noqa: E402
+from synthetic_data import DATA_PATH, write_dataset  # noqa: E402
+
+# (backend, build parameters, search parameters)
+CONFIGS = [
+    ('flat', {}, {}),
+    ('ivf', {}, {'nprobe': 1}),
+    ('ivf', {}, {'nprobe': 8}),
+    ('ivf', {}, {'nprobe': 32}),
+    ('hnsw', {'M': 16}, {'ef_search': 16}),
+    ('hnsw', {'M': 32}, {'ef_search': 64}),
+    ('hnsw', {'M': 32}, {'ef_search': 256}),
+    ('pq', {}, {}),
+    ('ivfpq', {}, {'nprobe': 8}),
+    ('ivfpq', {}, {'nprobe': 32}),
+]
+
+
+def load_vectors(data_path: str) -> np.ndarray:
+    """Returns the normalized answer vectors exactly as the recommender indexes them."""
+    answers = pd.read_json(os.path.join(data_path, 'answers.json'))
+    participants = pd.read_json(os.path.join(data_path, 'participants.json'))
+    dataset = Dataset(answers, participants)
+    return np.ascontiguousarray(normalize(dataset.answers_pivot.values).astype(np.float32))
+
+
+def recall(exact_distances: np.ndarray, distances: np.ndarray, indices: np.ndarray, eps: float = 1e-5) -> float:
+    """
+    Share of the returned neighbours that are at least as close as the k-th exact neighbour.
+
+    Answer vectors are categorical and many of them coincide, so comparing ids would punish
+    an index for returning a different one of several equally distant users.
+    """
+    threshold = exact_distances[:, -1:] + eps
+    return float(np.mean((distances <= threshold) & (indices >= 0)))
+
+
+def benchmark_index(vectors: np.ndarray, queries: np.ndarray, exact_distances: np.ndarray, k: int,
+                    backend: str, build_params: dict, search_params: dict) -> dict:
+    start = time.perf_counter()
+    index = build_index(vectors, backend, build_params, search_params)
+    build_time = time.perf_counter() - start
+
+    latencies = np.empty(len(queries))
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        index.search(query[None, :], k)
+        latencies[i] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    distances, indices = index.search(queries, k)
+    batch_time = time.perf_counter() - start
+
+    return {
+        'backend': backend,
+        'build_params': build_params,
+        'search_params': search_params,
+        'build_time': build_time,
+        'recall': recall(exact_distances, distances, indices),
+        'latency_p50_ms': 1000 * float(np.percentile(latencies, 50)),
+        'latency_p99_ms': 1000 * float(np.percentile(latencies, 99)),
+        'batch_qps': len(queries) / batch_time,
+    }
+
+
+def run(vectors: np.ndarray, n_queries: int = 1000, k: int = 11, seed: int = 0) -> list[dict]:
+    """Measures recall@k and latency of every configuration against the exact flat index."""
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.choice(len(vectors), size=min(n_queries, len(vectors)), replace=False)]
+    exact_distances, _ = build_index(vectors, 'flat').search(queries, k)
+    return [
+        benchmark_index(vectors, queries, exact_distances, k, backend, build_params, search_params)
+        for backend, build_params, search_params in CONFIGS
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Recall vs latency of the FAISS index backends.')
+    parser.add_argument('--data-path', default=DATA_PATH)
+    parser.add_argument('--size', type=int, default=None, help='Use a synthetic data graph of this size.')
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('-k', type=int, default=11)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='index_benchmark.json')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_path = args.data_path if args.size is None else write_dataset(tmp, args.size, args.seed)
+        vectors = load_vectors(data_path)
+
+    results = run(vectors, args.queries, args.k, args.seed)
+    for row in results:
+        print(f"{row['backend']:>6} {json.dumps(row['build_params']):>16} {json.dumps(row['search_params']):>20} "
+              f"recall={row['recall']:.3f} p50={row['latency_p50_ms']:.3f}ms p99={row['latency_p99_ms']:.3f}ms "
+              f"build={row['build_time']:.2f}s")
+    with open(args.output, 'w') as f:
+        json.dump({'n_vectors': len(vectors), 'k': args.k, 'results': results}, f, indent=2)
@@ -0,0 +1,81 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import numpy as np
+
+
+async def _request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, method: str, path: str,
+                   payload: dict = None) -> dict:
+    body = json.dumps(payload).encode() if payload is not None else b''
+    writer.write(f'{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n\r\n'.encode() + body)
+    await writer.drain()
+    await reader.readline()
+    headers = {}
+    while (line := await reader.readline()) not in (b'\r\n', b''):
+        name, _, value = line.decode().partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return json.loads(await reader.readexactly(int(headers['content-length'])))
+
+
+async def _client(host: str, port: int, user_ids: list[int], n_requests: int, feedback: float,
+                  latencies: list[float], rng: random.Random) -> None:
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for _ in range(n_requests):
+            user_id = rng.choice(user_ids)
+            start = time.perf_counter()
+            response = await _request(reader, writer, 'GET', f'/recommend?user_id={user_id}')
+            latencies.append(time.perf_counter() - start)
+            if response.get('recommendations') and rng.random() < feedback:
+                await _request(reader, writer, 'POST', '/feedback', {
+                    'user_id': user_id,
+                    'candidate_id': response['recommendations'][0],
+                    'accepted': rng.random() < 0.5,
+                })
+    finally:
+        writer.close()
+
+
+async def run(host: str, port: int, user_ids: list[int], clients: int, requests: int, feedback: float = 0.2,
+              seed: int = 0) -> dict:
+    """Runs `clients` concurrent keep-alive clients that send `requests` recommend requests each."""
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        _client(host, port, user_ids, requests, feedback, latencies, random.Random(seed + i))
+        for i in range(clients)
+    ))
+    wall_time = time.perf_counter() - start
+
+    reader, writer = await asyncio.open_connection(host, port)
+    server_stats = await _request(reader, writer, 'GET', '/stats')
+    writer.close()
+
+    latencies = 1000 * np.array(latencies)
+    return {
+        'clients': clients,
+        'requests': len(latencies),
+        'wall_time': wall_time,
+        'throughput': len(latencies) / wall_time,
+        'latency_p50_ms': float(np.percentile(latencies, 50)),
+        'latency_p99_ms': float(np.percentile(latencies, 99)),
+        'server': server_stats,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Load generator for the recommendation server.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--users', type=int, nargs='+', required=True, help='User ids to request recommendations for.')
+    parser.add_argument('--clients', type=int, default=64)
+    parser.add_argument('--requests', type=int, default=100, help='Requests per client.')
+    parser.add_argument('--feedback', type=float, default=0.2, help='Share of the responses answered with feedback.')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args.host, args.port, args.users, args.clients, args.requests, args.feedback, args.seed))
+    print(json.dumps(report, indent=2))
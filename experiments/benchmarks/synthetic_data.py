@@ -0,0 +1,168 @@
+import argparse
+import json
+import os
+
+import numpy as np
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data')
+
+
+def load_profile(data_path: str = DATA_PATH) -> dict:
+    """
+    Collects the empirical distributions of the real data graph that the generator resamples from.
+
+    :param data_path: Directory with participants.json, answers.json and fields.json.
+    :return: Dictionary with the fields, the per-participant statistics and the complete answer vectors.
+    """
+    with open(os.path.join(data_path, 'participants.json')) as f:
+        participants = json.load(f)
+    with open(os.path.join(data_path, 'answers.json')) as f:
+        answers = json.load(f)
+    with open(os.path.join(data_path, 'fields.json')) as f:
+        fields = json.load(f)
+
+    field_ids = [field['id'] for field in fields]
+    field_position = {field_id: i for i, field_id in enumerate(field_ids)}
+    matrix = np.full((max(p['id'] for p in participants) + 1, len(fields)), -1, dtype=np.int64)
+    for answer in answers:
+        matrix[answer['respondent_id'], field_position[answer['field_id']]] = answer['option']
+    matrix = matrix[[p['id'] for p in participants]]
+    answered = matrix >= 0
+
+    def lengths(key):
+        return np.array([len(p[key]) for p in participants])
+
+    return {
+        'fields': fields,
+        'gender_female': np.mean([p['gender'] == 'female' for p in participants]),
+        'created_at': np.array([p['created_at'] for p in participants]),
+        'views': np.array([p['views'] for p in participants]),
+        'subscription_lengths': lengths('subscription_ids'),
+        'subscriber_lengths': lengths('subscriber_ids'),
+        'viewed_extra': np.maximum(lengths('viewed_ids') - lengths('subscription_ids'), 0),
+        'subscriber_slack': np.array([p['subscriber_count'] for p in participants]) - lengths('subscriber_ids'),
+        'subscription_slack': np.array([p['subscription_count'] for p in participants]) - lengths('subscription_ids'),
+        'viewed_slack': np.array([p['viewed_count'] for p in participants]) - lengths('viewed_ids'),
+        'answer_patterns': answered,
+        'complete_answers': matrix[answered.all(axis=1)],
+    }
+
+
+def _sample_edges(rng: np.random.Generator, n: int, out_degrees: np.ndarray, popularity: np.ndarray) -> np.ndarray:
+    """
+    Samples unique edges without self-loops, targets are drawn proportionally to popularity.
+
+    :return: Sorted edge keys source * n + target.
+    """
+    sources = np.repeat(np.arange(n, dtype=np.int64), out_degrees)
+    targets = rng.choice(n, size=len(sources), p=popularity / popularity.sum())
+    keys = np.unique(sources * n + targets)
+    return keys[keys // n != keys % n]
+
+
+def _edges(keys: np.ndarray, n: int) -> np.ndarray:
+    return np.stack([keys // n, keys % n], axis=1)
+
+
+def _group(edges: np.ndarray, n: int, by: int) -> list[list[int]]:
+    """Splits the edge list into per-node neighbour lists of ids (1-based)."""
+    order = np.argsort(edges[:, by], kind='stable')
+    counts = np.bincount(edges[:, by], minlength=n)
+    neighbours = edges[order, 1 - by] + 1
+    return [chunk.tolist() for chunk in np.split(neighbours, np.cumsum(counts)[:-1])]
+
+
+def generate(n: int, profile: dict, seed=None, mutation: float = 0.1) -> (list[dict], list[dict], list[dict]):
+    """
+    Generates a data graph of `n` participants with the schema of the real one.
+
+    Out-degrees, popularity, counters and registration dates are bootstrapped from the real
+    participants, so the degree distributions keep their shape at any size. Answer vectors are
+    bootstrapped from the real complete ones, every answer is resampled from its field's
+    marginal distribution with probability `mutation`, and the answered-field patterns of late
+    joiners are reproduced.
+
+    :return: Participants, answers and fields as lists of dictionaries.
+    """
+    rng = np.random.default_rng(seed)
+
+    def bootstrap(key, size=n):
+        return rng.choice(profile[key], size=size)
+
+    out_degrees = np.minimum(bootstrap('subscription_lengths'), n - 1)
+    popularity = bootstrap('subscriber_lengths').astype(np.float64) + 1
+    subscription_keys = _sample_edges(rng, n, out_degrees, popularity)
+    view_keys = _sample_edges(rng, n, np.minimum(bootstrap('viewed_extra'), n - 1), popularity)
+    subscriptions = _edges(subscription_keys, n)
+    viewed = _edges(np.union1d(subscription_keys, view_keys), n)
+
+    subscription_ids = _group(subscriptions, n, 0)
+    subscriber_ids = _group(subscriptions, n, 1)
+    viewed_ids = _group(viewed, n, 0)
+
+    genders = np.where(rng.random(n) < profile['gender_female'], 'female', 'male')
+    roommate_ids = [[] for _ in range(n)]
+    for gender in ('male', 'female'):
+        members = rng.permutation(np.flatnonzero(genders == gender))
+        for room in np.array_split(members, -(-len(members) // 4)) if len(members) else []:
+            for member in room:
+                roommate_ids[member] = [int(other) + 1 for other in room if other != member]
+
+    created_at = bootstrap('created_at')
+    views_count = bootstrap('views')
+    subscriber_slack = bootstrap('subscriber_slack')
+    subscription_slack = bootstrap('subscription_slack')
+    viewed_slack = bootstrap('viewed_slack')
+    participants = [
+        {
+            'id': i + 1,
+            'created_at': int(created_at[i]),
+            'gender': str(genders[i]),
+            'subscriber_count': len(subscriber_ids[i]) + int(subscriber_slack[i]),
+            'subscriber_ids': subscriber_ids[i],
+            'subscription_count': len(subscription_ids[i]) + int(subscription_slack[i]),
+            'subscription_ids': subscription_ids[i],
+            'viewed_count': len(viewed_ids[i]) + int(viewed_slack[i]),
+            'viewed_ids': viewed_ids[i],
+            'views': int(views_count[i]),
+            'roommate_ids': roommate_ids[i],
+        }
+        for i in range(n)
+    ]
+
+    fields = profile['fields']
+    answers_matrix = profile['complete_answers'][rng.integers(len(profile['complete_answers']), size=n)]
+    for j, field in enumerate(fields):
+        frequencies = np.bincount(profile['complete_answers'][:, j], minlength=len(field['options']))
+        mutated = rng.random(n) < mutation
+        answers_matrix[mutated, j] = rng.choice(len(frequencies), size=mutated.sum(),
+                                                p=frequencies / frequencies.sum())
+    patterns = profile['answer_patterns'][rng.integers(len(profile['answer_patterns']), size=n)]
+
+    # Answers are listed field by field, like in the real dump
+    field_index, respondent_index = np.nonzero(patterns.T)
+    answers = [
+        {'field_id': fields[j]['id'], 'respondent_id': int(i) + 1, 'option': int(answers_matrix[i, j])}
+        for j, i in zip(field_index.tolist(), respondent_index.tolist())
+    ]
+    return participants, answers, fields
+
+
+def write_dataset(path: str, n: int, seed=None, profile: dict = None) -> str:
+    """Generates a data graph of `n` participants and writes the three json files into `path`."""
+    profile = load_profile() if profile is None else profile
+    participants, answers, fields = generate(n, profile, seed)
+    os.makedirs(path, exist_ok=True)
+    for name, records in (('participants', participants), ('answers', answers), ('fields', fields)):
+        with open(os.path.join(path, f'{name}.json'), 'w') as f:
+            json.dump(records, f)
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate a synthetic data graph with the schema of data/.')
+    parser.add_argument('size', type=int, help='Number of participants.')
+    parser.add_argument('output', help='Output directory.')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+    write_dataset(args.output, args.size, args.seed)
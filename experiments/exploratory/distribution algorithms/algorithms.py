@@ -1,5 +1,5 @@
-import copy
 import json
+import time
 from typing import Callable
 
 import communities
@@ -7,7 +7,9 @@ import networkx as nx
 import pandas as pd
 from communities.algorithms import louvain_method
 import numpy as np
+from scipy import sparse
 from datastructures import Room
+from similarity import knn_similarity_matrix
 
 
 def split_rooms(rooms: list[Room], num_male: int, num_female: int) -> (list[Room], list[Room]):
@@ -46,7 +48,7 @@ def split_rooms(rooms: list[Room], num_male: int, num_female: int) -> (list[Room
 
 def divide_by_rooms(info_df: pd.DataFrame, g: nx.Graph, rooms: list[Room], partition_algo=louvain_method, gender=None):
     """Assigns students to rooms based on room capacities and partitions."""
-    if np.sum(room.size() for room in rooms) < len(nx.nodes(g)):
+    if sum(room.size() for room in rooms) < len(nx.nodes(g)):
         print("impossible to distribute")
         return
     g_copy = nx.Graph(g)
@@ -92,15 +94,172 @@ def divide_by_rooms(info_df: pd.DataFrame, g: nx.Graph, rooms: list[Room], parti
                 it1 += 1
 
 
+def _louvain_level(adjacency: sparse.csr_matrix, rng: np.random.Generator, resolution: float) -> (np.ndarray, bool):
+    """
+    Moves every node to the neighbouring community with the largest modularity gain until no move helps.
+
+    :return: Community of every node, numbered from 0, and whether any node moved.
+    """
+    n_nodes = adjacency.shape[0]
+    degrees = np.asarray(adjacency.sum(axis=1)).ravel()
+    labels = np.arange(n_nodes)
+    community_degrees = degrees.copy()
+    total = degrees.sum()
+    if total == 0:
+        return labels, False
+
+    # the links between different nodes, self loops only count in the degrees
+    adjacency = adjacency.tolil()
+    adjacency.setdiag(0)
+    adjacency = adjacency.tocsr()
+    adjacency.eliminate_zeros()
+    indptr, indices, data = adjacency.indptr, adjacency.indices, adjacency.data
+    # weight of the links of the current node to every community, reset after every node
+    links = np.zeros(n_nodes)
+    improved = True
+    any_moved = False
+    while improved:
+        improved = False
+        for node in rng.permutation(n_nodes):
+            start, stop = indptr[node], indptr[node + 1]
+            candidates = labels[indices[start:stop]]
+            np.add.at(links, candidates, data[start:stop])
+            current = labels[node]
+            community_degrees[current] -= degrees[node]
+            stay = links[current] - resolution * community_degrees[current] * degrees[node] / total
+            best = current
+            if len(candidates):
+                gains = links[candidates] - resolution * community_degrees[candidates] * degrees[node] / total
+                if gains.max() > stay + 1e-12:
+                    best = candidates[np.argmax(gains)]
+                links[candidates] = 0
+            community_degrees[best] += degrees[node]
+            if best != current:
+                labels[node] = best
+                improved = any_moved = True
+    return np.unique(labels, return_inverse=True)[1], any_moved
+
+
+def sparse_louvain_method(adjacency: sparse.csr_matrix, n: int = None, seed=None,
+                          resolution: float = 1.0) -> (list[set], None):
+    """
+    Louvain partition of a sparse adjacency matrix, a drop-in replacement for `louvain_method`.
+
+    Works on the CSR arrays directly: every level moves nodes between communities with
+    `_louvain_level` and merges the communities into the nodes of the next level with one
+    sparse product, no networkx graph is built. The adjacency is expected to be symmetric,
+    its entries are the edge weights.
+
+    `n` is accepted for compatibility only, the number of communities is chosen by modularity.
+    """
+    rng = np.random.default_rng(seed)
+    adjacency = sparse.csr_matrix(adjacency, dtype=np.float64)
+    membership = np.arange(adjacency.shape[0])
+    while True:
+        labels, moved = _louvain_level(adjacency, rng, resolution)
+        if not moved:
+            break
+        membership = labels[membership]
+        merge = sparse.csr_matrix((np.ones(len(labels)), (np.arange(len(labels)), labels)))
+        adjacency = (merge.T @ adjacency @ merge).tocsr()
+    order = np.argsort(membership, kind='stable')
+    bounds = np.flatnonzero(np.diff(membership[order])) + 1
+    return [set(part.tolist()) for part in np.split(order, bounds)] if len(order) else [], None
+
+
+def _split_oversized(adjacency: sparse.csr_matrix, clusters: list[np.ndarray], max_size: int,
+                     partition_algo) -> list[np.ndarray]:
+    """Repartitions every cluster larger than `max_size` until all clusters fit, chunking unsplittable ones."""
+    result = []
+    stack = list(clusters)
+    while stack:
+        cluster = stack.pop()
+        if len(cluster) <= max_size:
+            result.append(cluster)
+            continue
+        parts = partition_algo(adjacency[cluster][:, cluster], None)[0]
+        if len(parts) > 1:
+            stack.extend(cluster[np.fromiter(part, dtype=np.int64)] for part in parts)
+        else:
+            result.extend(np.array_split(cluster, -(-len(cluster) // max_size)))
+    return result
+
+
+def divide_by_rooms_sparse(info_df: pd.DataFrame, g: nx.Graph, rooms: list[Room],
+                           partition_algo=sparse_louvain_method, gender=None) -> list[dict]:
+    """
+    Assigns students to rooms like `divide_by_rooms`, but keeps the graph as a CSR matrix.
+
+    The remaining students are tracked with a boolean mask, so every iteration only slices the
+    adjacency of the live nodes and hands it to `partition_algo` as a sparse matrix.
+    Clusters larger than the largest free room are partitioned again, so every iteration places someone.
+
+    :return: Per-iteration statistics: number of live nodes, number of placed nodes and the time
+        spent on partitioning and assignment.
+    """
+    if sum(room.size() for room in rooms) < len(nx.nodes(g)):
+        print("impossible to distribute")
+        return []
+    if gender is None:
+        nodes_female = info_df[info_df['gender'] == 'female']['id'].index.tolist()
+        nodes_male = info_df[info_df['gender'] == 'male']['id'].index.tolist()
+        rooms_male, rooms_female = split_rooms(rooms, len(nodes_male), len(nodes_female))
+
+        return (
+            divide_by_rooms_sparse(info_df, g.subgraph(nodes_female), rooms_female, partition_algo, 'female')
+            + divide_by_rooms_sparse(info_df, g.subgraph(nodes_male), rooms_male, partition_algo, 'male')
+        )
+
+    nodes = np.array(list(g.nodes))
+    adjacency = nx.to_scipy_sparse_array(g, nodelist=nodes.tolist(), format='csr')
+    live = np.ones(len(nodes), dtype=bool)
+    stats = []
+
+    while live.any():
+        start = time.perf_counter()
+        live_nodes = np.flatnonzero(live)
+        count_non_empty = sum(room.size() > 0 for room in rooms)
+        temp_parts = partition_algo(adjacency[live_nodes][:, live_nodes], count_non_empty)[0]
+        partition = [live_nodes[np.fromiter(cluster, dtype=np.int64)] for cluster in temp_parts]
+        max_size = max(room.size() for room in rooms)
+        partition = sorted(_split_oversized(adjacency, partition, max_size, partition_algo), key=len)
+        partition_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        rooms.sort()
+        placed = 0
+        it1 = len(rooms) - count_non_empty
+        it2 = 0
+        while it1 != len(rooms) and it2 != len(partition):
+            if len(partition[it2]) <= rooms[it1].size():
+                rooms[it1].student_ids.extend(nodes[partition[it2]].tolist())
+                live[partition[it2]] = False
+                placed += len(partition[it2])
+                it2 += 1
+            else:
+                it1 += 1
+
+        stats.append({
+            'gender': gender,
+            'live_nodes': len(live_nodes),
+            'placed': placed,
+            'partition_time': partition_time,
+            'assign_time': time.perf_counter() - start,
+        })
+    return stats
+
+
 def divide_by_rooms_randomly(g: nx.Graph, rooms: list[Room]):
-    g_copy = copy.deepcopy(g)
-    nodes = g_copy.nodes()
-    nodes = np.random.permutation(nodes)
+    """
+    Fills the rooms one after another with the nodes in random order, ignoring room types.
+    See `null_model` for many random assignments that respect room types.
+    """
+    nodes = np.random.permutation(list(g.nodes))
     i = 0
     for room in rooms:
-        while room.size() != 0:
-            room.student_ids.append(nodes[i])
-            i += 1
+        free = room.size()
+        room.student_ids.extend(nodes[i:i + free].tolist())
+        i += free
 
 
 def build_graph(info_df: pd.DataFrame) -> nx.Graph:
@@ -127,3 +286,16 @@ def build_graph_with_metric(info_df: pd.DataFrame, metric_function: Callable[[pd
             if i != j:
                 g.add_edge(j, i, weight=metric_matrix[j][i])
     return g
+
+
+def build_knn_graph(info_df: pd.DataFrame, k: int = 10, threshold: float = None, graph_weight: float = 0.7,
+                    content_weight: float = 0.3, max_hops: int = None, block_size: int = 256) -> nx.Graph:
+    """
+    Builds a sparse graph that connects every participant with its k most similar participants.
+
+    Unlike `build_graph_with_metric` the dense hybrid similarity matrix is never materialized,
+    it is computed in blocks of `block_size` rows and only the top-k entries of every row are kept.
+    Nodes are numbered like the rows of `info_df`, edges hold the similarity as `weight`.
+    """
+    knn = knn_similarity_matrix(info_df, k, threshold, graph_weight, content_weight, max_hops, block_size)
+    return nx.from_scipy_sparse_array(knn)
@@ -7,57 +7,48 @@ import pandas as pd
 
 from datastructures import Room
 from algorithms import build_graph
+import preprocess_data
+from scoring import RoomScorer
+from similarity import AnswerCodes, SimilarityService, content_similarity_matrix, graph_similarity_matrix
 
 
 def connections_inside_room(g: nx.Graph, rooms: list[Room]):
-    number_connections = [len(g.subgraph(room.student_ids).edges) for room in rooms]
-    return number_connections
+    """Number of edges of `g` between the students of every room, see `scoring.RoomScorer`."""
+    scorer = RoomScorer.from_graph(g, len(rooms))
+    return scorer.connections(scorer.labels(rooms)).tolist()
 
 
 def mean_room_satisfaction(g: nx.Graph, rooms: list[Room]):
-    number_connections = connections_inside_room(g, rooms)
-    room_satisfactions = []
-    for connection, room in zip(number_connections, rooms):
-        occupied_spaces = room.capacity - room.size()
-        max_num_connections = occupied_spaces * (occupied_spaces - 1)
-        if max_num_connections == 0:
-            room_satisfactions.append(1)
-        else:
-            room_satisfactions.append(connection / max_num_connections)
-    return np.mean(room_satisfactions)
-
-
-def get_content_similarity_matrix(df: pd.DataFrame) -> np.ndarray:
     """
-    Optimized function to calculate the content similarity matrix for all pairs of users.
-
-    :param df: DataFrame containing user data.
-    :return: A matrix where element [i][j] represents the similarity between user i and user j.
+    Mean over the rooms of the internal edges divided by the n * (n - 1) possible ones,
+    a room with at most one student is satisfied.
     """
-    unique_ids = df['id'].unique()
-    n_users = len(unique_ids)
-    similarity_matrix = np.zeros((n_users, n_users))
-
-    vectors = df.set_index('id')['option'].to_dict()
+    scorer = RoomScorer.from_graph(g, len(rooms))
+    occupancy = np.array([room.capacity - room.size() for room in rooms], dtype=np.int64)
+    return scorer.mean_satisfaction(scorer.labels(rooms), occupancy)
 
-    for i, id_i in enumerate(unique_ids):
-        for j, id_j in enumerate(unique_ids[i+1:], start=i+1):
-            vec_i = vectors[id_i]
-            vec_j = vectors[id_j]
 
-            max_len = max(len(vec_i), len(vec_j))
-            vec_i = np.pad(vec_i, (0, max_len - len(vec_i)), 'constant')
-            vec_j = np.pad(vec_j, (0, max_len - len(vec_j)), 'constant')
+def get_content_similarity_matrix(df: pd.DataFrame, block_size: int = 1024,
+                                  codes: AnswerCodes | None = None) -> np.ndarray:
+    """
+    Calculates the content similarity matrix for all pairs of users.
 
-            similarity = 1 - spatial.distance.cosine(vec_i, vec_j)
-            similarity_matrix[i, j] = similarity
-            similarity_matrix[j, i] = similarity
+    The answers are padded into one float32 matrix and compared with blocked matrix
+    multiplications, `block_size` users at a time. With `codes` the share of equal answers
+    is counted on packed one-hot codes instead.
 
-    return similarity_matrix
+    :param df: DataFrame containing user data.
+    :param block_size: Number of users compared per matrix multiplication.
+    :param codes: Codes of the answers, see `preprocess_data.get_answer_codes`.
+    :return: A matrix where element [i][j] represents the similarity between user i and user j.
+    """
+    return content_similarity_matrix(df, block_size, codes)
 
 
-def get_content_similarity(df: pd.DataFrame, user_id1: int, user_id2: int):
+def get_content_similarity(df: pd.DataFrame, user_id1: int, user_id2: int, service: SimilarityService = None):
     """Calculates the cosine similarity between two users' content."""
+    if service is not None:
+        return service.content_similarity(user_id1, user_id2)
     vec1 = df[df['id'] == user_id1]['option'].iloc[0]
     vec2 = df[df['id'] == user_id2]['option'].iloc[0]
 
@@ -70,31 +61,24 @@ def get_content_similarity(df: pd.DataFrame, user_id1: int, user_id2: int):
     return result
 
 
-def get_graph_similarity_matrix(df: pd.DataFrame) -> np.ndarray:
+def get_graph_similarity_matrix(df: pd.DataFrame, max_hops: int | None = None, as_sparse: bool = False):
     """
-    Calculates the distance matrix for all pairs of users in the graph.
+    Calculates the inverse-distance similarity matrix for all pairs of users in the graph.
+
+    The distances are found with a blocked BFS over the CSR adjacency of the subscription graph,
+    so no dict-of-dicts with every reachable pair is built.
 
     :param df: DataFrame containing user data.
-    :return: A matrix where element [i][j] represents the shortest distance between user i and user j.
+    :param max_hops: Users further than `max_hops` from each other get zero similarity.
+    :param as_sparse: Return a CSR matrix that stores only the reachable pairs.
+    :return: A matrix where element [i][j] is 1 / (d(i, j) + d(j, i)) for connected users i and j and 0 otherwise.
     """
-    naive_graph = build_graph(df)
-    spl = dict(nx.all_pairs_shortest_path_length(naive_graph))
-    unique_ids = df['id'].unique()
-    n_unique = len(unique_ids)
-    distance_matrix = np.full((n_unique, n_unique), 0)
-
-    for i, id_i in enumerate(unique_ids):
-        for j, id_j in enumerate(unique_ids[i + 1:], start=i + 1):
-            similarity = 0
-            if id_j in spl[id_i].keys():
-                similarity += spl[id_i][id_j]
-            if id_i in spl[id_j].keys():
-                similarity += spl[id_j][id_i]
-            distance_matrix[i, j] = 1 / similarity if similarity != 0 else 0
-    return distance_matrix
-
-
-def get_graph_similarity(df: pd.DataFrame, user_id1: int, user_id2: int):
+    return graph_similarity_matrix(df, max_hops, as_sparse=as_sparse)
+
+
+def get_graph_similarity(df: pd.DataFrame, user_id1: int, user_id2: int, service: SimilarityService = None):
+    if service is not None:
+        return service.graph_similarity(user_id1, user_id2)
     naive_graph = build_graph(df)
     spl = dict(nx.all_pairs_shortest_path_length(naive_graph))
     similarity = 0
@@ -109,7 +93,15 @@ def get_hybrid_similarity_matrix(df: pd.DataFrame) -> np.ndarray:
     return get_graph_similarity_matrix(df) * 0.7 + get_content_similarity_matrix(df) * 0.3
 
 
-def hybrid_similarity_score(df: pd.DataFrame, user_id1: int, user_id2: int):
+def hybrid_similarity_score(df: pd.DataFrame, user_id1: int, user_id2: int, service: SimilarityService = None):
+    """
+    Calculates the 0.7 graph / 0.3 content similarity of two users.
+
+    Pass a `SimilarityService` built from the same DataFrame to answer repeated queries
+    from precomputed matrices instead of rebuilding the graph every time.
+    """
+    if service is not None:
+        return service.pair(user_id1, user_id2, graph_weight=0.7, content_weight=0.3)
     similarity = 0
     similarity += get_content_similarity(df, user_id1, user_id2) * 0.3
     similarity += get_graph_similarity(df, user_id1, user_id2) * 0.7
@@ -117,12 +109,12 @@ def hybrid_similarity_score(df: pd.DataFrame, user_id1: int, user_id2: int):
 
 
 def edges_saved(g: nx.Graph, rooms: list[Room]):
-    number_connections = connections_inside_room(g, rooms)
-    return np.sum(number_connections) / len(g.edges)
+    """Share of the edges of `g` that are inside a room."""
+    scorer = RoomScorer.from_graph(g, len(rooms))
+    return scorer.edges_saved(scorer.labels(rooms))
 
 
 if __name__ == "__main__":
     path_to_data = os.path.join('..', '..', '..', 'data')
-    path_to_info_df = os.path.join(path_to_data, 'info_df.pkl')
-    info_df = pd.read_pickle(path_to_info_df)
+    info_df = preprocess_data.get_info_df(path_to_data)
     print(get_graph_similarity_matrix(info_df))
@@ -0,0 +1,75 @@
+import json
+import re
+from typing import Iterator, TextIO
+
+_SEPARATORS = re.compile(r'[\s,]*')
+
+
+def iter_json_array(f: TextIO, chunk_size: int = 1 << 16) -> Iterator[dict]:
+    """
+    Yields the objects of a top-level JSON array one by one.
+
+    The file is read in chunks of `chunk_size` characters and every object is decoded as soon
+    as it is complete, so only one chunk and one object are held in memory.
+
+    :param f: File opened in text mode that holds an array of objects.
+    :param chunk_size: Number of characters read at once.
+    :return: Iterator over the objects of the array.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    for chunk in iter(lambda: f.read(chunk_size), ''):
+        buffer = buffer[position:] + chunk
+        position = 0
+        while True:
+            position = _SEPARATORS.match(buffer, position).end()
+            if position == len(buffer):
+                break
+            if not started:
+                if buffer[position] != '[':
+                    raise ValueError('Expected a JSON array.')
+                started = True
+                position += 1
+                continue
+            if buffer[position] == ']':
+                return
+            try:
+                record, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                break  # the object continues in the next chunk
+            yield record
+    if buffer[position:].strip():
+        raise ValueError('Unexpected end of the JSON array.')
+
+
+def iter_ndjson(f: TextIO) -> Iterator[dict]:
+    """
+    Yields the objects of a newline-delimited JSON file, empty lines are skipped.
+
+    :param f: File opened in text mode with one object per line.
+    :return: Iterator over the objects.
+    """
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+
+def iter_records(path: str) -> Iterator[dict]:
+    """
+    Yields the records of a JSON array file or of a newline-delimited JSON file.
+
+    The format is detected by the first non-whitespace character: '[' starts an array.
+
+    :param path: Path of the file.
+    :return: Iterator over the records.
+    """
+    with open(path) as f:
+        while (char := f.read(1)).isspace():
+            pass
+        f.seek(0)
+        if char == '[':
+            yield from iter_json_array(f)
+        else:
+            yield from iter_ndjson(f)
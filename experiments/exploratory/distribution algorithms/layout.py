@@ -0,0 +1,108 @@
+import hashlib
+import os
+import tempfile
+from typing import NamedTuple
+
+import networkx as nx
+import numpy as np
+from scipy import sparse
+
+LAYOUT_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.layouts')
+LAYOUT_VERSION = 1
+
+
+class Layout(NamedTuple):
+    """Positions of the nodes of a graph and its edges as arrays of row indices."""
+    nodes: np.ndarray
+    positions: np.ndarray
+    sources: np.ndarray
+    targets: np.ndarray
+
+
+def graph_hash(g: nx.Graph) -> str:
+    """
+    Hashes the nodes and the edges of a graph, weights and attributes are ignored.
+
+    :param g: Graph to hash.
+    :return: Hex digest, equal for graphs with the same nodes in the same order and the same edges.
+    """
+    nodes = list(g.nodes)
+    adjacency = nx.to_scipy_sparse_array(g, nodelist=nodes, weight=None, format='csr')
+    adjacency.sort_indices()
+    digest = hashlib.sha256()
+    digest.update(repr((g.is_directed(), len(nodes))).encode())
+    node_array = np.asarray(nodes)
+    digest.update(node_array.tobytes() if node_array.dtype.kind in 'iuf' else repr(nodes).encode())
+    digest.update(adjacency.indptr.astype(np.int64).tobytes())
+    digest.update(adjacency.indices.astype(np.int64).tobytes())
+    return digest.hexdigest()
+
+
+def _edges(g: nx.Graph, nodes: list) -> (np.ndarray, np.ndarray):
+    adjacency = nx.to_scipy_sparse_array(g, nodelist=nodes, weight=None, format='csr')
+    if not g.is_directed():
+        adjacency = sparse.triu(adjacency, format='csr')
+    adjacency = adjacency.tocoo()
+    return adjacency.row.astype(np.int64), adjacency.col.astype(np.int64)
+
+
+def compute_layout(g: nx.Graph, seed: int = 0, iterations: int = 50) -> Layout:
+    """
+    Computes the spring layout of a graph, the rows of the positions follow `g.nodes`.
+
+    :param g: Graph to lay out.
+    :param seed: Seed of the initial positions, the same seed gives the same layout.
+    :param iterations: Number of iterations of the spring layout.
+    :return: The layout.
+    """
+    nodes = list(g.nodes)
+    pos = nx.spring_layout(g, seed=seed, iterations=iterations)
+    positions = np.array([pos[node] for node in nodes], dtype=np.float32).reshape(-1, 2)
+    return Layout(np.asarray(nodes), positions, *_edges(g, nodes))
+
+
+def cached_layout(g: nx.Graph, seed: int = 0, iterations: int = 50, cache_dir: str = None) -> Layout:
+    """
+    Returns the spring layout of a graph, computed once and cached on disk.
+
+    The cache file is keyed by `graph_hash` and the layout parameters, so a changed graph gets a
+    new layout and an unchanged one is only loaded. The file is written to a temporary place
+    and moved, so a reader never sees a half-written layout.
+
+    :param g: Graph to lay out.
+    :param seed: Seed of the initial positions.
+    :param iterations: Number of iterations of the spring layout.
+    :param cache_dir: Directory of the cached layouts, LAYOUT_CACHE by default.
+    :return: The layout.
+    """
+    cache_dir = cache_dir or LAYOUT_CACHE
+    key = f'{graph_hash(g)}-{seed}-{iterations}-v{LAYOUT_VERSION}'
+    path = os.path.join(cache_dir, f'{key}.npy')
+    nodes = list(g.nodes)
+    if os.path.exists(path):
+        return Layout(np.asarray(nodes), np.load(path), *_edges(g, nodes))
+
+    layout = compute_layout(g, seed, iterations)
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix='.npy')
+    with os.fdopen(fd, 'wb') as f:
+        np.save(f, layout.positions)
+    os.replace(tmp, path)
+    return layout
+
+
+def edge_coordinates(positions: np.ndarray, sources: np.ndarray, targets: np.ndarray) -> (np.ndarray, np.ndarray):
+    """
+    Builds the x and y arrays of line segments for a single plotly trace.
+
+    Every edge is its two end points followed by NaN, which breaks the line between edges.
+
+    :param positions: Positions of shape (n, 2).
+    :param sources: Row of the source of every edge.
+    :param targets: Row of the target of every edge.
+    :return: x and y arrays of length 3 * number of edges.
+    """
+    points = np.full((len(sources), 3, 2), np.nan, dtype=np.float32)
+    points[:, 0] = positions[sources]
+    points[:, 1] = positions[targets]
+    return points[:, :, 0].ravel(), points[:, :, 1].ravel()
@@ -0,0 +1,192 @@
+import time
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from algorithms import split_rooms
+from datastructures import Room
+
+
+def heavy_edge_matching(adjacency: sparse.csr_matrix, sizes: np.ndarray, max_size: int, rng: np.random.Generator,
+                        rounds: int = 3) -> np.ndarray:
+    """
+    Matches every node with its heaviest neighbour if both choose each other.
+
+    Pairs whose total size exceeds `max_size` are never matched. The handshake is repeated
+    `rounds` times for the nodes that are still unmatched.
+
+    :return: The coarse node of every node, coarse nodes are numbered contiguously.
+    """
+    n_nodes = adjacency.shape[0]
+    coo = adjacency.tocoo()
+    rows, cols = coo.row, coo.col
+    # A tiny jitter breaks ties between equal weights randomly
+    weights = coo.data + rng.random(len(coo.data)) * 1e-9
+    keep = (rows != cols) & (weights > 0) & (sizes[rows] + sizes[cols] <= max_size)
+    rows, cols, weights = rows[keep], cols[keep], weights[keep]
+
+    match = np.full(n_nodes, -1, dtype=np.int64)
+    for _ in range(rounds):
+        free = (match[rows] < 0) & (match[cols] < 0)
+        if not free.any():
+            break
+        rows, cols, weights = rows[free], cols[free], weights[free]
+        order = np.lexsort((-weights, rows))
+        heaviest = order[np.r_[True, rows[order][1:] != rows[order][:-1]]]
+
+        proposal = np.full(n_nodes, -1, dtype=np.int64)
+        proposal[rows[heaviest]] = cols[heaviest]
+        proposers = np.flatnonzero(proposal >= 0)
+        mutual = proposers[proposal[proposal[proposers]] == proposers]
+        match[mutual] = proposal[mutual]
+
+    leaders = np.where(match >= 0, np.minimum(match, np.arange(n_nodes)), np.arange(n_nodes))
+    return np.unique(leaders, return_inverse=True)[1]
+
+
+def coarsen(adjacency: sparse.csr_matrix, sizes: np.ndarray, coarse: np.ndarray) -> (sparse.csr_matrix, np.ndarray):
+    """Contracts the nodes with the same coarse id, the weights of parallel edges are summed."""
+    projection = sparse.csr_matrix(
+        (np.ones(len(coarse)), (np.arange(len(coarse)), coarse)), shape=(len(coarse), coarse.max(initial=-1) + 1)
+    )
+    coarse_adjacency = (projection.T @ adjacency @ projection).tocsr()
+    coarse_adjacency.setdiag(0)
+    coarse_adjacency.eliminate_zeros()
+    return coarse_adjacency, np.bincount(coarse, weights=sizes).astype(np.int64)
+
+
+def _room_affinity(adjacency: sparse.csr_matrix, labels: np.ndarray, node: int) -> (np.ndarray, np.ndarray):
+    """Returns the rooms of the neighbours of `node` and the total edge weight to each of them."""
+    start, stop = adjacency.indptr[node], adjacency.indptr[node + 1]
+    neighbour_rooms = labels[adjacency.indices[start:stop]]
+    placed = neighbour_rooms >= 0
+    rooms, inverse = np.unique(neighbour_rooms[placed], return_inverse=True)
+    return rooms, np.bincount(inverse, weights=adjacency.data[start:stop][placed], minlength=len(rooms))
+
+
+def pack(adjacency: sparse.csr_matrix, sizes: np.ndarray, labels: np.ndarray, free: np.ndarray) -> None:
+    """
+    Places every unplaced node (label -1) into a room, the largest nodes first.
+
+    A node goes to the room it is most connected to if that room has enough free places,
+    otherwise to the room with the smallest sufficient number of free places.
+    Nodes that fit nowhere keep the label -1.
+    """
+    buckets = [set() for _ in range(free.max(initial=0) + 1)]
+    for room, places in enumerate(free):
+        buckets[places].add(room)
+
+    unplaced = np.flatnonzero(labels < 0)
+    for node in unplaced[np.argsort(-sizes[unplaced], kind='stable')]:
+        size = sizes[node]
+        rooms, affinity = _room_affinity(adjacency, labels, node)
+        fits = free[rooms] >= size
+        if fits.any():
+            best = rooms[fits][np.argmax(affinity[fits])]
+        else:
+            best = next((next(iter(buckets[places])) for places in range(size, len(buckets)) if buckets[places]), -1)
+            if best < 0:
+                continue
+        buckets[free[best]].discard(best)
+        free[best] -= size
+        buckets[free[best]].add(best)
+        labels[node] = best
+
+
+def refine(adjacency: sparse.csr_matrix, sizes: np.ndarray, labels: np.ndarray, free: np.ndarray,
+           rng: np.random.Generator, passes: int = 2) -> int:
+    """
+    Greedily moves nodes to the room they are most connected to while it has enough free places.
+
+    :return: Number of moves made.
+    """
+    moves = 0
+    for _ in range(passes):
+        moved = 0
+        for node in rng.permutation(np.flatnonzero(labels >= 0)):
+            rooms, affinity = _room_affinity(adjacency, labels, node)
+            if not len(rooms):
+                continue
+            own = labels[node]
+            current = affinity[rooms == own].sum()
+            fits = (free[rooms] >= sizes[node]) & (rooms != own)
+            if not fits.any():
+                continue
+            target = np.argmax(np.where(fits, affinity, -np.inf))
+            if affinity[target] > current:
+                free[own] += sizes[node]
+                free[rooms[target]] -= sizes[node]
+                labels[node] = rooms[target]
+                moved += 1
+        moves += moved
+        if not moved:
+            break
+    return moves
+
+
+def divide_by_rooms_multilevel(info_df: pd.DataFrame, g: nx.Graph, rooms: list[Room], gender=None,
+                               coarsening_ratio: float = 0.95, refine_passes: int = 2, seed=None) -> list[dict]:
+    """
+    Assigns students to rooms by coarsening the graph, packing the coarse nodes and refining on the way up.
+
+    The graph is coarsened by heavy-edge matching until the matching stops shrinking it by at least
+    `1 - coarsening_ratio` or the number of coarse nodes reaches the number of rooms. Coarse nodes are
+    never larger than the largest room. Nodes that do not fit at a coarse level are packed again after
+    being projected to a finer level. Genders are split with `split_rooms` like in `divide_by_rooms`.
+
+    :return: Per-level statistics: number of nodes, moves made by the refinement and the time spent.
+    """
+    if sum(room.size() for room in rooms) < len(nx.nodes(g)):
+        print("impossible to distribute")
+        return []
+    if gender is None:
+        nodes_female = info_df[info_df['gender'] == 'female']['id'].index.tolist()
+        nodes_male = info_df[info_df['gender'] == 'male']['id'].index.tolist()
+        rooms_male, rooms_female = split_rooms(rooms, len(nodes_male), len(nodes_female))
+
+        return (
+            divide_by_rooms_multilevel(info_df, g.subgraph(nodes_female), rooms_female, 'female',
+                                       coarsening_ratio, refine_passes, seed)
+            + divide_by_rooms_multilevel(info_df, g.subgraph(nodes_male), rooms_male, 'male',
+                                         coarsening_ratio, refine_passes, seed)
+        )
+
+    rng = np.random.default_rng(seed)
+    nodes = list(g.nodes)
+    adjacency = nx.to_scipy_sparse_array(g, nodelist=nodes, format='csr').astype(np.float64)
+    if g.is_directed():
+        adjacency = (adjacency + adjacency.T).tocsr()
+    adjacency.setdiag(0)
+    adjacency.eliminate_zeros()
+    free = np.array([room.size() for room in rooms], dtype=np.int64)
+    max_size = free.max(initial=0)
+
+    start = time.perf_counter()
+    levels = [(adjacency, np.ones(len(nodes), dtype=np.int64))]
+    mappings = []
+    while levels[-1][0].shape[0] > len(rooms):
+        level_adjacency, level_sizes = levels[-1]
+        coarse = heavy_edge_matching(level_adjacency, level_sizes, max_size, rng)
+        if coarse.max(initial=-1) + 1 > coarsening_ratio * len(coarse):
+            break
+        levels.append(coarsen(level_adjacency, level_sizes, coarse))
+        mappings.append(coarse)
+    stats = [{'gender': gender, 'level': 'coarsening', 'nodes': len(nodes), 'moves': 0,
+              'time': time.perf_counter() - start}]
+
+    labels = np.full(levels[-1][0].shape[0], -1, dtype=np.int64)
+    for level in range(len(levels) - 1, -1, -1):
+        start = time.perf_counter()
+        level_adjacency, level_sizes = levels[level]
+        if level < len(levels) - 1:
+            labels = labels[mappings[level]]
+        pack(level_adjacency, level_sizes, labels, free)
+        moves = refine(level_adjacency, level_sizes, labels, free, rng, refine_passes)
+        stats.append({'gender': gender, 'level': level, 'nodes': len(labels), 'moves': moves,
+                      'time': time.perf_counter() - start})
+
+    for i, room in enumerate(rooms):
+        room.student_ids.extend(nodes[node] for node in np.flatnonzero(labels == i))
+    return stats
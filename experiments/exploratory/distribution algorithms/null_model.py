@@ -0,0 +1,169 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from datastructures import Room
+from refinement import GENDER_CODES, node_genders
+from scoring import RoomScorer
+
+
+def sample_assignments(capacities: np.ndarray, room_genders: np.ndarray, genders: np.ndarray, n_samples: int,
+                       rng: np.random.Generator) -> np.ndarray:
+    """
+    Draws random assignments of students to rooms that respect capacities and room types.
+
+    Male and female rooms only take students of their gender. Every sample gives its free rooms,
+    in random order, to the gender that still misses more places, so a free room never mixes
+    genders. The students of a gender then take random places of the rooms of their gender,
+    all samples at once: the places are ordered by random keys and the first ones are taken.
+    When the places of a gender run out, random students of it stay unassigned, like the
+    students the algorithms cannot place.
+
+    :param capacities: Capacity of every room.
+    :param room_genders: Gender code of every room, -1 for free rooms.
+    :param genders: Gender code of every student.
+    :param n_samples: Number of assignments.
+    :param rng: Random generator.
+    :return: Labels of shape (n_samples, number of students), the room of every student or -1.
+    """
+    capacities = np.asarray(capacities, dtype=np.int64)
+    room_genders = np.broadcast_to(np.asarray(room_genders, dtype=np.int64), (n_samples, len(capacities))).copy()
+    genders = np.asarray(genders, dtype=np.int64)
+
+    missing = np.stack([
+        np.full(n_samples, np.count_nonzero(genders == code) - capacities[room_genders[0] == code].sum())
+        for code in GENDER_CODES.values()
+    ])
+    free = np.flatnonzero(room_genders[0] < 0)
+    order = free[np.argsort(rng.random((n_samples, len(free))), axis=1)]
+    samples = np.arange(n_samples)
+    for column in order.T:
+        female = (missing[1] > missing[0]) | ((missing[1] == missing[0]) & (rng.random(n_samples) < 0.5))
+        room_genders[samples, column] = female
+        missing[female.astype(np.int64), samples] -= capacities[column]
+
+    places = np.repeat(np.arange(len(capacities)), capacities)
+    place_genders = room_genders[:, places]
+    labels = np.full((n_samples, len(genders)), -1, dtype=np.int64)
+    for code in GENDER_CODES.values():
+        students = np.flatnonzero(genders == code)
+        n_taken = min(len(students), len(places))
+        if not n_taken:
+            continue
+        keys = np.where(place_genders == code, rng.random(place_genders.shape), np.inf)
+        taken = np.argpartition(keys, n_taken - 1, axis=1)[:, :n_taken]
+        # infinite keys are places of the other gender, their students stay unassigned
+        rooms = np.where(np.isfinite(np.take_along_axis(keys, taken, axis=1)), places[taken], -1)
+        # the students in random order, so the unassigned ones are random too
+        order = students[np.argsort(rng.random((n_samples, len(students))), axis=1)[:, :n_taken]]
+        labels[samples[:, None], order] = rooms
+    return labels
+
+
+def _sample_and_score(args) -> (np.ndarray, np.ndarray):
+    sources, targets, n_nodes, capacities, room_genders, genders, seed, n_samples, batch_size = args
+    # the edges are already deduplicated, every one of them is counted once
+    adjacency = sparse.coo_matrix((np.ones(len(sources)), (sources, targets)), shape=(n_nodes, n_nodes))
+    scorer = RoomScorer(adjacency, len(capacities), directed=True)
+    rng = np.random.default_rng(seed)
+    satisfaction, edges_saved = [], []
+    for start in range(0, n_samples, batch_size):
+        labels = sample_assignments(capacities, room_genders, genders, min(batch_size, n_samples - start), rng)
+        connections = scorer.connections(labels)
+        satisfaction.append(scorer.satisfaction(labels, connections=connections).mean(axis=1))
+        edges_saved.append(scorer.edges_saved(labels, connections))
+    return np.concatenate(satisfaction), np.concatenate(edges_saved)
+
+
+class NullDistribution:
+    """
+    Scores of random assignments that an algorithm result is compared against.
+
+    :param satisfaction: Mean room satisfaction of every sampled assignment.
+    :param edges_saved: Share of the edges inside a room of every sampled assignment.
+    """
+
+    def __init__(self, satisfaction: np.ndarray, edges_saved: np.ndarray):
+        self.satisfaction = satisfaction
+        self.edges_saved = edges_saved
+
+    def __len__(self):
+        return len(self.satisfaction)
+
+    def percentiles(self, q=(1, 5, 25, 50, 75, 95, 99)) -> dict:
+        """Returns the percentiles of both scores, {'satisfaction': {q: value}, 'edges_saved': {q: value}}."""
+        return {
+            name: dict(zip(q, np.percentile(values, q).tolist()))
+            for name, values in (('satisfaction', self.satisfaction), ('edges_saved', self.edges_saved))
+        }
+
+    def p_values(self, satisfaction: float, edges_saved: float) -> dict:
+        """
+        Returns the share of random assignments that score at least as well as the result.
+
+        The counts get +1 in the numerator and denominator, so a p-value is never 0.
+        """
+        return {
+            'satisfaction': float((np.count_nonzero(self.satisfaction >= satisfaction) + 1) / (len(self) + 1)),
+            'edges_saved': float((np.count_nonzero(self.edges_saved >= edges_saved) + 1) / (len(self) + 1)),
+        }
+
+    def compare(self, g: nx.Graph, rooms: list[Room]) -> dict:
+        """Scores an assignment and returns its scores, their z-scores and p-values against the null."""
+        scorer = RoomScorer.from_graph(g, len(rooms))
+        labels = scorer.labels(rooms)
+        occupancy = np.array([room.capacity - room.size() for room in rooms], dtype=np.int64)
+        scores = {
+            'satisfaction': float(scorer.mean_satisfaction(labels, occupancy)),
+            'edges_saved': float(scorer.edges_saved(labels)),
+        }
+        z_scores = {
+            name: float((scores[name] - values.mean()) / values.std()) if values.std() > 0 else float('nan')
+            for name, values in (('satisfaction', self.satisfaction), ('edges_saved', self.edges_saved))
+        }
+        return {'scores': scores, 'z_scores': z_scores, 'p_values': self.p_values(**scores)}
+
+
+def null_distribution(info_df: pd.DataFrame, g: nx.Graph, rooms: list[Room], n_samples: int = 10000,
+                      batch_size: int = 500, n_workers: int = None, seed=None,
+                      node_key: str = 'id') -> NullDistribution:
+    """
+    Samples the null distribution of random capacity- and gender-respecting room assignments.
+
+    The samples are drawn and scored in batches of `batch_size` label arrays, the batches are
+    split over `n_workers` processes with independent random streams.
+
+    :param info_df: DataFrame containing user data.
+    :param g: Graph the assignments are scored on, its nodes are the students.
+    :param rooms: Rooms with their capacity and `room_type`, their students are ignored.
+    :param n_samples: Number of random assignments.
+    :param batch_size: Number of assignments sampled and scored at once.
+    :param n_workers: Number of processes, all CPUs by default.
+    :param seed: Seed of the random streams.
+    :param node_key: How the nodes of `g` are looked up in `info_df`, see `refinement.node_genders`.
+    :return: The scores of the random assignments.
+    """
+    nodes = list(g.nodes)
+    scorer = RoomScorer.from_graph(g, len(rooms))
+    capacities = np.array([room.capacity for room in rooms], dtype=np.int64)
+    room_genders = np.array([GENDER_CODES.get(room.room_type, -1) for room in rooms], dtype=np.int64)
+    genders = node_genders(info_df, nodes, node_key)
+
+    n_workers = max(1, min(n_workers or os.cpu_count() or 1, -(-n_samples // batch_size)))
+    chunks = [len(chunk) for chunk in np.array_split(np.arange(n_samples), n_workers)]
+    seeds = np.random.SeedSequence(seed).spawn(n_workers)
+    tasks = [
+        (scorer.sources, scorer.targets, scorer.n_nodes, capacities, room_genders, genders, seeds[i],
+         chunks[i], batch_size)
+        for i in range(n_workers)
+    ]
+    if n_workers == 1:
+        results = [_sample_and_score(tasks[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            results = list(executor.map(_sample_and_score, tasks))
+    return NullDistribution(np.concatenate([r[0] for r in results]), np.concatenate([r[1] for r in results]))
@@ -1,9 +1,24 @@
 import os
 
+import numpy as np
 import pandas as pd
 
+from similarity import AnswerCodes, build_answer_codes
+from snapshot import compile_snapshot, load_snapshot
+
+
+def get_info_df(data_path, use_snapshot=True):
+    """
+    Merges the participants with the list of their answers.
+
+    :param data_path: Directory with participants.json, answers.json and fields.json.
+    :param use_snapshot: Read the memory-mapped snapshot of the data graph instead of parsing the JSON files,
+        the snapshot is compiled on the first call and whenever the files change.
+    :return: DataFrame with a row per participant that answered at least one question.
+    """
+    if use_snapshot:
+        return load_snapshot(data_path).info_df()
 
-def get_info_df(data_path):
     path_to_participants = os.path.join(data_path, 'participants.json')
     path_to_answers = os.path.join(data_path, 'answers.json')
 
@@ -14,8 +29,21 @@ def get_info_df(data_path):
     return pd.merge(df1, df2)
 
 
+def get_answer_codes(data_path) -> AnswerCodes:
+    """
+    Returns the packed one-hot codes of the answers of every respondent, see `similarity.build_answer_codes`.
+
+    The codes are built from the answer matrix of the snapshot, where a missing answer keeps its field.
+
+    :param data_path: Directory with participants.json, answers.json and fields.json.
+    :return: The respondent ids with their codes.
+    """
+    snapshot = load_snapshot(data_path)
+    options = {field['id']: len(field['options']) for field in snapshot.fields}
+    n_options = [options[field_id] for field_id in np.asarray(snapshot['field_ids']).tolist()]
+    return build_answer_codes(np.asarray(snapshot['respondent_ids']), np.asarray(snapshot['answers']), n_options)
+
+
 if __name__ == "__main__":
     path_to_data = os.path.join('..', '..', '..', 'data')
-    path_to_info_df = os.path.join(path_to_data, 'info_df.pkl')
-    df = get_info_df(path_to_data)
-    df.to_pickle(path_to_info_df)
+    print(compile_snapshot(path_to_data))
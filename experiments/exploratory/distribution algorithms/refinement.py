@@ -0,0 +1,222 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+
+from datastructures import Room
+
+GENDER_CODES = {'male': 0, 'female': 1}
+
+
+def node_genders(info_df: pd.DataFrame, nodes: list, node_key: str = 'id') -> np.ndarray:
+    """
+    Looks up the gender code of every node of a graph.
+
+    :param info_df: DataFrame containing user data.
+    :param nodes: Nodes of the graph.
+    :param node_key: 'id' if the nodes are user ids like in `algorithms.build_graph`, 'position' if
+        they are row positions of `info_df` like in `algorithms.build_graph_with_metric`.
+    :return: int64 codes of GENDER_CODES.
+    :raises ValueError: If a node is not in `info_df` or its gender is not in GENDER_CODES.
+    """
+    if node_key == 'id':
+        genders = info_df.set_index('id')['gender']
+    elif node_key == 'position':
+        genders = info_df['gender'].reset_index(drop=True)
+    else:
+        raise ValueError(f"node_key must be 'id' or 'position', not {node_key!r}")
+    codes = genders.reindex(nodes).map(GENDER_CODES)
+    unknown = codes.isna().to_numpy()
+    if unknown.any():
+        raise ValueError(f'Unknown gender of {unknown.sum()} nodes, e.g. {np.asarray(nodes)[unknown][:5].tolist()}')
+    return codes.to_numpy(dtype=np.int64)
+
+
+def _room_satisfaction(connections: float, occupied: int) -> float:
+    """Satisfaction of one room as defined by `evaluation.mean_room_satisfaction`."""
+    if occupied <= 1:
+        return 1
+    return connections / (occupied * (occupied - 1))
+
+
+class _LocalSearch:
+    """
+    Incremental state of one room assignment.
+
+    Every student keeps the label of its room, every room keeps its number of internal
+    connections, occupancy and gender counts, so a move or a swap is scored in O(degree).
+    """
+
+    def __init__(self, indptr, indices, weights, labels, capacities, room_genders, genders, seed):
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+        self.labels = labels.copy()
+        self.capacities = capacities
+        self.room_genders = room_genders
+        self.genders = genders
+        self.rng = np.random.default_rng(seed)
+
+        n_rooms = len(capacities)
+        assigned = self.labels >= 0
+        self.occupied = np.bincount(self.labels[assigned], minlength=n_rooms)
+        self.gender_counts = np.zeros((n_rooms, 2), dtype=np.int64)
+        np.add.at(self.gender_counts, (self.labels[assigned], genders[assigned]), 1)
+        self.connections = np.zeros(n_rooms)
+        for student in np.flatnonzero(assigned):
+            self.connections[self.labels[student]] += self._links(student, self.labels[student]) / 2
+        self.students = np.flatnonzero(assigned)
+        self.score = self._total()
+
+    def _total(self) -> float:
+        return float(np.mean([_room_satisfaction(c, o) for c, o in zip(self.connections, self.occupied)]))
+
+    def _links(self, student: int, room: int) -> float:
+        start, stop = self.indptr[student], self.indptr[student + 1]
+        return self.weights[start:stop][self.labels[self.indices[start:stop]] == room].sum()
+
+    def _link(self, student: int, other: int) -> float:
+        start, stop = self.indptr[student], self.indptr[student + 1]
+        return self.weights[start:stop][self.indices[start:stop] == other].sum()
+
+    def _accepts(self, room: int, gender: int) -> bool:
+        if self.occupied[room] >= self.capacities[room]:
+            return False
+        if self.room_genders[room] >= 0:
+            return self.room_genders[room] == gender
+        return self.gender_counts[room, 1 - gender] == 0
+
+    def try_move(self, student: int, target: int) -> bool:
+        source = self.labels[student]
+        if source == target or not self._accepts(target, self.genders[student]):
+            return False
+        new_source = self.connections[source] - self._links(student, source)
+        new_target = self.connections[target] + self._links(student, target)
+        delta = (
+            _room_satisfaction(new_source, self.occupied[source] - 1)
+            - _room_satisfaction(self.connections[source], self.occupied[source])
+            + _room_satisfaction(new_target, self.occupied[target] + 1)
+            - _room_satisfaction(self.connections[target], self.occupied[target])
+        ) / len(self.capacities)
+        if delta <= 0:
+            return False
+
+        gender = self.genders[student]
+        self.connections[source], self.connections[target] = new_source, new_target
+        self.occupied[source] -= 1
+        self.occupied[target] += 1
+        self.gender_counts[source, gender] -= 1
+        self.gender_counts[target, gender] += 1
+        self.labels[student] = target
+        self.score += delta
+        return True
+
+    def try_swap(self, first: int, second: int, force: bool = False) -> bool:
+        room_a, room_b = self.labels[first], self.labels[second]
+        if room_a == room_b or self.genders[first] != self.genders[second]:
+            return False
+        link = self._link(first, second)
+        new_a = self.connections[room_a] - self._links(first, room_a) + self._links(second, room_a) - link
+        new_b = self.connections[room_b] - self._links(second, room_b) + self._links(first, room_b) - link
+        delta = (
+            _room_satisfaction(new_a, self.occupied[room_a])
+            - _room_satisfaction(self.connections[room_a], self.occupied[room_a])
+            + _room_satisfaction(new_b, self.occupied[room_b])
+            - _room_satisfaction(self.connections[room_b], self.occupied[room_b])
+        ) / len(self.capacities)
+        if delta <= 0 and not force:
+            return False
+
+        self.connections[room_a], self.connections[room_b] = new_a, new_b
+        self.labels[first], self.labels[second] = room_b, room_a
+        self.score += delta
+        return True
+
+    def perturb(self, n_swaps: int) -> None:
+        if not len(self.students):
+            return
+        for _ in range(n_swaps):
+            first, second = self.rng.choice(self.students, 2)
+            self.try_swap(first, second, force=True)
+
+    def run(self, deadline: float, swap_probability: float = 0.5) -> None:
+        if not len(self.students):
+            return
+        n_rooms = len(self.capacities)
+        while time.time() < deadline:
+            for _ in range(256):
+                student = self.students[self.rng.integers(len(self.students))]
+                if self.rng.random() < swap_probability:
+                    self.try_swap(student, self.students[self.rng.integers(len(self.students))])
+                else:
+                    self.try_move(student, self.rng.integers(n_rooms))
+
+
+def _restart(args) -> (float, np.ndarray):
+    indptr, indices, weights, labels, capacities, room_genders, genders, seed, deadline, perturbation = args
+    search = _LocalSearch(indptr, indices, weights, labels, capacities, room_genders, genders, seed)
+    search.perturb(perturbation)
+    search.run(deadline)
+    return search.score, search.labels
+
+
+def refine_rooms(info_df: pd.DataFrame, g: nx.Graph, rooms: list[Room], time_budget: float = 5.0,
+                 n_restarts: int = None, perturbation: float = 0.05, weight: str = None, seed=None,
+                 node_key: str = 'id') -> float:
+    """
+    Improves an assignment of students to rooms by moving and swapping students between rooms.
+
+    Moves respect room capacities and `room_type`, a free room never mixes genders.
+    Each move is scored incrementally in O(degree) against `g`. The search runs until `time_budget`
+    seconds of wall-clock time have passed, in `n_restarts` parallel processes, at most one per CPU.
+    Every restart but the first starts from the given assignment perturbed by
+    `perturbation * number of students` random swaps.
+    `rooms` is updated in place with the best assignment found. The genders of the students are
+    looked up by `node_key`, see `node_genders`.
+
+    :return: Mean room satisfaction of the best assignment.
+    """
+    nodes = list(g.nodes)
+    positions = {node: i for i, node in enumerate(nodes)}
+    adjacency = nx.to_scipy_sparse_array(g, nodelist=nodes, weight=weight, format='csr')
+    if g.is_directed():
+        adjacency = adjacency + adjacency.T
+    adjacency.setdiag(0)
+    adjacency.eliminate_zeros()
+
+    labels = np.full(len(nodes), -1, dtype=np.int64)
+    for i, room in enumerate(rooms):
+        labels[[positions[student] for student in room.student_ids]] = i
+    capacities = np.array([room.capacity for room in rooms])
+    room_genders = np.array([GENDER_CODES.get(room.room_type, -1) for room in rooms])
+    genders = node_genders(info_df, nodes, node_key)
+    weights = adjacency.data.astype(np.float64)
+    if not np.any(labels >= 0):
+        # no student to move, the given assignment is the only one
+        return _LocalSearch(adjacency.indptr, adjacency.indices, weights, labels, capacities,
+                            room_genders, genders, seed).score
+
+    # the restarts share one deadline, the wall clock is comparable across processes
+    deadline = time.time() + time_budget
+    n_workers = os.cpu_count() or 1
+    n_restarts = min(n_restarts or n_workers, n_workers)
+    seeds = np.random.SeedSequence(seed).spawn(n_restarts)
+    n_swaps = int(perturbation * np.count_nonzero(labels >= 0))
+    tasks = [
+        (adjacency.indptr, adjacency.indices, weights, labels, capacities,
+         room_genders, genders, seeds[i], deadline, 0 if i == 0 else n_swaps)
+        for i in range(n_restarts)
+    ]
+    if n_restarts == 1:
+        results = [_restart(tasks[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=n_restarts) as executor:
+            results = list(executor.map(_restart, tasks))
+
+    best_score, best_labels = max(results, key=lambda result: result[0])
+    for i, room in enumerate(rooms):
+        room.student_ids = [nodes[student] for student in np.flatnonzero(best_labels == i)]
+    return best_score
@@ -0,0 +1,119 @@
+import networkx as nx
+import numpy as np
+from scipy import sparse
+
+from datastructures import Room
+
+
+class RoomScorer:
+    """
+    Scores room assignments given as label arrays with vectorized sparse operations.
+
+    An assignment is an array with the room of every node, -1 for unassigned nodes, and a batch
+    is a 2-D array with one assignment per row. The edges are kept as two arrays (sources,
+    targets), so the internal edges of every room of every assignment in a batch are counted
+    with one comparison and one `bincount`, no subgraph is built.
+
+    The scores are the ones of `evaluation`: the satisfaction of a room with n occupants is
+    its internal edges divided by n * (n - 1), or 1 if n <= 1, and the edges saved are the
+    internal edges of all rooms divided by the number of edges.
+
+    :param adjacency: Sparse adjacency matrix, nonzero entries are edges.
+    :param n_rooms: Number of rooms, labels are in range(n_rooms).
+    :param directed: Count every nonzero entry as an edge. Otherwise the adjacency is symmetric
+        and every edge is counted once, like the edges of an undirected `nx.Graph`.
+    :param nodes: The node of every row of the adjacency, used to convert lists of rooms into labels.
+    """
+
+    def __init__(self, adjacency: sparse.spmatrix, n_rooms: int, directed: bool = False, nodes=None):
+        # duplicate entries of one edge are merged first
+        adjacency = sparse.csr_matrix(adjacency).tocoo()
+        if not directed:
+            adjacency = sparse.triu(adjacency, format='coo')
+        keep = adjacency.data != 0
+        self.sources = adjacency.row[keep].astype(np.int64)
+        self.targets = adjacency.col[keep].astype(np.int64)
+        self.n_nodes = adjacency.shape[0]
+        self.n_edges = len(self.sources)
+        self.n_rooms = n_rooms
+        self.nodes = np.asarray(nodes if nodes is not None else np.arange(self.n_nodes))
+        self._order = np.argsort(self.nodes, kind='stable')
+
+    @classmethod
+    def from_graph(cls, g: nx.Graph, n_rooms: int) -> 'RoomScorer':
+        """Creates the scorer of the edges of a networkx graph, the rows follow `g.nodes`."""
+        nodes = list(g.nodes)
+        adjacency = nx.to_scipy_sparse_array(g, nodelist=nodes, weight=None, format='csr')
+        return cls(adjacency, n_rooms, g.is_directed(), nodes)
+
+    def labels(self, rooms: list[Room]) -> np.ndarray:
+        """Returns the label array of a list of rooms, students that are not nodes are skipped."""
+        labels = np.full(self.n_nodes, -1, dtype=np.int64)
+        if not len(self.nodes):
+            return labels
+        for i, room in enumerate(rooms):
+            students = np.asarray(room.student_ids)
+            found = np.minimum(np.searchsorted(self.nodes[self._order], students), self.n_nodes - 1)
+            positions = self._order[found]
+            labels[positions[self.nodes[positions] == students]] = i
+        return labels
+
+    def _batches(self, labels: np.ndarray, batch_size: int | None):
+        labels = np.asarray(labels, dtype=np.int64)
+        batch_size = batch_size or max(1, 2 ** 24 // max(self.n_edges, 1))
+        for start in range(0, len(labels), batch_size):
+            yield labels[start:start + batch_size]
+
+    def connections(self, labels: np.ndarray, batch_size: int = None) -> np.ndarray:
+        """
+        Counts the edges inside every room.
+
+        :param labels: Assignment of shape (n_nodes,) or a batch of shape (b, n_nodes).
+        :param batch_size: Number of assignments compared at once, bounds the memory to batch_size * n_edges.
+        :return: int64 counts of shape (n_rooms,) or (b, n_rooms).
+        """
+        batch = np.atleast_2d(labels)
+        counts = []
+        for block in self._batches(batch, batch_size):
+            source_rooms = block[:, self.sources]
+            inside = (source_rooms == block[:, self.targets]) & (source_rooms >= 0)
+            layouts = np.broadcast_to(np.arange(len(block))[:, None], inside.shape)
+            flat = np.bincount(layouts[inside] * self.n_rooms + source_rooms[inside],
+                               minlength=len(block) * self.n_rooms)
+            counts.append(flat.reshape(len(block), self.n_rooms))
+        counts = np.concatenate(counts) if counts else np.zeros((0, self.n_rooms), dtype=np.int64)
+        return counts[0] if np.ndim(labels) == 1 else counts
+
+    def occupancy(self, labels: np.ndarray) -> np.ndarray:
+        """Number of nodes in every room, of shape (n_rooms,) or (b, n_rooms)."""
+        batch = np.atleast_2d(np.asarray(labels, dtype=np.int64))
+        layouts = np.broadcast_to(np.arange(len(batch))[:, None], batch.shape)
+        assigned = batch >= 0
+        occupancy = np.bincount(layouts[assigned] * self.n_rooms + batch[assigned],
+                                minlength=len(batch) * self.n_rooms).reshape(len(batch), self.n_rooms)
+        return occupancy[0] if np.ndim(labels) == 1 else occupancy
+
+    def satisfaction(self, labels: np.ndarray, occupancy: np.ndarray = None,
+                     connections: np.ndarray = None) -> np.ndarray:
+        """
+        Satisfaction of every room.
+
+        :param labels: Assignment or batch of assignments.
+        :param occupancy: Number of occupants of every room, by default the nodes with its label.
+        :param connections: Precomputed `connections(labels)`.
+        :return: float64 satisfactions of shape (n_rooms,) or (b, n_rooms).
+        """
+        connections = self.connections(labels) if connections is None else connections
+        occupancy = self.occupancy(labels) if occupancy is None else np.asarray(occupancy)
+        pairs = occupancy * (occupancy - 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(pairs > 0, connections / pairs, 1.0)
+
+    def mean_satisfaction(self, labels: np.ndarray, occupancy: np.ndarray = None) -> np.ndarray | float:
+        """Mean room satisfaction of an assignment (float) or of every assignment of a batch."""
+        return self.satisfaction(labels, occupancy).mean(axis=-1)
+
+    def edges_saved(self, labels: np.ndarray, connections: np.ndarray = None) -> np.ndarray | float:
+        """Share of the edges that are inside a room, of an assignment (float) or of every assignment of a batch."""
+        connections = self.connections(labels) if connections is None else connections
+        return connections.sum(axis=-1) / self.n_edges
@@ -0,0 +1,491 @@
+from typing import Iterator, NamedTuple
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+# Number of set bits of every byte value
+POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1, dtype=np.uint8)
+
+
+def build_answer_matrix(df: pd.DataFrame, dtype=np.float32, fill_value=0) -> np.ndarray:
+    """
+    Stacks the answers of all users into one padded matrix.
+
+    :param df: DataFrame containing user data.
+    :param dtype: Data type of the resulting matrix.
+    :param fill_value: Value of the missing answers at the end of the shorter rows.
+    :return: A matrix where row i holds the answers of the i-th unique user id, padded with `fill_value`.
+    """
+    unique_ids = df['id'].unique()
+    vectors = df.set_index('id')['option'].to_dict()
+    answers = [vectors[user_id] for user_id in unique_ids]
+
+    lengths = np.fromiter((len(answer) for answer in answers), dtype=np.int64, count=len(answers))
+    matrix = np.full((len(answers), lengths.max(initial=0)), fill_value, dtype=dtype)
+    if matrix.size:
+        filled = np.arange(matrix.shape[1]) < lengths[:, None]
+        matrix[filled] = np.concatenate(answers)
+    return matrix
+
+
+class AnswerCodes(NamedTuple):
+    """Packed one-hot codes of the answers, see `build_answer_codes`."""
+    ids: np.ndarray
+    codes: np.ndarray
+    n_fields: int
+
+
+def build_answer_codes(ids: np.ndarray, answers: np.ndarray, n_options: list[int]) -> AnswerCodes:
+    """
+    One-hot encodes the answers of all users into packed bit vectors.
+
+    Every field gets one bit per option and a user sets the bit of the option it chose, so the
+    options are compared as categories and a user takes `ceil(sum(n_options) / 8)` bytes.
+    A field the user did not answer sets no bit.
+
+    :param ids: The id of every user.
+    :param answers: The chosen option of every user (row) and field (column), -1 if it is missing.
+    :param n_options: Number of options of every field.
+    :return: The ids with the uint8 code of every user.
+    """
+    answers = np.asarray(answers, dtype=np.int64)
+    n_options = np.asarray(n_options, dtype=np.int64)
+    if answers.shape[1] != len(n_options) or (answers >= n_options).any():
+        raise ValueError('The answers do not fit the options of the fields.')
+    offsets = np.concatenate([[0], np.cumsum(n_options)[:-1]])
+
+    bits = np.zeros((len(answers), -(-n_options.sum() // 8) * 8), dtype=np.uint8)
+    rows, fields = np.nonzero(answers >= 0)
+    bits[rows, offsets[fields] + answers[rows, fields]] = 1
+    return AnswerCodes(np.asarray(ids), np.packbits(bits, axis=1), len(n_options))
+
+
+def iter_hamming_similarity_blocks(codes: np.ndarray, n_fields: int,
+                                   block_size: int = 1024) -> Iterator[tuple[int, int, np.ndarray]]:
+    """
+    Yields the upper block-triangle of the share of equal answers between the one-hot codes.
+
+    Two users chose the same option of a field exactly when both codes have its bit set, so the
+    number of equal answers is the popcount of `a & b`. It is counted byte by byte with a lookup
+    table, keeping the memory overhead at `block_size * n` bytes.
+
+    :param codes: Packed one-hot codes, one user per row.
+    :param n_fields: Number of fields, the share is the number of equal answers divided by it.
+    :param block_size: Number of rows compared at once.
+    :return: Tuples (start, stop, block) where block[k, j] is the similarity between rows start + k and start + j.
+    """
+    if block_size < 1:
+        raise ValueError("block_size must be positive.")
+    for start in range(0, len(codes), block_size):
+        stop = min(start + block_size, len(codes))
+        matches = np.zeros((stop - start, len(codes) - start), dtype=np.uint16)
+        for byte in range(codes.shape[1]):
+            matches += POPCOUNT[codes[start:stop, byte, None] & codes[None, start:, byte]]
+        yield start, stop, matches.astype(np.float32) / max(n_fields, 1)
+
+
+def iter_cosine_similarity_blocks(matrix: np.ndarray, block_size: int = 1024) -> Iterator[tuple[int, int, np.ndarray]]:
+    """
+    Yields the upper block-triangle of the cosine similarity matrix of the rows of `matrix`.
+
+    Only `block_size` rows are multiplied at a time, so the memory overhead stays at
+    `block_size * n` values regardless of the number of users.
+
+    :param matrix: Matrix where every row is a user vector.
+    :param block_size: Number of rows compared per matrix multiplication.
+    :return: Tuples (start, stop, block) where block[k, j] is the similarity between rows start + k and start + j.
+    """
+    if block_size < 1:
+        raise ValueError("block_size must be positive.")
+    norms = np.linalg.norm(matrix, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Zero vectors have no direction, scipy reports nan for them as well
+        normalized = matrix / norms[:, None]
+
+    for start in range(0, len(matrix), block_size):
+        stop = min(start + block_size, len(matrix))
+        block = normalized[start:stop] @ normalized[start:].T
+        np.clip(block, -1, 1, out=block)
+        yield start, stop, block
+
+
+def content_similarity_matrix(df: pd.DataFrame, block_size: int = 1024,
+                              codes: AnswerCodes | None = None) -> np.ndarray:
+    """
+    Calculates the cosine similarity between the answers of all pairs of users.
+
+    With `codes` the answers are treated as categories instead: the similarity is the share
+    of fields both users answered with the same option, counted on the packed one-hot codes.
+
+    :param df: DataFrame containing user data.
+    :param block_size: Number of users compared per matrix multiplication.
+    :param codes: Codes of the users of `df`, see `preprocess_data.get_answer_codes`.
+    :return: A float32 matrix where element [i][j] represents the similarity between user i and user j.
+    """
+    if codes is None:
+        matrix = build_answer_matrix(df)
+        blocks = iter_cosine_similarity_blocks(matrix, block_size)
+    else:
+        matrix = codes.codes[id_positions(codes.ids, df['id'].unique())]
+        blocks = iter_hamming_similarity_blocks(matrix, codes.n_fields, block_size)
+    similarity_matrix = np.empty((len(matrix), len(matrix)), dtype=np.float32)
+
+    for start, stop, block in blocks:
+        similarity_matrix[start:stop, start:] = block
+        similarity_matrix[start:, start:stop] = block.T
+    np.fill_diagonal(similarity_matrix, 0)
+    return similarity_matrix
+
+
+def id_positions(ids: np.ndarray, user_ids, order: np.ndarray | None = None) -> np.ndarray:
+    """
+    Returns the positions of `user_ids` in `ids` with one binary search over the sorted ids.
+
+    :param ids: Unique ids, the position of an id is its index in this array.
+    :param user_ids: Ids to look up, all of them must be in `ids`.
+    :param order: `np.argsort(ids)`, pass it when many arrays are looked up in the same ids.
+    :return: Array of positions of the shape of `user_ids`.
+    """
+    if order is None:
+        order = np.argsort(ids, kind='stable')
+    user_ids = np.asarray(user_ids)
+    sorted_ids = ids[order]
+    found = np.minimum(np.searchsorted(sorted_ids, user_ids), max(len(ids) - 1, 0))
+    missing = user_ids[sorted_ids[found] != user_ids] if len(ids) else user_ids
+    if missing.size:
+        raise KeyError(missing.ravel()[0].item())
+    return order[found]
+
+
+def build_adjacency(df: pd.DataFrame, column: str = 'subscriber_ids') -> tuple[sparse.csr_matrix, np.ndarray]:
+    """
+    Builds the symmetric CSR adjacency matrix of the graph produced by `algorithms.build_graph`.
+
+    :param df: DataFrame containing user data.
+    :param column: Column with the ids every user is connected to.
+    :return: The adjacency matrix and the id of every node. The first nodes are the unique ids of `df`
+        in their original order, ids that only appear in `column` are appended after them.
+    """
+    unique_ids = df['id'].unique()
+    lengths = df[column].map(len).to_numpy()
+    sources = np.repeat(df['id'].to_numpy(), lengths)
+    targets = np.concatenate([*df[column], []]).astype(sources.dtype)
+
+    node_ids = np.concatenate([unique_ids, np.setdiff1d(targets, unique_ids)])
+    order = np.argsort(node_ids, kind='stable')
+    rows = id_positions(node_ids, sources, order)
+    cols = id_positions(node_ids, targets, order)
+
+    n_nodes = len(node_ids)
+    adjacency = sparse.coo_matrix(
+        (np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=(n_nodes, n_nodes)
+    ).tocsr()
+    adjacency = adjacency + adjacency.T
+    adjacency.data[:] = 1
+    return adjacency, node_ids
+
+
+def distance_dtype(max_distance: int) -> np.dtype:
+    """Returns the smallest unsigned integer type able to store distances up to `max_distance`."""
+    return np.min_scalar_type(max(max_distance, 1))
+
+
+def iter_hop_distance_blocks(
+        adjacency: sparse.csr_matrix,
+        n_sources: int | None = None,
+        max_hops: int | None = None,
+        block_size: int = 256
+) -> Iterator[tuple[int, int, np.ndarray]]:
+    """
+    Runs a level-synchronous BFS from `block_size` sources at a time over a symmetric CSR adjacency.
+
+    :param adjacency: Symmetric adjacency matrix of the graph.
+    :param n_sources: BFS is started from the nodes 0..n_sources - 1, all nodes by default.
+    :param max_hops: Nodes further than `max_hops` are treated as unreachable.
+    :param block_size: Number of sources explored simultaneously.
+    :return: Tuples (start, stop, distances) where distances[k, j] is the number of hops between
+        nodes start + k and j, and 0 if j is unreachable or j == start + k.
+    """
+    if block_size < 1:
+        raise ValueError("block_size must be positive.")
+    n_nodes = adjacency.shape[0]
+    n_sources = n_nodes if n_sources is None else n_sources
+    dtype = distance_dtype(n_nodes - 1 if max_hops is None else max_hops)
+
+    for start in range(0, n_sources, block_size):
+        stop = min(start + block_size, n_sources)
+        sources = np.arange(start, stop)
+        columns = np.arange(stop - start)
+
+        distances = np.zeros((n_nodes, stop - start), dtype=dtype)
+        visited = np.zeros((n_nodes, stop - start), dtype=bool)
+        visited[sources, columns] = True
+        frontier = np.zeros((n_nodes, stop - start), dtype=np.float32)
+        frontier[sources, columns] = 1
+
+        hop = 0
+        while max_hops is None or hop < max_hops:
+            reached = adjacency @ frontier > 0
+            reached &= ~visited
+            if not reached.any():
+                break
+            hop += 1
+            visited |= reached
+            distances[reached] = hop
+            frontier = reached.astype(np.float32)
+        yield start, stop, distances.T
+
+
+def graph_distance_matrix(
+        df: pd.DataFrame,
+        max_hops: int | None = None,
+        block_size: int = 256
+) -> sparse.csr_matrix:
+    """
+    Calculates the shortest path lengths between all pairs of users in the subscription graph.
+
+    :param df: DataFrame containing user data.
+    :param max_hops: Pairs further than `max_hops` are not stored.
+    :param block_size: Number of BFS sources explored simultaneously.
+    :return: A sparse matrix of the smallest sufficient integer type where element [i][j] is the
+        distance between user i and user j. Unreachable pairs and the diagonal are not stored.
+    """
+    adjacency, _ = build_adjacency(df)
+    n_users = df['id'].nunique()
+
+    blocks = []
+    for start, stop, distances in iter_hop_distance_blocks(adjacency, n_users, max_hops, block_size):
+        blocks.append(sparse.csr_matrix(distances[:, :n_users]))
+    if not blocks:
+        return sparse.csr_matrix((0, 0), dtype=distance_dtype(0))
+    return sparse.vstack(blocks, format='csr')
+
+
+def graph_similarity_matrix(
+        df: pd.DataFrame,
+        max_hops: int | None = None,
+        block_size: int = 256,
+        as_sparse: bool = False
+) -> np.ndarray | sparse.csr_matrix:
+    """
+    Calculates the inverse-distance similarity 1 / (d(i, j) + d(j, i)) for all pairs of users.
+
+    :param df: DataFrame containing user data.
+    :param max_hops: Pairs further than `max_hops` get zero similarity.
+    :param block_size: Number of BFS sources explored simultaneously.
+    :param as_sparse: Return a CSR matrix that stores only the reachable pairs.
+    :return: A float32 matrix where element [i][j] represents the graph similarity between user i and user j.
+    """
+    if as_sparse:
+        similarity_matrix = graph_distance_matrix(df, max_hops, block_size).astype(np.float32)
+        similarity_matrix.data = 1 / (2 * similarity_matrix.data)
+        return similarity_matrix
+
+    adjacency, _ = build_adjacency(df)
+    n_users = df['id'].nunique()
+    similarity_matrix = np.zeros((n_users, n_users), dtype=np.float32)
+    for start, stop, distances in iter_hop_distance_blocks(adjacency, n_users, max_hops, block_size):
+        distances = distances[:, :n_users]
+        reachable = distances > 0
+        similarity_matrix[start:stop][reachable] = 1 / (2 * distances[reachable].astype(np.float32))
+    return similarity_matrix
+
+
+def iter_hybrid_similarity_blocks(
+        df: pd.DataFrame,
+        graph_weight: float = 0.7,
+        content_weight: float = 0.3,
+        max_hops: int | None = None,
+        block_size: int = 256
+) -> Iterator[tuple[int, int, np.ndarray]]:
+    """
+    Yields full rows of the hybrid similarity matrix, `block_size` users at a time.
+
+    :param df: DataFrame containing user data.
+    :param graph_weight: Weight of the graph similarity.
+    :param content_weight: Weight of the content similarity.
+    :param max_hops: Users further than `max_hops` from each other get zero graph similarity.
+    :param block_size: Number of rows computed at once.
+    :return: Tuples (start, stop, block) where block[k, j] is the similarity between users start + k and j.
+    """
+    matrix = build_answer_matrix(df)
+    norms = np.linalg.norm(matrix, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        normalized = matrix / norms[:, None]
+    adjacency, _ = build_adjacency(df)
+    n_users = len(matrix)
+
+    for start, stop, distances in iter_hop_distance_blocks(adjacency, n_users, max_hops, block_size):
+        block = normalized[start:stop] @ normalized.T
+        np.clip(block, -1, 1, out=block)
+        block *= content_weight
+
+        distances = distances[:, :n_users]
+        reachable = distances > 0
+        block[reachable] += graph_weight / (2 * distances[reachable].astype(np.float32))
+        block[np.arange(stop - start), np.arange(start, stop)] = 0
+        yield start, stop, block
+
+
+def knn_similarity_matrix(
+        df: pd.DataFrame,
+        k: int,
+        threshold: float | None = None,
+        graph_weight: float = 0.7,
+        content_weight: float = 0.3,
+        max_hops: int | None = None,
+        block_size: int = 256
+) -> sparse.csr_matrix:
+    """
+    Keeps only the k most similar neighbours of every user without building the dense matrix.
+
+    :param df: DataFrame containing user data.
+    :param k: Number of neighbours kept per user.
+    :param threshold: Neighbours with a similarity below `threshold` are dropped.
+    :param graph_weight: Weight of the graph similarity.
+    :param content_weight: Weight of the content similarity.
+    :param max_hops: Users further than `max_hops` from each other get zero graph similarity.
+    :param block_size: Number of rows computed at once.
+    :return: A symmetric float32 CSR matrix, an edge is kept if either endpoint selected the other.
+    """
+    n_users = df['id'].nunique()
+    k = min(k, n_users - 1)
+    rows, cols, values = [], [], []
+    if k > 0:
+        for start, stop, block in iter_hybrid_similarity_blocks(df, graph_weight, content_weight, max_hops, block_size):
+            block = np.nan_to_num(block, nan=-np.inf)
+            block[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+            neighbours = np.argpartition(-block, k - 1, axis=1)[:, :k]
+            scores = np.take_along_axis(block, neighbours, axis=1)
+
+            keep = np.isfinite(scores)
+            if threshold is not None:
+                keep &= scores >= threshold
+            rows.append(np.repeat(np.arange(start, stop), k)[keep.ravel()])
+            cols.append(neighbours[keep])
+            values.append(scores[keep])
+
+    knn = sparse.coo_matrix(
+        (np.concatenate([*values, np.empty(0, np.float32)]),
+         (np.concatenate([*rows, np.empty(0, int)]), np.concatenate([*cols, np.empty(0, int)]))),
+        shape=(n_users, n_users)
+    ).tocsr()
+    return knn.maximum(knn.T).tocsr()
+
+
+class SimilarityService:
+    """
+    Precomputed content and graph similarity of all pairs of users.
+
+    Both components are computed once from `info_df`, the weighted hybrid is combined only for
+    the rows or pairs that are queried, so changing the weights does not recompute anything and
+    no hybrid matrix is kept.
+
+    :param df: DataFrame containing user data.
+    :param graph_weight: Weight of the graph similarity in the hybrid score.
+    :param content_weight: Weight of the content similarity in the hybrid score.
+    :param max_hops: Users further than `max_hops` from each other get zero graph similarity.
+    :param codes: Compare the answers as categories on binary codes, see `content_similarity_matrix`.
+    """
+
+    def __init__(self, df: pd.DataFrame, graph_weight: float = 0.7, content_weight: float = 0.3,
+                 max_hops: int | None = None, codes: AnswerCodes | None = None):
+        self.ids = df['id'].unique()
+        self._order = np.argsort(self.ids, kind='stable')
+        self.content = content_similarity_matrix(df, codes=codes)
+        self.graph = graph_similarity_matrix(df, max_hops)
+        self.graph_weight = graph_weight
+        self.content_weight = content_weight
+        # (weights, k, table) of the last ranking, only the ranking of one pair of weights is kept
+        self._ranking = (None, 0, None)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def set_weights(self, graph_weight: float, content_weight: float):
+        self.graph_weight = graph_weight
+        self.content_weight = content_weight
+
+    def _weights(self, graph_weight: float | None, content_weight: float | None) -> tuple[float, float]:
+        return (
+            self.graph_weight if graph_weight is None else graph_weight,
+            self.content_weight if content_weight is None else content_weight,
+        )
+
+    def positions(self, user_ids) -> np.ndarray:
+        """Returns the rows of the users in the similarity matrices, KeyError for unknown users."""
+        return id_positions(self.ids, user_ids, self._order)
+
+    def content_similarity(self, user_id1: int, user_id2: int) -> float:
+        i, j = self.positions([user_id1, user_id2])
+        return float(self.content[i, j])
+
+    def graph_similarity(self, user_id1: int, user_id2: int) -> float:
+        i, j = self.positions([user_id1, user_id2])
+        return float(self.graph[i, j])
+
+    def pair(self, user_id1: int, user_id2: int, graph_weight: float | None = None,
+             content_weight: float | None = None) -> float:
+        """Returns the hybrid similarity of two users."""
+        graph_weight, content_weight = self._weights(graph_weight, content_weight)
+        i, j = self.positions([user_id1, user_id2])
+        return float(self.graph[i, j] * graph_weight + self.content[i, j] * content_weight)
+
+    def pairs(self, user_ids1, user_ids2, graph_weight: float | None = None,
+              content_weight: float | None = None) -> np.ndarray:
+        """Returns the hybrid similarity of every pair (user_ids1[i], user_ids2[i])."""
+        graph_weight, content_weight = self._weights(graph_weight, content_weight)
+        i, j = self.positions(user_ids1), self.positions(user_ids2)
+        return self.graph[i, j] * graph_weight + self.content[i, j] * content_weight
+
+    def row(self, user_id: int, graph_weight: float | None = None, content_weight: float | None = None) -> np.ndarray:
+        """Returns the hybrid similarity between the user and every user in `self.ids` order."""
+        graph_weight, content_weight = self._weights(graph_weight, content_weight)
+        i = self.positions([user_id])[0]
+        return self.graph[i] * graph_weight + self.content[i] * content_weight
+
+    def matrix(self, graph_weight: float | None = None, content_weight: float | None = None) -> np.ndarray:
+        """Returns a new hybrid similarity matrix, it is not cached."""
+        graph_weight, content_weight = self._weights(graph_weight, content_weight)
+        return self.graph * graph_weight + self.content * content_weight
+
+    def top_k(self, user_id: int, k: int, graph_weight: float | None = None,
+              content_weight: float | None = None) -> list[tuple[int, float]]:
+        """
+        Returns the k most similar users as (id, similarity) pairs in descending order.
+
+        The ranking of every user is computed for the current weights and reused until other
+        weights are queried, so repeated queries only cost O(k).
+        """
+        weights = self._weights(graph_weight, content_weight)
+        k = min(k, len(self) - 1)
+        if k <= 0:
+            return []
+        cached_weights, cached_k, table = self._ranking
+        if cached_weights != weights or cached_k < k:
+            table = self._rank(*weights, k)
+            self._ranking = (weights, k, table)
+
+        i = self.positions([user_id])[0]
+        neighbours = table[i, :k]
+        scores = self.graph[i, neighbours] * weights[0] + self.content[i, neighbours] * weights[1]
+        return [(self.ids[j].item(), float(score)) for j, score in zip(neighbours, scores)]
+
+    def _rank(self, graph_weight: float, content_weight: float, k: int, block_size: int = 1024) -> np.ndarray:
+        """
+        Returns the positions of the k most similar other users of every user in descending order.
+
+        The hybrid similarity is combined one block of rows at a time.
+        """
+        table = np.empty((len(self), k), dtype=np.int32)
+        for start in range(0, len(self), block_size):
+            stop = min(start + block_size, len(self))
+            block = self.graph[start:stop] * graph_weight + self.content[start:stop] * content_weight
+            block = np.nan_to_num(block, nan=-np.inf)
+            block[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+            candidates = np.argpartition(-block, k - 1, axis=1)[:, :k]
+            order = np.argsort(-np.take_along_axis(block, candidates, axis=1), axis=1, kind='stable')
+            table[start:stop] = np.take_along_axis(candidates, order, axis=1)
+        return table
@@ -0,0 +1,369 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from ingest import iter_records
+
+SOURCE_FILES = ('participants.json', 'answers.json', 'fields.json')
+SCALAR_COLUMNS = ('created_at', 'subscriber_count', 'subscription_count', 'viewed_count', 'views')
+LIST_COLUMNS = ('subscriber_ids', 'subscription_ids', 'viewed_ids', 'roommate_ids')
+PARTICIPANT_COLUMNS = ('id', 'created_at', 'gender', 'subscriber_count', 'subscriber_ids', 'subscription_count',
+                       'subscription_ids', 'viewed_count', 'viewed_ids', 'views', 'roommate_ids')
+SNAPSHOT_VERSION = 1
+
+
+def file_hash(path: str, digest=None) -> str:
+    """
+    Hashes the contents of a file without parsing it.
+
+    :param path: Path of the file.
+    :param digest: hashlib object to update, a new sha256 by default.
+    :return: Hex digest of the contents.
+    """
+    digest = digest or hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_hash(data_path: str) -> str:
+    """
+    Hashes the contents of the three JSON files, the files are read but not parsed.
+
+    :param data_path: Directory with participants.json, answers.json and fields.json.
+    :return: Hex digest of the contents.
+    """
+    digest = hashlib.sha256()
+    for name in SOURCE_FILES:
+        digest.update(name.encode())
+        file_hash(os.path.join(data_path, name), digest)
+    return digest.hexdigest()
+
+
+def source_stats(data_path: str) -> dict:
+    """
+    Returns the size and modification time of the three JSON files, {name: [size, mtime_ns]}.
+
+    :param data_path: Directory with participants.json, answers.json and fields.json.
+    """
+    stats = {}
+    for name in SOURCE_FILES:
+        stat = os.stat(os.path.join(data_path, name))
+        stats[name] = [stat.st_size, stat.st_mtime_ns]
+    return stats
+
+
+class _Buffer:
+    """Append-only array that doubles its capacity when it is full."""
+
+    def __init__(self, dtype, capacity: int = 1024):
+        self.data = np.empty(capacity, dtype=dtype)
+        self.size = 0
+
+    def _reserve(self, n: int):
+        if self.size + n > len(self.data):
+            data = np.empty(max(self.size + n, 2 * len(self.data)), dtype=self.data.dtype)
+            data[:self.size] = self.data[:self.size]
+            self.data = data
+
+    def append(self, value):
+        self._reserve(1)
+        self.data[self.size] = value
+        self.size += 1
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self.data.dtype)
+        self._reserve(len(values))
+        self.data[self.size:self.size + len(values)] = values
+        self.size += len(values)
+
+    def array(self) -> np.ndarray:
+        return self.data[:self.size]
+
+
+class SnapshotBuilder:
+    """
+    Writes participants and answers record by record into the arrays of a snapshot.
+
+    The answers go straight into a preallocated respondent x field int8 matrix whose rows are
+    added on demand, the lists of the participants are appended to CSR buffers. Nothing but
+    the arrays themselves grows with the number of records, so JSON dumps of any size can be
+    ingested with bounded overhead.
+
+    :param fields: The questions of fields.json.
+    :param capacity: Number of participants and respondents to preallocate for.
+    """
+
+    def __init__(self, fields: list[dict], capacity: int = 1024):
+        self.fields = fields
+        self.ids = _Buffer(np.int64, capacity)
+        self.known_ids = set()
+        self.scalars = {column: _Buffer(np.int64, capacity) for column in SCALAR_COLUMNS}
+        self.genders = []
+        self.gender = _Buffer(np.int8, capacity)
+        self.indptr = {column: _Buffer(np.int64, capacity + 1) for column in LIST_COLUMNS}
+        self.indices = {column: _Buffer(np.int64, capacity) for column in LIST_COLUMNS}
+        for column in LIST_COLUMNS:
+            self.indptr[column].append(0)
+
+        self.respondent_rows = {}
+        # The columns follow the first appearance of the fields
+        self.field_columns = {}
+        self.answers = np.full((capacity, max(len(fields), 1)), -1, dtype=np.int8)
+
+    def _gender_code(self, gender: str) -> int:
+        if gender not in self.genders:
+            self.genders.append(gender)
+        return self.genders.index(gender)
+
+    def add_participant(self, record: dict):
+        """Adds a participant, its id must be new."""
+        if record['id'] in self.known_ids:
+            raise ValueError(f"Participant {record['id']} is already in the snapshot.")
+        self.known_ids.add(record['id'])
+        self.ids.append(record['id'])
+        for column in SCALAR_COLUMNS:
+            self.scalars[column].append(record[column])
+        self.gender.append(self._gender_code(record['gender']))
+        for column in LIST_COLUMNS:
+            self.indices[column].extend(record[column])
+            self.indptr[column].append(self.indices[column].size)
+
+    def _row(self, respondent_id: int) -> int:
+        row = self.respondent_rows.setdefault(respondent_id, len(self.respondent_rows))
+        if row >= len(self.answers):
+            answers = np.full((2 * len(self.answers), self.answers.shape[1]), -1, dtype=np.int8)
+            answers[:len(self.answers)] = self.answers
+            self.answers = answers
+        return row
+
+    def _column(self, field_id: int) -> int:
+        column = self.field_columns.setdefault(field_id, len(self.field_columns))
+        if column >= self.answers.shape[1]:
+            answers = np.full((len(self.answers), 2 * self.answers.shape[1]), -1, dtype=np.int8)
+            answers[:, :self.answers.shape[1]] = self.answers
+            self.answers = answers
+        return column
+
+    def add_answer(self, record: dict):
+        """Adds an answer, a later answer to the same field replaces the earlier one."""
+        # both may grow the matrix, so they are looked up before it
+        row, column = self._row(record['respondent_id']), self._column(record['field_id'])
+        self.answers[row, column] = record['option']
+
+    def add_snapshot(self, snapshot: 'Snapshot'):
+        """Adds all participants and answers of an existing snapshot, without parsing JSON."""
+        ids = np.asarray(snapshot['ids'])
+        overlap = self.known_ids.intersection(ids.tolist())
+        if overlap:
+            raise ValueError(f'Participants {sorted(overlap)} are already in the snapshot.')
+        self.known_ids.update(ids.tolist())
+        self.ids.extend(ids)
+        for column in SCALAR_COLUMNS:
+            self.scalars[column].extend(snapshot[column])
+        codes = np.array([self._gender_code(gender) for gender in snapshot.meta['genders']], dtype=np.int8)
+        self.gender.extend(codes[np.asarray(snapshot['gender'])] if len(codes) else [])
+        for column in LIST_COLUMNS:
+            indptr, indices = snapshot.csr(column)
+            self.indptr[column].extend(np.asarray(indptr[1:]) + self.indices[column].size)
+            self.indices[column].extend(indices)
+
+        rows = np.array([self._row(i) for i in np.asarray(snapshot['respondent_ids']).tolist()], dtype=np.int64)
+        columns = np.array([self._column(i) for i in np.asarray(snapshot['field_ids']).tolist()], dtype=np.int64)
+        answers = np.asarray(snapshot['answers'])
+        answered = answers >= 0
+        self.answers[rows[:, None], columns] = np.where(answered, answers, self.answers[rows[:, None], columns])
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        """Returns the arrays of the snapshot, the respondents are sorted by id."""
+        arrays = {'ids': self.ids.array()}
+        arrays.update({column: buffer.array() for column, buffer in self.scalars.items()})
+        arrays['gender'] = self.gender.array()
+        for column in LIST_COLUMNS:
+            arrays[f'{column}_indptr'] = self.indptr[column].array()
+            arrays[f'{column}_indices'] = self.indices[column].array()
+
+        respondent_ids = np.fromiter(self.respondent_rows, dtype=np.int64, count=len(self.respondent_rows))
+        rows = np.fromiter(self.respondent_rows.values(), dtype=np.int64, count=len(self.respondent_rows))
+        order = np.argsort(respondent_ids, kind='stable')
+        arrays['respondent_ids'] = respondent_ids[order]
+        arrays['field_ids'] = np.fromiter(self.field_columns, dtype=np.int64, count=len(self.field_columns))
+        arrays['answers'] = self.answers[rows[order], :len(self.field_columns)]
+        return arrays
+
+    def write(self, snapshot_path: str, meta: dict) -> str:
+        """
+        Writes the arrays and the metadata to `snapshot_path`.
+
+        The directory is written to a temporary place and moved, so a reader never sees a
+        half-written snapshot.
+        """
+        parent = os.path.dirname(os.path.abspath(snapshot_path))
+        os.makedirs(parent, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=parent)
+        for name, array in self.arrays().items():
+            np.save(os.path.join(tmp, f'{name}.npy'), array)
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump({**meta, 'version': SNAPSHOT_VERSION, 'genders': self.genders, 'fields': self.fields}, f)
+        if os.path.exists(snapshot_path):
+            shutil.rmtree(snapshot_path)
+        os.replace(tmp, snapshot_path)
+        return snapshot_path
+
+
+def compile_snapshot(data_path: str, snapshot_path: str = None) -> str:
+    """
+    Compiles the JSON data graph into a directory of .npy arrays.
+
+    Every scalar column is one array. Every list column is a CSR pair {name}_indptr, {name}_indices:
+    the list of participant i is indices[indptr[i]:indptr[i + 1]]. The answers are an int8 matrix
+    with a row per respondent and -1 for missing answers, the columns follow the order in which
+    the fields appear in answers.json. The JSON files are streamed, see ingest.iter_records.
+
+    :param data_path: Directory with participants.json, answers.json and fields.json.
+    :param snapshot_path: Output directory, data_path/snapshot by default.
+    :return: Path of the snapshot.
+    """
+    snapshot_path = snapshot_path or os.path.join(data_path, 'snapshot')
+    # taken before the files are read, so a file changed while compiling makes the snapshot stale
+    stats = source_stats(data_path)
+    digest = source_hash(data_path)
+    with open(os.path.join(data_path, 'fields.json')) as f:
+        builder = SnapshotBuilder(json.load(f))
+    for record in iter_records(os.path.join(data_path, 'participants.json')):
+        builder.add_participant(record)
+    for record in iter_records(os.path.join(data_path, 'answers.json')):
+        builder.add_answer(record)
+    return builder.write(snapshot_path, {'source_hash': digest, 'source_stats': stats, 'appended': []})
+
+
+def append_to_snapshot(snapshot_path: str, participants_path: str = None, answers_path: str = None) -> str:
+    """
+    Adds new participants and answers to a snapshot without reading the data it was built from.
+
+    The chunks are JSON arrays or newline-delimited JSON files, e.g. the registrations of one
+    day. New participants must have new ids, answers may add or replace answers of anyone.
+
+    :param snapshot_path: Directory of the snapshot.
+    :param participants_path: File with new participants.
+    :param answers_path: File with new answers.
+    :return: Path of the snapshot.
+    """
+    snapshot = Snapshot(snapshot_path)
+    builder = SnapshotBuilder(snapshot.fields, capacity=len(snapshot['ids']) + 1024)
+    builder.add_snapshot(snapshot)
+    appended = list(snapshot.meta.get('appended', []))
+    if participants_path is not None:
+        for record in iter_records(participants_path):
+            builder.add_participant(record)
+        appended.append(file_hash(participants_path))
+    if answers_path is not None:
+        for record in iter_records(answers_path):
+            builder.add_answer(record)
+        appended.append(file_hash(answers_path))
+    return builder.write(snapshot_path, {**snapshot.meta, 'appended': appended})
+
+
+class Snapshot:
+    """
+    Memory-mapped snapshot of the data graph.
+
+    The arrays are opened with mmap_mode='r', so loading costs the same for any size of the
+    data graph and pages are read only when they are used.
+
+    :param snapshot_path: Directory written by compile_snapshot.
+    """
+
+    def __init__(self, snapshot_path: str):
+        self.path = snapshot_path
+        with open(os.path.join(snapshot_path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self._arrays = {}
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        if name not in self._arrays:
+            self._arrays[name] = np.load(os.path.join(self.path, f'{name}.npy'), mmap_mode='r')
+        return self._arrays[name]
+
+    @property
+    def fields(self) -> list[dict]:
+        """The questions of fields.json."""
+        return self.meta['fields']
+
+    def csr(self, column: str) -> (np.ndarray, np.ndarray):
+        """Returns indptr and indices of a list column."""
+        return self[f'{column}_indptr'], self[f'{column}_indices']
+
+    def lists(self, column: str) -> list[list[int]]:
+        """Converts a list column back into Python lists, one per participant."""
+        indptr, indices = self.csr(column)
+        return [chunk.tolist() for chunk in np.split(np.asarray(indices), np.asarray(indptr[1:-1]))]
+
+    def participants_df(self) -> pd.DataFrame:
+        """Returns the participants with the columns and the order of participants.json."""
+        data = {'id': np.asarray(self['ids'])}
+        data.update({column: np.asarray(self[column]) for column in SCALAR_COLUMNS})
+        data['gender'] = np.array(self.meta['genders'], dtype=object)[self['gender']]
+        data.update({column: self.lists(column) for column in LIST_COLUMNS})
+        return pd.DataFrame({column: data[column] for column in PARTICIPANT_COLUMNS})
+
+    def answers_df(self) -> pd.DataFrame:
+        """Returns the answers in the long format of answers.json, listed field by field."""
+        answered = np.asarray(self['answers']).T >= 0
+        columns, rows = np.nonzero(answered)
+        return pd.DataFrame({
+            'field_id': np.asarray(self['field_ids'])[columns],
+            'respondent_id': np.asarray(self['respondent_ids'])[rows],
+            'option': np.asarray(self['answers'])[rows, columns].astype(np.int64),
+        })
+
+    def info_df(self) -> pd.DataFrame:
+        """Returns the same DataFrame as preprocess_data.get_info_df without parsing JSON."""
+        participants = self.participants_df()
+        matrix = np.asarray(self['answers'])
+        options = pd.DataFrame({
+            'id': np.asarray(self['respondent_ids']),
+            'option': [row[row >= 0].astype(np.int64).tolist() for row in matrix],
+        })
+        return pd.merge(participants, options)
+
+
+def load_snapshot(data_path: str, snapshot_path: str = None) -> Snapshot:
+    """
+    Opens the snapshot of the data graph, it is compiled first if it is missing or stale.
+
+    A snapshot is stale when the content hash of the JSON files or the snapshot format changed.
+    The files are only hashed when their size or modification time differ from the ones stored
+    in the snapshot, so opening an up-to-date snapshot does not read the JSON files. When only
+    the times changed, e.g. after a copy, the new times are stored.
+
+    :param data_path: Directory with participants.json, answers.json and fields.json.
+    :param snapshot_path: Snapshot directory, data_path/snapshot by default.
+    :return: Memory-mapped snapshot.
+    """
+    snapshot_path = snapshot_path or os.path.join(data_path, 'snapshot')
+    if os.path.exists(os.path.join(snapshot_path, 'meta.json')):
+        snapshot = Snapshot(snapshot_path)
+        if snapshot.meta.get('version') == SNAPSHOT_VERSION:
+            stats = source_stats(data_path)
+            if snapshot.meta.get('source_stats') == stats:
+                return snapshot
+            if snapshot.meta.get('source_hash') == source_hash(data_path):
+                snapshot.meta['source_stats'] = stats
+                _write_meta(snapshot_path, snapshot.meta)
+                return snapshot
+    return Snapshot(compile_snapshot(data_path, snapshot_path))
+
+
+def _write_meta(snapshot_path: str, meta: dict):
+    """Replaces meta.json of a snapshot, the file is written to a temporary place and moved."""
+    fd, tmp = tempfile.mkstemp(dir=snapshot_path, suffix='.json')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp, os.path.join(snapshot_path, 'meta.json'))
@@ -1,87 +1,159 @@
 import networkx as nx
+import numpy as np
+import plotly.express as px
 import plotly.graph_objects as go
 from matplotlib import pyplot as plt
+from scipy import sparse
 
 from datastructures import Room
 import evaluation
+from layout import cached_layout, edge_coordinates
+from scoring import RoomScorer
+from null_model import NullDistribution
 
 
-def plot_graph(g: nx.Graph):
-    pos = nx.spring_layout(g)
-    edge_x = []
-    edge_y = []
-    for edge in g.edges():
-        x0, y0 = pos[edge[0]]
-        x1, y1 = pos[edge[1]]
-        edge_x.extend([x0, x1])
-        edge_y.extend([y0, y1])
-
-    edge_trace = go.Scatter(
-        x=edge_x, y=edge_y,
-        line=dict(width=0.5, color='#888'),
-        hoverinfo='none',
-        mode='lines')
-
-    node_x = []
-    node_y = []
-    for node in g.nodes():
-        x, y = pos[node]
-        node_x.append(x)
-        node_y.append(y)
-
-    node_trace = go.Scatter(
-        x=node_x, y=node_y,
+AXIS = dict(showgrid=False, zeroline=False, showticklabels=False)
+ROOM_COLORS = np.array(px.colors.qualitative.Alphabet)
+
+
+def _figure(traces: list, title: str) -> go.Figure:
+    return go.Figure(data=traces,
+                     layout=go.Layout(
+                         title=dict(text=f'<br>{title}', font=dict(size=16)),
+                         showlegend=False,
+                         hovermode='closest',
+                         margin=dict(b=20, l=5, r=5, t=40),
+                         xaxis=AXIS,
+                         yaxis=AXIS)
+                     )
+
+
+def _edge_trace(positions: np.ndarray, sources: np.ndarray, targets: np.ndarray, width: float = 0.5) -> go.Scattergl:
+    edge_x, edge_y = edge_coordinates(positions, sources, targets)
+    return go.Scattergl(x=edge_x, y=edge_y, line=dict(width=width, color='#888'), hoverinfo='none', mode='lines')
+
+
+def plot_graph(g: nx.Graph, cache_dir: str = None):
+    """
+    Plots the graph with WebGL traces, the nodes are coloured by their number of connections.
+
+    The layout is computed once per graph and cached, see `layout.cached_layout`.
+    """
+    layout = cached_layout(g, cache_dir=cache_dir)
+    degrees = np.bincount(np.concatenate([layout.sources, layout.targets]), minlength=len(layout.nodes))
+
+    node_trace = go.Scattergl(
+        x=layout.positions[:, 0], y=layout.positions[:, 1],
         mode='markers',
         hoverinfo='text',
+        text=[f'# of connections: {degree}' for degree in degrees.tolist()],
         marker=dict(
             showscale=True,
             colorscale='YlGnBu',
             reversescale=True,
-            color=[],
+            color=degrees,
             size=10,
             colorbar=dict(
                 thickness=15,
-                title='Node Connections',
-                xanchor='left',
-                titleside='right'
+                title=dict(text='Node Connections', side='right'),
+                xanchor='left'
             ),
             line_width=2))
 
-    node_adjacency = []
-    node_text = []
-    for node, adjacency in enumerate(g.adjacency()):
-        node_adjacency.append(len(adjacency[1]))
-        node_text.append(f'# of connections: {len(adjacency[1])}')
+    _figure([_edge_trace(layout.positions, layout.sources, layout.targets), node_trace], 'Subscribers graph').show()
 
-    node_trace.marker.color = node_adjacency
-    node_trace.text = node_text
 
-    fig = go.Figure(data=[edge_trace, node_trace],
-                    layout=go.Layout(
-                        title='<br>Subscribers graph',
-                        titlefont_size=16,
-                        showlegend=False,
-                        hovermode='closest',
-                        margin=dict(b=20, l=5, r=5, t=40),
-                        xaxis=dict(showgrid=False, zeroline=False, showticklabels=False),
-                        yaxis=dict(showgrid=False, zeroline=False, showticklabels=False))
-                    )
+def plot_assignment(g: nx.Graph, rooms: list[Room], cache_dir: str = None):
+    """Plots the graph with WebGL traces, the students are coloured by their room and unassigned nodes are grey."""
+    layout = cached_layout(g, cache_dir=cache_dir)
+    labels = RoomScorer.from_graph(g, len(rooms)).labels(rooms)
+    assigned = labels >= 0
 
-    fig.show()
+    node_trace = go.Scattergl(
+        x=layout.positions[assigned, 0], y=layout.positions[assigned, 1],
+        mode='markers',
+        hoverinfo='text',
+        text=[f'{node}: room {rooms[label].label} ({label})'
+              for node, label in zip(layout.nodes[assigned].tolist(), labels[assigned].tolist())],
+        marker=dict(color=ROOM_COLORS[labels[assigned] % len(ROOM_COLORS)], size=8))
+    unassigned_trace = go.Scattergl(
+        x=layout.positions[~assigned, 0], y=layout.positions[~assigned, 1],
+        mode='markers',
+        hoverinfo='text',
+        text=[f'{node}: no room' for node in layout.nodes[~assigned].tolist()],
+        marker=dict(color='#ccc', size=6))
+    traces = [_edge_trace(layout.positions, layout.sources, layout.targets, width=0.3), unassigned_trace, node_trace]
+    _figure(traces, 'Assignment of students to rooms').show()
+
+
+def plot_rooms(g: nx.Graph, rooms: list[Room], cache_dir: str = None):
+    """
+    Plots one marker per room instead of one per student, for large check-ins.
+
+    A room is placed at the mean layout position of its students, its size is its number of
+    occupants and its colour its satisfaction. The rooms are joined by the edges between their
+    students, thicker lines for more edges. Rooms without nodes of the graph are not shown.
+    """
+    layout = cached_layout(g, cache_dir=cache_dir)
+    scorer = RoomScorer.from_graph(g, len(rooms))
+    labels = scorer.labels(rooms)
+    assigned = labels >= 0
+    in_graph = np.bincount(labels[assigned], minlength=len(rooms))
+    occupancy = np.array([room.capacity - room.size() for room in rooms], dtype=np.int64)
+    satisfaction = scorer.satisfaction(labels, occupancy)
+    shown = in_graph > 0
+    with np.errstate(invalid='ignore'):
+        centers = np.stack([
+            np.bincount(labels[assigned], weights=layout.positions[assigned, axis], minlength=len(rooms))
+            for axis in range(2)
+        ], axis=1) / in_graph[:, None]
+
+    source_rooms, target_rooms = labels[scorer.sources], labels[scorer.targets]
+    between = (source_rooms >= 0) & (target_rooms >= 0) & (source_rooms != target_rooms)
+    room_edges = sparse.coo_matrix((np.ones(np.count_nonzero(between)), (source_rooms[between], target_rooms[between])),
+                                   shape=(len(rooms), len(rooms))).tocsr()
+    if not g.is_directed():
+        room_edges = sparse.triu(room_edges + room_edges.T, format='csr')
+    room_edges = room_edges.tocoo()
+
+    # one trace per doubling of the number of edges, a trace has a single line width
+    buckets = np.log2(room_edges.data).astype(np.int64) if room_edges.nnz else np.zeros(0, dtype=np.int64)
+    traces = [_edge_trace(centers, room_edges.row[buckets == bucket], room_edges.col[buckets == bucket],
+                          width=0.5 + bucket)
+              for bucket in np.unique(buckets)]
+    traces.append(go.Scattergl(
+        x=centers[shown, 0], y=centers[shown, 1],
+        mode='markers',
+        hoverinfo='text',
+        text=[f'{room.label} ({i}), {room.room_type}: {occupancy[i]}/{room.capacity} students, '
+              f'{100 * satisfaction[i]:.0f}% satisfaction'
+              for i, room in enumerate(rooms) if shown[i]],
+        marker=dict(
+            showscale=True,
+            colorscale='YlGnBu',
+            reversescale=True,
+            color=satisfaction[shown],
+            cmin=0,
+            cmax=1,
+            size=6 + 3 * np.sqrt(occupancy[shown]),
+            colorbar=dict(
+                thickness=15,
+                title=dict(text='Room satisfaction', side='right'),
+                xanchor='left'
+            ),
+            line_width=1)))
+    _figure(traces, 'Rooms').show()
 
 
-def visualize_assignment(g: nx.Graph, rooms: list[Room]):
+def visualize_assignment(g: nx.Graph, rooms: list[Room], cache_dir: str = None):
     """Visualizes the assignment of students to rooms using Matplotlib."""
     cmap = plt.get_cmap('tab20')
-    room_color = [cmap(i % 20) for i in range(len(rooms))]
-    node_color = [cmap(0) for _ in range(len(g.nodes))]
-
-    for i, room in enumerate(rooms):
-        for student_id in room.student_ids:
-            node_color[student_id - 1] = room_color[i]
+    layout = cached_layout(g, cache_dir=cache_dir)
+    labels = RoomScorer.from_graph(g, len(rooms)).labels(rooms)
+    node_color = [cmap(label % 20) if label >= 0 else cmap(0) for label in labels.tolist()]
 
-    pos = nx.spring_layout(g)
-    nx.draw(g, pos, node_color=node_color, with_labels=True)
+    pos = dict(zip(layout.nodes.tolist(), layout.positions))
+    nx.draw(g, pos, nodelist=layout.nodes.tolist(), node_color=node_color, with_labels=True)
     edges = g.edges()
     nx.draw_networkx_edges(g, pos, edgelist=edges, edge_color='black', arrows=False)
     plt.show()
@@ -95,6 +167,13 @@ def print_adjacent(rooms):
         print()
 
 
-def print_distribution_statistics(g: nx.Graph, rooms: list[Room]):
+def print_distribution_statistics(g: nx.Graph, rooms: list[Room], null: NullDistribution = None):
     print(f"Mean room satisfaction: {100 * evaluation.mean_room_satisfaction(g, rooms)}%")
     print(f"Percentage of edges saved: {100 * evaluation.edges_saved(g, rooms)}%")
+    if null is not None:
+        comparison = null.compare(g, rooms)
+        percentiles = null.percentiles((5, 50, 95))
+        for name, title in (('satisfaction', 'Mean room satisfaction'), ('edges_saved', 'Percentage of edges saved')):
+            low, median, high = (100 * value for value in percentiles[name].values())
+            print(f"{title} of {len(null)} random assignments: median {median:.2f}%, 90% in [{low:.2f}%, {high:.2f}%], "
+                  f"z = {comparison['z_scores'][name]:.1f}, p = {comparison['p_values'][name]:.4f}")
@@ -1,183 +1,113 @@
-import enum
-
-import faiss
-import numpy as np
 from rec_services.dataset import Dataset
-
-from rec_services.graph import Graph
+from rec_services.encoding import AnswerEncoder
+from rec_services.model import RecommendationModel
 from rec_services.user import User
-from sklearn.preprocessing import normalize
-
-
-class StatusKind(enum.Enum):
-    """StatusKind enum class that holds the status of the users' flow now."""
-
-    COMMON = 1
-    FRIEND = 2
+from recommendation_session import RecommendationSession
 
 
 class HybridRecommendationSystem:
     """Recommendation system class that handles the recommendation process.
+    The index, the vectors and the adjacency live in a RecommendationModel, so one model can be
+    shared by the recommendation systems of many users.
 
     Args:
         :param user: User object
-        :param dataset: Dataset object
+        :param dataset: Dataset object, not needed if a model is given
+        :param index_backend: FAISS index backend, one of rec_services.index.INDEX_BACKENDS
+        :param index_build_params: Build parameters of the index backend
+        :param index_search_params: Search parameters of the index backend
+        :param model: Shared model, it is built from the dataset if not given
+        :param encoder: Compare the answers as categories on binary codes, see RecommendationModel
 
     """
 
-    status = StatusKind.COMMON
-
-    def __init__(self, user: User, dataset: Dataset):
+    def __init__(
+        self,
+        user: User,
+        dataset: Dataset = None,
+        index_backend: str = "flat",
+        index_build_params: dict = None,
+        index_search_params: dict = None,
+        model: RecommendationModel = None,
+        encoder: AnswerEncoder = None,
+    ):
         self.user = user
-
-        self.participants = dataset.participants
-        self.answers_pivot = dataset.answers_pivot
-        self.working_answers = dataset.answers_pivot.drop(self.user.black_list)
-
-        self.working_graph = Graph(self.participants, dataset.nan_responses)
-
-        self.index = faiss.IndexFlatL2(self.working_answers.shape[1])
-        self.index.add(
-            np.ascontiguousarray(
-                normalize(self.working_answers.values).astype(np.float32)
-            )
+        self.model = model or RecommendationModel(
+            dataset,
+            index_backend,
+            index_build_params,
+            index_search_params,
+            encoder=encoder,
         )
+        self.index = self.model.index
 
-        self.contiguous_to_custom = dataset.contiguous_to_custom_index()
-        self.custom_to_contiguous = dataset.custom_to_contiguous_index()
-
-    def create_faiss_index(self) -> None:
-        """Creates a new faiss index and adds the normalized data to it."""
-        self.index = faiss.IndexFlatL2(self.working_answers.shape[1])
-        normalized_data = normalize(self.working_answers.values).astype(np.float32)
-        self.index.add(np.ascontiguousarray(normalized_data))
+    def session(
+        self,
+        page_size: int = 10,
+        prefetch: bool = True,
+        graph_weight: float = 0.7,
+        content_weight: float = 0.3,
+    ) -> RecommendationSession:
+        """Returns a recommendation session of the user that can be driven by a service.
 
-    def update_faiss_index(self) -> None:
-        """Updates the faiss index by removing blacklisted users."""
-        self.working_answers = self.answers_pivot.drop(self.user.black_list)
-        self.contiguous_to_custom = {
-            i: j for i, j in enumerate(self.working_answers.index)
-        }
-        self.custom_to_contiguous = {
-            j: i for i, j in enumerate(self.working_answers.index)
-        }
+        Args:
+            :param page_size: Number of candidates searched at once
+            :param prefetch: Whether the next page is searched in a background thread
+            :param graph_weight: Weight of the graph proximity in the ranking
+            :param content_weight: Weight of the content similarity in the ranking
 
-        self.create_faiss_index()
+        Returns:
+            RecommendationSession: Session of the user over the shared model
+        """
+        return RecommendationSession(
+            self.model, self.user, page_size, prefetch, graph_weight, content_weight
+        )
 
     def process_user_recommendations(self) -> None:
-        """Processes the user recommendations.
+        """Processes the user recommendations in the console.
 
-        The function gets similar users and asks the user if they want to be friends.
-           If the user says yes, the function adds the user to the graph and the checked list.
-           If the user says no, the function adds the user to the blacklist and updates the faiss index.
-        When algorithm shows 10 users for recommendations, it recommends the similar users from the first neighbor.
+        The function shows the candidates of a recommendation session and asks the user if they want to be friends.
+           If the user says yes, the candidate is added to the friends and the checked list.
+           If the user says no, the candidate is added to the blacklist, which the index search skips.
+        The pages of the users similar to the user alternate with the pages of the friends of its friends.
 
-        After the recommendation process is finished, the function restarts the recommendation process.
-        As a result, the recommendation process is infinite.
+        When nobody is left, the session restarts with an empty blacklist, without recursion.
+        The process ends when there is nobody to recommend even after a restart.
         """
-
-        similar_users = self.user.get_similar_users(
-            self.index, self.contiguous_to_custom, 11
-        )
-
-        while self.working_answers.shape[0] != len(self.user.checked) - 1:
-            neighbor_users = self.working_graph.get_n_neighbors(self.user.id, 11)
-
-            if (
-                len(similar_users) == 0 and self.status == StatusKind.COMMON
-            ):  # check if similar users are empty for the common user
-
-                if len(neighbor_users) == 0:  # check if neighbors' list is empty, too
-                    similar_users = self.user.get_similar_users(
-                        self.index, self.contiguous_to_custom, 11
-                    )
-
-                    if len(similar_users) == 0:
-                        break
-                else:
-                    neighbor_user = User(
-                        neighbor_users[0],
-                        self.working_answers.loc[neighbor_users[0]]
-                        .values.reshape(1, -1)
-                        .astype(np.float32),
-                        self.participants.loc[neighbor_users[0]]["subscription_ids"],
-                    )
-
-                    similar_users = neighbor_user.get_similar_users(
-                        self.index, self.contiguous_to_custom, 11
-                    )  # get similar users for the neighbor user
-
-                    self.user.checked.append(neighbor_users[0])
-
-                    if (
-                        self.user.id in similar_users
-                    ):  # we don't want to recommend the user itself, if it is in the similar users list of the neighbor user
-                        idx = similar_users.index(self.user.id)
-
-                        del similar_users[idx]
-                    self.status = StatusKind.FRIEND
-            elif (
-                len(similar_users) == 0 and self.status == StatusKind.FRIEND
-            ):  # check if similar users are empty for the neighbor user
-                similar_users = self.user.get_similar_users(
-                    self.index, self.contiguous_to_custom, 11
-                )
-                self.status = StatusKind.COMMON
-            if self.user.is_blacklisted(
-                similar_users[0]
-            ):  # we don't want to recommend the rejected users
-                continue
-            if self.user.is_checked(
-                similar_users[0]
-            ):  # we don't want to recommend the already checked users
-                if len(similar_users) == 10 and all(
-                    i in self.working_graph.get_neighbors(self.user.id)
-                    for i in similar_users
-                ):
-
-                    for i in similar_users:
-                        self.user.black_list.append(i)
-                    self.update_faiss_index()
-
-                    continue
-                del similar_users[0]
-
-                continue
-            self.answer_handler(similar_users)
-
-            del similar_users[0]
-        self.restart_handler()
-
-    def answer_handler(self, similar_users) -> None:
+        with self.session() as session:
+            restarts = 0
+            for candidate in session:
+                if session.restarts != restarts:
+                    restarts = session.restarts
+                    self.restart_handler()
+                self.answer_handler(candidate, session)
+        print("No more users to recommend.")
+
+    def answer_handler(self, candidate: int, session: RecommendationSession) -> None:
         """Handles the user's answer to the recommendation.
 
         Args:
-            :param similar_users: List of similar users
+            :param candidate: Recommended user id
+            :param session: Session that receives the answer
 
         """
         while True:
-            print(f"Do you want this user {similar_users[0]} to be your friend?")
-            print(
-                np.array(
-                    self.answers_pivot[self.answers_pivot.index == similar_users[0]]
-                )
-            )
+            print(f"Do you want this user {candidate} to be your friend?")
+            print(self.model.get_user_vector(candidate))
             ans = input("yes/no: ")
 
             match ans:
 
                 case "yes":
-                    print(f"You have a new friend {similar_users[0]}")
+                    print(f"You have a new friend {candidate}")
                     print("----------------------------------------")
-                    self.working_graph.add_edge(self.user.id, similar_users[0])
-                    self.user.checked.append(similar_users[0])
+                    session.accept(candidate)
 
                     break
                 case "no":
                     print(f"You have no new friend")
                     print("----------------------------------------")
-                    self.user.black_list.append(similar_users[0])
-                    self.update_faiss_index()
+                    session.reject(candidate)
                     break
                 case _:
                     print("Invalid input. Use only yes or no.")
@@ -185,10 +115,3 @@ class HybridRecommendationSystem:
     def restart_handler(self) -> None:
         """Handles the restart of the recommendation process."""
         print("No more users to recommend. I restart the recommendation process.")
-
-        self.user.black_list = []
-
-        self.working_answers = self.answers_pivot
-        self.update_faiss_index()
-
-        self.process_user_recommendations()
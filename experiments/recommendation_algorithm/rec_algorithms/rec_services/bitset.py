@@ -0,0 +1,77 @@
+from typing import Iterable, Iterator
+
+import numpy as np
+
+
+class Bitset:
+    """
+    Set of non-negative integer ids stored as a bitmap, bit i of byte i // 8 marks id i.
+
+    Adding, removing and membership checks are O(1). The layout matches faiss.IDSelectorBitmap,
+    so the bitmap can be passed to FAISS searches without conversion.
+
+    Args:
+        :param ids: Initial ids
+        :param size: Number of ids to allocate space for, the bitmap grows on demand
+    """
+
+    def __init__(self, ids: Iterable[int] = (), size: int = 0):
+        self.bits = np.zeros((size + 7) // 8, dtype=np.uint8)
+        self.count = 0
+        for i in ids:
+            self.add(i)
+
+    def _grow(self, some_id: int) -> None:
+        n_bytes = (some_id >> 3) + 1
+        if n_bytes > len(self.bits):
+            bits = np.zeros(max(n_bytes, 2 * len(self.bits)), dtype=np.uint8)
+            bits[: len(self.bits)] = self.bits
+            self.bits = bits
+
+    def add(self, some_id: int) -> None:
+        """Adds the id to the set."""
+        self._grow(some_id)
+        mask = 1 << (some_id & 7)
+        if not self.bits[some_id >> 3] & mask:
+            self.bits[some_id >> 3] |= mask
+            self.count += 1
+
+    def discard(self, some_id: int) -> None:
+        """Removes the id from the set if it is present."""
+        if some_id in self:
+            self.bits[some_id >> 3] &= ~np.uint8(1 << (some_id & 7))
+            self.count -= 1
+
+    def clear(self) -> None:
+        """Removes all ids, the allocated bitmap is kept."""
+        self.bits[:] = 0
+        self.count = 0
+
+    def to_array(self) -> np.ndarray:
+        """Returns the sorted ids of the set."""
+        return np.flatnonzero(np.unpackbits(self.bits, bitorder="little"))
+
+    def __or__(self, other: "Bitset") -> "Bitset":
+        """Returns the union of both sets."""
+        result = Bitset(size=8 * max(len(self.bits), len(other.bits)))
+        result.bits[: len(self.bits)] |= self.bits
+        result.bits[: len(other.bits)] |= other.bits
+        result.count = int(np.unpackbits(result.bits).sum())
+        return result
+
+    def __contains__(self, some_id) -> bool:
+        some_id = int(some_id)
+        return (
+            0 <= some_id
+            and some_id >> 3 < len(self.bits)
+            and bool(self.bits[some_id >> 3] & (1 << (some_id & 7)))
+        )
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.to_array().tolist())
+
+
+__all__ = ("Bitset",)
@@ -1,43 +1,41 @@
 import numpy as np
 import pandas as pd
+from rec_services.id_map import IdMap
 
 
 class Dataset:
     """
     Dataset class that represents the participants and their answers.
 
+    The rows of the answers pivot are the positions of id_map, it converts arrays of user ids
+    to rows and back, FAISS and the adjacency address the users by these rows.
+
     Args:
         :param answers_data: DataFrame with answers data
         :param participants_data: DataFrame with participants data
+        :param keep_partial: Keep the participants that did not answer every question (late joiners),
+            their missing answers stay NaN and answers_mask tells which answers exist
 
     """
 
-    def __init__(self, answers_data: pd.DataFrame, participants_data: pd.DataFrame):
-        self.participants = participants_data.copy()
+    def __init__(
+        self,
+        answers_data: pd.DataFrame,
+        participants_data: pd.DataFrame,
+        keep_partial: bool = False,
+    ):
+        # participants are looked up by user id, like the rows of the answers pivot
+        self.participants = participants_data.set_index("id", drop=False)
         self.answers = answers_data.copy()
         self.answers_pivot = answers_data.pivot(
             index="respondent_id", columns="field_id", values="option"
         )
         self.nan_responses = None
+        self.partial_responses = None
+        self.answers_mask = None
+        self.id_map = None
 
-        self.remove_nan_responses()
-
-    def contiguous_to_custom_index(self) -> dict:
-        """Returns a dictionary that maps the contiguous index to the custom index.
-            FAISS library uses contiguous index, so we need to map it to the custom index, because some participants can be removed.
-
-        Returns:
-            dict: Dictionary that maps the contiguous index to the custom index
-        """
-        return {i: j for i, j in enumerate(self.answers_pivot.index)}
-
-    def custom_to_contiguous_index(self) -> dict:
-        """Returns a dictionary that maps the custom index to the contiguous index.
-
-        Returns:
-            dict: Dictionary that maps the custom index to the contiguous index
-        """
-        return {j: i for i, j in enumerate(self.answers_pivot.index)}
+        self.clean_responses(keep_partial)
 
     def get_user_vector(self, user_id: int) -> np.ndarray:
         """Returns the user vector containing the numerical answers of the user_id.
@@ -48,16 +46,40 @@ class Dataset:
         Returns:
             np.ndarray: User vector
         """
-        return self.answers_pivot.loc[user_id].values.reshape(1, -1).astype(np.float32)
+        # the missing answers of partial respondents are zeros, see answers_mask
+        return (
+            self.answers_pivot.loc[user_id]
+            .fillna(0)
+            .values.reshape(1, -1)
+            .astype(np.float32)
+        )
+
+    def clean_responses(self, keep_partial: bool = False) -> None:
+        """Finds the participants with NaN responses and removes them unless keep_partial is set.
+
+        Args:
+            :param keep_partial: Keep the partial respondents instead of removing them
+        """
+        answered = self.answers_pivot.notna().to_numpy()
+        self.partial_responses = self.answers_pivot.index[
+            ~answered.all(axis=1)
+        ].to_list()
+        if keep_partial:
+            self.nan_responses = []
+            self.answers_mask = answered
+        else:
+            self.remove_nan_responses()
+            self.answers_mask = np.ones(self.answers_pivot.shape, dtype=bool)
+        # positions of the users are the rows of the answers pivot, the ids are sorted by pivot
+        self.id_map = IdMap(self.answers_pivot.index)
 
     def remove_nan_responses(self) -> None:
         """Removes all participants with NaN responses. If a participant has at least one NaN response, it is removed."""
         nan_responses = self.answers_pivot.isna().sum(axis=1)
         self.nan_responses = nan_responses[nan_responses > 0].index.to_list()
 
-        for i in self.nan_responses:
-            self.answers_pivot = self.answers_pivot.drop(i)
-            self.participants = self.participants.drop(i)
+        self.answers_pivot = self.answers_pivot.drop(self.nan_responses)
+        self.participants = self.participants.drop(self.nan_responses, errors="ignore")
 
 
 __all__ = ("Dataset",)
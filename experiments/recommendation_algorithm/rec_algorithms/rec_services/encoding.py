@@ -0,0 +1,77 @@
+import json
+from typing import List
+
+import numpy as np
+
+
+class AnswerEncoder:
+    """
+    One-hot encoding of the single-choice answers into packed bit vectors.
+
+    Every field gets one bit per option, a user sets the bit of the chosen option and no bit
+    of a field it did not answer. The bits are packed eight per byte, so 13 fields with up to
+    three options take 5 bytes instead of 52 bytes of float32. Options are categories, two
+    different options are equally far apart whatever their index.
+
+    For two users the Hamming distance of their codes is 2 for every field they answered
+    differently and 1 for every field only one of them answered, so it ranks complete
+    respondents by the number of equal answers.
+
+    Args:
+        :param n_options: Number of options of every field, in the order of the answer columns
+
+    """
+
+    def __init__(self, n_options: List[int]):
+        self.n_options = np.asarray(n_options, dtype=np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(self.n_options)[:-1]])
+        self.n_fields = len(self.n_options)
+        self.n_bits = int(self.n_options.sum())
+        self.n_bytes = (self.n_bits + 7) // 8
+
+    @classmethod
+    def from_fields(cls, fields: List[dict]) -> "AnswerEncoder":
+        """Creates the encoder of the questions of fields.json, the columns are sorted by field id.
+
+        Args:
+            :param fields: Questions with their id and options
+        """
+        return cls(
+            [len(field["options"]) for field in sorted(fields, key=lambda f: f["id"])]
+        )
+
+    @classmethod
+    def from_file(cls, path: str) -> "AnswerEncoder":
+        """Creates the encoder of a fields.json file.
+
+        Args:
+            :param path: Path of fields.json
+        """
+        with open(path, "r") as f:
+            return cls.from_fields(json.load(f))
+
+    def encode(self, options: np.ndarray, mask: np.ndarray = None) -> np.ndarray:
+        """Encodes the chosen options of many users.
+
+        Args:
+            :param options: Option indices of shape (n, n_fields), NaN or negative for missing answers
+            :param mask: Answered questions of shape (n, n_fields), by default the options that are not missing
+
+        Returns:
+            np.ndarray: uint8 codes of shape (n, n_bytes)
+        """
+        options = np.asarray(options, dtype=np.float64).reshape(-1, self.n_fields)
+        answered = np.nan_to_num(options, nan=-1) >= 0
+        if mask is not None:
+            answered &= np.asarray(mask, dtype=bool).reshape(options.shape)
+        chosen = np.nan_to_num(options, nan=0).astype(np.int64)
+        if (chosen >= self.n_options)[answered].any():
+            raise ValueError("Option index out of range of its field")
+
+        bits = np.zeros((len(options), self.n_bytes * 8), dtype=np.uint8)
+        rows, fields = np.nonzero(answered)
+        bits[rows, self.offsets[fields] + chosen[rows, fields]] = 1
+        return np.packbits(bits, axis=1)
+
+
+__all__ = ("AnswerEncoder",)
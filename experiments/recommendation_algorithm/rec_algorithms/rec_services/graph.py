@@ -1,38 +1,103 @@
+import threading
+from itertools import chain
 from typing import List
 
-import networkx as nx
+import numpy as np
 import pandas as pd
+from rec_services.id_map import IdMap
 
 
 class Graph:
     """
     Graph class that represents the participants and their connections.
 
+    The nodes are the positions of id_map. The subscriptions of the participants are loaded
+    once into a CSR adjacency of int32 positions (indptr, indices), the edges added later are
+    appended to a growable int32 array per source that doubles when it is full. Adding an edge
+    is amortized O(1) and a slice of k neighbours is O(k), neither depends on the number of
+    participants. The neighbours of a node are its subscriptions first, then the added edges
+    in the order they were added.
+
+    The graph is shared by the sessions of a model: add_edge runs under a lock, and readers
+    never see a partly added edge because the entry is written before the count that makes it
+    visible. The out-degree of every node is kept up to date in degrees.
+
     Args:
         :param participants_data: DataFrame with participants data
         :param nan_responses: List of participants with NaN responses
+        :param id_map: IdMap of the users of the graph, by default the participants without NaN responses
     """
 
     def __init__(
-        self, participants_data: pd.DataFrame, nan_responses: List[int] = None
+        self,
+        participants_data: pd.DataFrame,
+        nan_responses: List[int] = None,
+        id_map: IdMap = None,
     ):
         self.participants = participants_data.copy()
         self.nan_responses = nan_responses
-
-        self.graph = self.create_graph()
-
-    def create_graph(self) -> nx.DiGraph:
-        """Creates a directed graph with the participants.
+        if id_map is None:
+            ids = self.participants["id"].to_numpy()
+            id_map = IdMap(ids[~np.isin(ids, nan_responses or [])])
+        self.id_map = id_map
+
+        self.indptr, self.indices = self.create_graph()
+        self.degrees = np.diff(self.indptr)
+        # source position -> (int32 targets, number of used entries)
+        self.added = {}
+        self.n_added = 0
+        self._lock = threading.Lock()
+        # called with (source, target) ids after a new edge is added, e.g. to invalidate caches
+        self.edge_listeners = []
+
+    def create_graph(self) -> (np.ndarray, np.ndarray):
+        """Creates the CSR adjacency of the subscriptions between the nodes, duplicates are dropped.
 
         Returns:
-            nx.DiGraph: Directed graph with the participants
+            (np.ndarray, np.ndarray): indptr and indices, the neighbours of position i are indices[indptr[i]:indptr[i + 1]]
         """
-        graph = nx.DiGraph()
-
-        for index, row in self.participants.iterrows():
-            if row["id"] not in self.nan_responses:
-                graph.add_node(row["id"], **row.to_dict())
-        return graph
+        n_nodes = len(self.id_map)
+        subscriptions = (
+            self.participants.set_index("id")["subscription_ids"]
+            .reindex(self.id_map.ids)
+            .apply(lambda x: x if isinstance(x, list) else [])
+        )
+        lengths = subscriptions.map(len).values
+        sources = np.repeat(np.arange(n_nodes, dtype=np.int64), lengths)
+        targets = self.id_map.to_positions(
+            np.fromiter(
+                chain.from_iterable(subscriptions), dtype=np.int64, count=lengths.sum()
+            )
+        )
+        keep = targets >= 0
+        sources, targets = sources[keep], targets[keep]
+        # the first occurrence of every edge, in the order of the subscriptions
+        _, first = np.unique(sources * n_nodes + targets, return_index=True)
+        first.sort()
+
+        indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources[first], minlength=n_nodes), out=indptr[1:])
+        return indptr, targets[first].astype(np.int32)
+
+    def neighbor_positions(self, position: int, n: int = None) -> np.ndarray:
+        """Returns the positions of the first n neighbours of the node, all if n is None."""
+        start, stop = self.indptr[position], self.indptr[position + 1]
+        if n is not None:
+            stop = min(stop, start + n)
+        neighbors = self.indices[start:stop]
+        if position not in self.added or (n is not None and len(neighbors) >= n):
+            return neighbors
+        added, count = self.added[position]
+        if n is not None:
+            count = min(count, n - len(neighbors))
+        return np.concatenate([neighbors, added[:count]])
+
+    def _has_edge(self, source: int, target: int) -> bool:
+        start, stop = self.indptr[source], self.indptr[source + 1]
+        if (self.indices[start:stop] == target).any():
+            return True
+        added, count = self.added.get(source, (None, 0))
+        return count > 0 and bool((added[:count] == target).any())
 
     def add_edge(self, source: int, target: int) -> None:
         """Adds an edge between the source and target participants. Also, updates the subscription_ids in the participants data.
@@ -41,10 +106,47 @@ class Graph:
             :param source: Source participant id
             :param target: Target participant id
         """
-        self.graph.add_edge(source, target)
-        self.participants["subscription_ids"] = self.participants[
-            "subscription_ids"
-        ].apply(lambda x: x.append(target) if x == source else x)
+        source_position = self.id_map.to_position(source)
+        target_position = self.id_map.to_position(target)
+        with self._lock:
+            if self._has_edge(source_position, target_position):
+                return
+            added, count = self.added.get(source_position, (np.empty(0, np.int32), 0))
+            if count == len(added):
+                grown = np.empty(max(4, 2 * len(added)), dtype=np.int32)
+                grown[:count] = added
+                added = grown
+            added[count] = target_position
+            self.added[source_position] = (added, count + 1)
+            self.degrees[source_position] += 1
+            self.n_added += 1
+
+            if source in self.participants.index:
+                # a new list, the lists are shared with the dataset the participants
+                # were copied from
+                self.participants.at[source, "subscription_ids"] = [
+                    *self.participants.at[source, "subscription_ids"],
+                    target,
+                ]
+        # outside of the lock, the listeners may read the graph
+        for listener in self.edge_listeners:
+            listener(source, target)
+
+    def added_edges(self) -> (np.ndarray, np.ndarray):
+        """Returns the edges added with add_edge as int64 (source, target) position arrays."""
+        with self._lock:
+            items = [
+                (source, added[:count].copy())
+                for source, (added, count) in self.added.items()
+            ]
+        sources = [
+            np.full(len(targets), source, dtype=np.int64) for source, targets in items
+        ]
+        targets = [targets.astype(np.int64) for _, targets in items]
+        return (
+            np.concatenate([np.empty(0, np.int64), *sources]),
+            np.concatenate([np.empty(0, np.int64), *targets]),
+        )
 
     def get_n_neighbors(self, node_id: int, n: int) -> List[int]:
         """Returns the first n neighbors of the node_id.
@@ -53,7 +155,9 @@ class Graph:
             :param node_id: Node id
             :param n: Number of neighbors to return
         """
-        return list(self.graph.neighbors(node_id))[:n]
+        return self.id_map.to_ids(
+            self.neighbor_positions(self.id_map.to_position(node_id), n)
+        ).tolist()
 
     def get_neighbors(self, node_id: int) -> List[int]:
         """Returns all neighbors of the node_id.
@@ -61,7 +165,9 @@ class Graph:
         Args:
             :param node_id: Node id
         """
-        return list(self.graph.neighbors(node_id))
+        return self.id_map.to_ids(
+            self.neighbor_positions(self.id_map.to_position(node_id))
+        ).tolist()
 
     def is_neighbors(self, source: int, target: int) -> bool:
         """Checks if the source and target participants are neighbors.
@@ -70,7 +176,10 @@ class Graph:
             :param source: Source participant id
             :param target: Target participant id
         """
-        return self.graph.has_edge(source, target)
+        source_position, target_position = self.id_map.to_positions([source, target])
+        if source_position < 0 or target_position < 0:
+            return False
+        return self._has_edge(source_position, target_position)
 
 
 __all__ = ("Graph",)
@@ -0,0 +1,106 @@
+import numpy as np
+
+
+class IdMap:
+    """
+    Immutable mapping between user ids and contiguous positions 0..n-1.
+
+    FAISS, the CSR adjacency and the answer matrices address users by their position, the
+    rest of the code by their id. The ids are kept in a sorted array, so whole arrays of ids
+    are converted with one binary search and positions are converted back with one take.
+    Both arrays are read-only, the map can be shared between threads.
+
+    Args:
+        :param ids: Unique user ids, the position of an id is its index in this sequence
+
+    """
+
+    def __init__(self, ids):
+        ids = np.array(ids, dtype=np.int64).ravel()
+        order = np.argsort(ids, kind="stable")
+        sorted_ids = ids[order]
+        if len(ids) > 1 and (sorted_ids[1:] == sorted_ids[:-1]).any():
+            raise ValueError("User ids must be unique")
+        # the order is only needed when the positions are not sorted by id
+        self._order = None if (order == np.arange(len(ids))).all() else order
+        self._sorted = sorted_ids
+        self._ids = ids
+        for array in (self._ids, self._sorted, self._order):
+            if array is not None:
+                array.flags.writeable = False
+
+    @property
+    def ids(self) -> np.ndarray:
+        """User ids in position order, read-only."""
+        return self._ids
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, user_id) -> bool:
+        return bool(self.contains([user_id])[0])
+
+    def _lookup(self, user_ids) -> (np.ndarray, np.ndarray):
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        if not len(self._sorted):
+            empty = np.zeros(user_ids.shape, dtype=np.int64)
+            return empty, empty.astype(bool)
+        rows = np.minimum(
+            np.searchsorted(self._sorted, user_ids), len(self._sorted) - 1
+        )
+        found = self._sorted[rows] == user_ids
+        return (rows if self._order is None else self._order[rows]), found
+
+    def contains(self, user_ids) -> np.ndarray:
+        """Returns which of the user ids are in the map.
+
+        Args:
+            :param user_ids: User ids
+
+        Returns:
+            np.ndarray: Boolean array of the shape of user_ids
+        """
+        return self._lookup(user_ids)[1]
+
+    def to_positions(self, user_ids, missing: int = -1) -> np.ndarray:
+        """Returns the positions of the user ids.
+
+        Args:
+            :param user_ids: User ids
+            :param missing: Position of the ids that are not in the map, None raises KeyError
+
+        Returns:
+            np.ndarray: Positions of the shape of user_ids
+        """
+        positions, found = self._lookup(user_ids)
+        if missing is None:
+            if not found.all():
+                raise KeyError(np.asarray(user_ids)[~found].ravel()[0].item())
+            return positions
+        return np.where(found, positions, missing)
+
+    def to_position(self, user_id: int) -> int:
+        """Returns the position of the user id, KeyError if it is not in the map.
+
+        Args:
+            :param user_id: User id
+        """
+        return int(self.to_positions([user_id], missing=None)[0])
+
+    def to_ids(self, positions, missing: int = -1) -> np.ndarray:
+        """Returns the user ids at the positions, negative positions are FAISS padding.
+
+        Args:
+            :param positions: Positions
+            :param missing: Id returned for the negative positions
+
+        Returns:
+            np.ndarray: User ids of the shape of positions
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        if not len(self._ids):
+            return np.full(positions.shape, missing, dtype=np.int64)
+        return np.where(positions >= 0, self._ids[np.maximum(positions, 0)], missing)
+
+
+__all__ = ("IdMap",)
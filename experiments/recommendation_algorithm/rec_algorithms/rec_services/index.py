@@ -0,0 +1,232 @@
+import math
+from typing import List, Tuple
+
+import faiss
+import numpy as np
+
+from rec_services.bitset import Bitset
+
+INDEX_BACKENDS = ("flat", "ivf", "hnsw", "pq", "ivfpq")
+
+# FAISS k-means wants at least this many training vectors per centroid
+MIN_POINTS_PER_CENTROID = 39
+
+
+def _default_nlist(n_vectors: int) -> int:
+    return max(
+        1, min(n_vectors // MIN_POINTS_PER_CENTROID, int(4 * math.sqrt(n_vectors)))
+    )
+
+
+def _default_nbits(n_vectors: int) -> int:
+    return max(
+        1, min(8, int(math.log2(max(n_vectors // MIN_POINTS_PER_CENTROID, 2))))
+    )
+
+
+def create_index(
+    dimension: int, backend: str = "flat", n_vectors: int = 0, **params
+) -> faiss.Index:
+    """Creates an empty L2 index of the given backend.
+
+    Args:
+        :param dimension: Dimension of the vectors
+        :param backend: One of INDEX_BACKENDS
+        :param n_vectors: Expected number of vectors, used to pick defaults for nlist and nbits
+        :param params: Build parameters of the backend:
+            ivf: nlist; hnsw: M, ef_construction; pq: m, nbits; ivfpq: nlist, m, nbits
+
+    Returns:
+        faiss.Index: Index that still has to be trained (if needed) and filled
+    """
+    if backend == "flat":
+        return faiss.IndexFlatL2(dimension)
+    if backend == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, params.get("M", 32))
+        index.hnsw.efConstruction = params.get("ef_construction", 40)
+        return index
+    if backend not in INDEX_BACKENDS:
+        raise ValueError(
+            f"Unknown index backend {backend}, use one of {INDEX_BACKENDS}"
+        )
+
+    nlist = params.get("nlist", _default_nlist(n_vectors))
+    # The number of sub-quantizers must divide the dimension
+    m = params.get("m", dimension)
+    nbits = params.get("nbits", _default_nbits(n_vectors))
+    if backend == "pq":
+        return faiss.IndexPQ(dimension, m, nbits)
+    if backend == "ivf":
+        index = faiss.IndexIVFFlat(faiss.IndexFlatL2(dimension), dimension, nlist)
+    else:
+        index = faiss.IndexIVFPQ(
+            faiss.IndexFlatL2(dimension), dimension, nlist, m, nbits
+        )
+    # FAISS probes a single list by default, which loses most neighbours
+    index.nprobe = min(nlist, 16)
+    return index
+
+
+def set_search_params(index: faiss.Index, **params) -> None:
+    """Sets the search-time parameters of the index.
+
+    Args:
+        :param index: FAISS index
+        :param params: nprobe for IVF indexes, ef_search for HNSW indexes
+    """
+    if "nprobe" in params and hasattr(index, "nprobe"):
+        index.nprobe = params["nprobe"]
+    if "ef_search" in params and hasattr(index, "hnsw"):
+        index.hnsw.efSearch = params["ef_search"]
+
+
+def build_index(
+    vectors: np.ndarray,
+    backend: str = "flat",
+    build_params: dict = None,
+    search_params: dict = None,
+    ids: np.ndarray = None,
+) -> faiss.Index:
+    """Creates, trains and fills an index with the vectors.
+
+    Args:
+        :param vectors: Vectors to add, one per row
+        :param backend: One of INDEX_BACKENDS
+        :param build_params: Parameters passed to create_index
+        :param search_params: Parameters passed to set_search_params
+        :param ids: Custom ids of the vectors, the index returns them instead of row numbers
+
+    Returns:
+        faiss.Index: Index ready for searching
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    index = create_index(
+        vectors.shape[1], backend, len(vectors), **(build_params or {})
+    )
+    if not index.is_trained:
+        index.train(vectors)
+    set_search_params(index, **(search_params or {}))
+    if ids is None:
+        index.add(vectors)
+        return index
+
+    index = faiss.IndexIDMap(index)
+    index.add_with_ids(vectors, np.ascontiguousarray(ids, dtype=np.int64))
+    return index
+
+
+def build_binary_index(codes: np.ndarray, ids: np.ndarray = None) -> faiss.IndexBinary:
+    """Creates a brute-force Hamming index of packed binary codes.
+
+    Args:
+        :param codes: uint8 codes, one per row, see rec_services.encoding.AnswerEncoder
+        :param ids: Custom ids of the codes, the index returns them instead of row numbers
+
+    Returns:
+        faiss.IndexBinary: Index whose distances are Hamming distances
+    """
+    codes = np.ascontiguousarray(codes, dtype=np.uint8)
+    index = faiss.IndexBinaryFlat(8 * codes.shape[1])
+    if ids is None:
+        index.add(codes)
+        return index
+
+    index = faiss.IndexBinaryIDMap(index)
+    index.add_with_ids(codes, np.ascontiguousarray(ids, dtype=np.int64))
+    return index
+
+
+def _selector_params(index: faiss.Index, selector: faiss.IDSelector):
+    """Search parameters that keep the configured nprobe/efSearch of the index."""
+    if isinstance(index, faiss.IndexIDMap):
+        index = faiss.downcast_index(index.index)
+    if hasattr(index, "nprobe"):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=index.nprobe)
+    if hasattr(index, "hnsw"):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+def search_index(
+    index: faiss.Index, queries: np.ndarray, k: int, exclude: Bitset = None
+) -> (np.ndarray, np.ndarray):
+    """Searches the k nearest neighbours whose ids are not in `exclude`.
+
+    The excluded ids are skipped inside FAISS through a bitmap selector, so the index never has
+    to be rebuilt. Backends without selector support over-fetch k + len(exclude) neighbours and
+    filter them. Missing results are padded with id -1 like FAISS does.
+
+    Args:
+        :param index: FAISS index
+        :param queries: Query vectors, one per row
+        :param k: Number of neighbours
+        :param exclude: Ids that must not be returned
+
+    Returns:
+        (np.ndarray, np.ndarray): Distances and ids of the neighbours
+    """
+    if exclude is None or not len(exclude):
+        return index.search(queries, k)
+
+    # the size of the bitmap is given in bytes
+    selector = faiss.IDSelectorNot(
+        faiss.IDSelectorBitmap(len(exclude.bits), faiss.swig_ptr(exclude.bits))
+    )
+    try:
+        return index.search(queries, k, params=_selector_params(index, selector))
+    except RuntimeError:
+        pass
+
+    fetched = min(k + len(exclude), index.ntotal)
+    distances, ids = index.search(queries, fetched)
+    keep = (ids >= 0) & ~np.isin(ids, exclude.to_array())
+    result_distances = np.full((len(queries), k), np.inf, dtype=distances.dtype)
+    result_ids = np.full((len(queries), k), -1, dtype=ids.dtype)
+    for row in range(len(queries)):
+        kept = np.flatnonzero(keep[row])[:k]
+        result_distances[row, : len(kept)] = distances[row, kept]
+        result_ids[row, : len(kept)] = ids[row, kept]
+    return result_distances, result_ids
+
+
+def search_index_batch(
+    index: faiss.Index, queries: np.ndarray, k: int, excludes: list
+) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """Searches the k nearest neighbours of many queries in one call, each with its own exclusions.
+
+    A selector can only hold the exclusions of one query, so the batch over-fetches by the
+    largest exclusion set and filters every row by its own exclusions.
+
+    Args:
+        :param index: FAISS index
+        :param queries: Query vectors, one per row
+        :param k: Number of neighbours
+        :param excludes: Ids that must not be returned, one Bitset or set per query
+
+    Returns:
+        List[Tuple[np.ndarray, np.ndarray]]: Distances and ids of the neighbours of every query, at most k of them
+    """
+    fetched = min(k + max((len(e) for e in excludes), default=0), index.ntotal)
+    dtype = np.uint8 if isinstance(index, faiss.IndexBinary) else np.float32
+    distances, ids = index.search(np.ascontiguousarray(queries, dtype=dtype), fetched)
+    results = []
+    for row_distances, row_ids, exclude in zip(distances, ids, excludes):
+        keep = np.fromiter(
+            (i >= 0 and i not in exclude for i in row_ids.tolist()),
+            dtype=bool,
+            count=len(row_ids),
+        )
+        kept = np.flatnonzero(keep)[:k]
+        results.append((row_distances[kept], row_ids[kept]))
+    return results
+
+
+__all__ = (
+    "INDEX_BACKENDS",
+    "create_index",
+    "set_search_params",
+    "build_index",
+    "build_binary_index",
+    "search_index",
+    "search_index_batch",
+)
@@ -0,0 +1,143 @@
+import asyncio
+import time
+from collections import deque
+from typing import List
+
+import numpy as np
+from rec_services.bitset import Bitset
+from rec_services.model import RecommendationModel
+
+
+class MicroBatcher:
+    """
+    Collects concurrent searches into micro-batches, so one index.search serves many requests.
+
+    A batch is closed when it holds max_batch_size queries or when its first query has waited
+    max_wait seconds. The search runs in the default executor, the event loop keeps accepting
+    requests meanwhile.
+
+    Args:
+        :param model: Shared RecommendationModel, its search_batch serves the batches
+        :param max_batch_size: Largest number of queries searched at once
+        :param max_wait: Longest time in seconds a query waits for the batch to fill up
+        :param window: Number of recent requests and batches the stats are computed over
+
+    """
+
+    def __init__(
+        self,
+        model: RecommendationModel,
+        max_batch_size: int = 64,
+        max_wait: float = 0.002,
+        window: int = 10000,
+    ):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self.queue = None
+        self.latencies = deque(maxlen=window)
+        self.batch_sizes = deque(maxlen=window)
+        self.requests = 0
+        self.batches = 0
+        self._worker = None
+
+    def start(self) -> None:
+        """Starts the batching worker on the running event loop."""
+        self.queue = asyncio.Queue()
+        self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stops the batching worker."""
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+
+    async def search(
+        self, vector: np.ndarray, k: int, exclude: Bitset, mask: np.ndarray = None
+    ) -> List[int]:
+        """Returns the k users most similar to the vector that are not excluded.
+
+        Args:
+            :param vector: Query vector of shape (1, d)
+            :param k: Number of users
+            :param exclude: Users that must not be returned, it must not change until the result is ready
+            :param mask: Questions answered by the query, all by default
+        """
+        if mask is None:
+            mask = np.ones(vector.shape[-1], dtype=bool)
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((time.perf_counter(), vector, mask, k, exclude, future))
+        return await future
+
+    async def _collect(self) -> list:
+        batch = [await self.queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            queries = np.concatenate([vector for _, vector, *_ in batch])
+            masks = np.stack([mask for _, _, mask, *_ in batch])
+            k = max(request_k for _, _, _, request_k, _, _ in batch)
+            try:
+                results = await loop.run_in_executor(
+                    None,
+                    self.model.search_batch,
+                    queries,
+                    k,
+                    [exclude for *_, exclude, _ in batch],
+                    masks,
+                )
+            except Exception as e:
+                for *_, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            finished = time.perf_counter()
+            for (started, _, _, request_k, _, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result[:request_k])
+                self.latencies.append(finished - started)
+            self.requests += len(batch)
+            self.batches += 1
+            self.batch_sizes.append(len(batch))
+
+    def stats(self) -> dict:
+        """Returns the queue depth, the batch sizes and the latency percentiles in milliseconds."""
+        latencies = 1000 * np.array(self.latencies)
+        return {
+            "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+            "requests": self.requests,
+            "batches": self.batches,
+            "mean_batch_size": (
+                float(np.mean(self.batch_sizes)) if self.batch_sizes else None
+            ),
+            "latency_p50_ms": (
+                float(np.percentile(latencies, 50)) if len(latencies) else None
+            ),
+            "latency_p99_ms": (
+                float(np.percentile(latencies, 99)) if len(latencies) else None
+            ),
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": 1000 * self.max_wait,
+        }
+
+
+__all__ = ("MicroBatcher",)
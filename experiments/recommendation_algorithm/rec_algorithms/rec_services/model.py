@@ -0,0 +1,618 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import chain
+from typing import List
+
+import faiss
+import numpy as np
+from rec_services.bitset import Bitset
+from rec_services.dataset import Dataset
+from rec_services.encoding import AnswerEncoder
+from rec_services.graph import Graph
+from rec_services.id_map import IdMap
+from rec_services.index import (
+    MIN_POINTS_PER_CENTROID,
+    build_binary_index,
+    build_index,
+    search_index,
+    search_index_batch,
+)
+from rec_services.ppr import PersonalizedPageRank
+from rec_services.user import User
+from scipy import sparse
+from sklearn.preprocessing import normalize
+
+
+class RecommendationModel:
+    """
+    Read-only data of the recommender that is built once and shared by all sessions.
+
+    The users are the rows of the answers pivot, ids are mapped to rows and back by the
+    IdMap of the dataset. The subscriptions between them are kept as
+    a CSR adjacency (indptr, indices) over the rows, and the searches of all sessions run on
+    shared FAISS indexes and one thread pool. The arrays are marked read-only.
+
+    Users are compared only on the questions both of them answered (masked cosine similarity).
+    The users are grouped by the set of questions they answered, and a query is searched in
+    every group on an index of the questions it shares with the group, with the vectors
+    normalized over exactly these questions. The distances are then comparable across the
+    groups. If everybody answered every question, there is one group and one index.
+
+    With an AnswerEncoder the answers are compared as categories instead: every user is a
+    packed one-hot code and all users are searched in one binary index by Hamming distance,
+    a missing answer simply sets no bit, so no groups are needed.
+
+    The only mutable part is the friendship graph: accepted candidates are added to it under
+    its lock, and both the friend-of-friend products and the personalized PageRank that
+    hybrid_search fuses with the content similarity follow the added edges. The PPR vectors
+    are pushed on the first request of a user, or ahead of the requests by a background
+    thread with precompute_ppr, cached and dropped locally when an edge is added.
+
+    Args:
+        :param dataset: Dataset object
+        :param index_backend: FAISS index backend, one of rec_services.index.INDEX_BACKENDS
+        :param index_build_params: Build parameters of the index backend
+        :param index_search_params: Search parameters of the index backend
+        :param search_workers: Number of threads that run the prefetched searches
+        :param encoder: Encoder of the answers into binary codes, the float indexes are not built if it is given
+        :param precompute_ppr: Push the PPR vectors of all users in a background thread instead of on demand
+
+    """
+
+    def __init__(
+        self,
+        dataset: Dataset,
+        index_backend: str = "flat",
+        index_build_params: dict = None,
+        index_search_params: dict = None,
+        search_workers: int = None,
+        encoder: AnswerEncoder = None,
+        precompute_ppr: bool = False,
+    ):
+        answers_pivot = dataset.answers_pivot
+        self.id_map: IdMap = dataset.id_map
+        self.ids = self.id_map.ids
+        self.masks = answers_pivot.notna().to_numpy()
+        self.vectors = np.ascontiguousarray(
+            answers_pivot.fillna(0).values, dtype=np.float32
+        )
+        self.indptr, self.indices = self.create_adjacency(dataset)
+
+        patterns, group_of = np.unique(self.masks, axis=0, return_inverse=True)
+        # group of the users with the same answered questions: (questions, rows)
+        self.groups = [
+            (pattern, np.flatnonzero(group_of.ravel() == group))
+            for group, pattern in enumerate(patterns)
+        ]
+        for array in (self.masks, self.vectors, self.indptr, self.indices):
+            array.flags.writeable = False
+        # 0/1 subscription matrix for the friend-of-friend products, duplicates are merged
+        self.adjacency = sparse.csr_matrix(
+            (np.ones(len(self.indices), dtype=np.int32), self.indices, self.indptr),
+            shape=(len(self.ids), len(self.ids)),
+        )
+        self.adjacency.sum_duplicates()
+        self.adjacency.data[:] = 1
+        self.graph = Graph(dataset.participants, id_map=self.id_map)
+        # (graph.n_added, 0/1 matrix of the edges added to the graph)
+        self._added_adjacency = (
+            0,
+            sparse.csr_matrix(self.adjacency.shape, dtype=np.int32),
+        )
+        self.ppr = PersonalizedPageRank(self.graph)
+
+        self.index_backend = index_backend
+        self.index_build_params = index_build_params
+        self.index_search_params = index_search_params
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self.encoder = encoder
+        self.codes = None
+        if encoder is not None:
+            if encoder.n_fields != answers_pivot.shape[1]:
+                raise ValueError(
+                    f"The encoder has {encoder.n_fields} fields, "
+                    f"the answers have {answers_pivot.shape[1]} questions"
+                )
+            self.codes = encoder.encode(answers_pivot.values)
+            self.codes.flags.writeable = False
+            self.index = build_binary_index(self.codes, self.ids)
+        else:
+            for group, (pattern, rows) in enumerate(self.groups):
+                self.get_group_index(group, pattern)
+            # index of the users that answered every question, if there are any
+            last_pattern = self.groups[-1][0]
+            self.index = (
+                self._indexes[(len(self.groups) - 1, last_pattern.tobytes())]
+                if last_pattern.all()
+                else None
+            )
+
+        self.executor = ThreadPoolExecutor(max_workers=search_workers)
+        self._stop = threading.Event()
+        if precompute_ppr:
+            threading.Thread(
+                target=self.ppr.precompute, kwargs={"stop": self._stop}, daemon=True
+            ).start()
+
+    def create_adjacency(self, dataset: Dataset) -> (np.ndarray, np.ndarray):
+        """Creates the CSR adjacency of the subscriptions between the indexed users.
+
+        Args:
+            :param dataset: Dataset object
+
+        Returns:
+            (np.ndarray, np.ndarray): indptr and indices, the neighbours of row i are indices[indptr[i]:indptr[i + 1]]
+        """
+        subscriptions = (
+            dataset.participants["subscription_ids"]
+            .reindex(self.ids)
+            .apply(lambda x: x if isinstance(x, list) else [])
+        )
+        lengths = subscriptions.map(len).values
+        sources = np.repeat(np.arange(len(self.ids), dtype=np.int64), lengths)
+        targets = self.positions(
+            np.fromiter(
+                chain.from_iterable(subscriptions), dtype=np.int64, count=lengths.sum()
+            )
+        )
+        keep = targets >= 0
+        indptr = np.zeros(len(self.ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources[keep], minlength=len(self.ids)), out=indptr[1:])
+        return indptr, targets[keep]
+
+    def positions(self, user_ids) -> np.ndarray:
+        """Returns the rows of the users, -1 for the users that are not indexed.
+
+        Args:
+            :param user_ids: User ids
+
+        Returns:
+            np.ndarray: Rows of the users
+        """
+        return self.id_map.to_positions(user_ids)
+
+    def position(self, user_id: int) -> int:
+        """Returns the row of the user.
+
+        Args:
+            :param user_id: User id
+
+        Returns:
+            int: Row of the user, KeyError if the user is not indexed
+        """
+        return self.id_map.to_position(user_id)
+
+    def get_user_vector(self, user_id: int) -> np.ndarray:
+        """Returns the user vector containing the numerical answers of the user_id.
+
+        Args:
+            :param user_id: User id
+
+        Returns:
+            np.ndarray: User vector of shape (1, d)
+        """
+        row = self.position(user_id)
+        return self.vectors[row : row + 1]
+
+    def get_subscriptions(self, user_id: int) -> List[int]:
+        """Returns the indexed users the user is subscribed to.
+
+        Args:
+            :param user_id: User id
+        """
+        row = self.position(user_id)
+        return self.id_map.to_ids(
+            self.indices[self.indptr[row] : self.indptr[row + 1]]
+        ).tolist()
+
+    def create_user(self, user_id: int) -> User:
+        """Returns a new user with its vector and subscriptions.
+
+        Args:
+            :param user_id: User id
+        """
+        return User(
+            user_id,
+            self.get_user_vector(user_id),
+            self.get_subscriptions(user_id),
+            self.get_user_mask(user_id),
+        )
+
+    def get_user_mask(self, user_id: int) -> np.ndarray:
+        """Returns which questions the user answered.
+
+        Args:
+            :param user_id: User id
+
+        Returns:
+            np.ndarray: Boolean mask of shape (d,)
+        """
+        return self.masks[self.position(user_id)]
+
+    def get_group_index(self, group: int, columns: np.ndarray) -> faiss.Index:
+        """Returns the index of the users of the group over the given questions, it is built once.
+
+        Args:
+            :param group: Position of the group in groups
+            :param columns: Boolean mask of the questions, a subset of the questions of the group
+
+        Returns:
+            faiss.Index: Index of the normalized sub-vectors with custom user ids
+        """
+        key = (group, columns.tobytes())
+        if key not in self._indexes:
+            with self._lock:
+                if key not in self._indexes:
+                    rows = self.groups[group][1]
+                    # small groups of late joiners are too small to train an index on
+                    backend = (
+                        self.index_backend
+                        if len(rows) >= MIN_POINTS_PER_CENTROID
+                        else "flat"
+                    )
+                    self._indexes[key] = build_index(
+                        normalize(self.vectors[rows][:, columns]),
+                        backend,
+                        self.index_build_params,
+                        self.index_search_params,
+                        ids=self.ids[rows],
+                    )
+        return self._indexes[key]
+
+    def _plan(self, vectors: np.ndarray, masks: np.ndarray = None):
+        """Yields the queries, the index and the normalized sub-vectors (or codes) of every search."""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.masks.shape[1])
+        if masks is None:
+            masks = np.ones(vectors.shape, dtype=bool)
+        if self.encoder is not None:
+            codes = self.encoder.encode(vectors, masks)
+            yield np.arange(len(vectors)), self.index, codes
+            return
+        patterns, pattern_of = np.unique(masks, axis=0, return_inverse=True)
+        for pattern_id, pattern in enumerate(patterns):
+            queries = np.flatnonzero(pattern_of.ravel() == pattern_id)
+            for group, (group_pattern, _) in enumerate(self.groups):
+                columns = pattern & group_pattern
+                if not columns.any():  # nothing to compare on
+                    continue
+                yield queries, self.get_group_index(group, columns), np.ascontiguousarray(
+                    normalize(vectors[queries][:, columns]), dtype=np.float32
+                )
+
+    @staticmethod
+    def _merge(found: list, n: int) -> (List[int], List[float]):
+        if not found:
+            return [], []
+        distances = np.concatenate([d for d, _ in found])
+        ids = np.concatenate([i for _, i in found])
+        order = np.argsort(distances, kind="stable")[:n]
+        return ids[order].tolist(), distances[order].tolist()
+
+    def search(
+        self,
+        vector: np.ndarray,
+        n: int,
+        exclude: Bitset = None,
+        mask: np.ndarray = None,
+        return_distances: bool = False,
+    ):
+        """Returns the n users most similar to the vector that are not excluded.
+
+        Args:
+            :param vector: Query vector of shape (1, d)
+            :param n: Number of users
+            :param exclude: Users that must not be returned
+            :param mask: Questions answered by the query, all by default
+            :param return_distances: Also return the L2 distances of the normalized sub-vectors
+
+        Returns:
+            List[int]: Users, the most similar first (and their distances)
+        """
+        found = []
+        for _, index, queries in self._plan(
+            vector, None if mask is None else mask.reshape(1, -1)
+        ):
+            distances, indices = search_index(index, queries, n, exclude)
+            keep = indices[0] >= 0
+            found.append((distances[0][keep], indices[0][keep]))
+        ids, distances = self._merge(found, n)
+        return (ids, distances) if return_distances else ids
+
+    def search_batch(
+        self,
+        vectors: np.ndarray,
+        n: int,
+        excludes: list,
+        masks: np.ndarray = None,
+        return_distances: bool = False,
+    ):
+        """Searches many queries with one index.search per group and question subset.
+
+        Args:
+            :param vectors: Query vectors, one per row
+            :param n: Number of users per query
+            :param excludes: Users that must not be returned, one Bitset or set per query
+            :param masks: Questions answered by the queries, all by default
+            :param return_distances: Also return the distances
+
+        Returns:
+            List[List[int]]: Users of every query (and their distances)
+        """
+        found = [[] for _ in range(len(vectors))]
+        for queries, index, sub_vectors in self._plan(vectors, masks):
+            results = search_index_batch(
+                index, sub_vectors, n, [excludes[q] for q in queries]
+            )
+            for query, result in zip(queries, results):
+                found[query].append(result)
+        merged = [self._merge(result, n) for result in found]
+        if return_distances:
+            return merged
+        return [ids for ids, _ in merged]
+
+    def hybrid_search(
+        self,
+        user_id: int,
+        vector: np.ndarray,
+        n: int,
+        exclude: Bitset = None,
+        mask: np.ndarray = None,
+        graph_weight: float = 0.7,
+        content_weight: float = 0.3,
+        fetch: int = None,
+        return_scores: bool = False,
+    ):
+        """Ranks the users by graph_weight * graph proximity + content_weight * content similarity.
+
+        One index search over-fetches the users most similar by content, see
+        content_similarity. The graph proximity is looked up in the cached PPR vector of the
+        user and scaled by the largest proximity among the candidates.
+
+        Args:
+            :param user_id: User the graph proximity is personalized for
+            :param vector: Query vector of shape (1, d)
+            :param n: Number of users
+            :param exclude: Users that must not be returned
+            :param mask: Questions answered by the query, all by default
+            :param graph_weight: Weight of the graph proximity
+            :param content_weight: Weight of the content similarity
+            :param fetch: Number of content candidates that are re-ranked, 4 * n by default
+            :param return_scores: Also return the hybrid scores
+
+        Returns:
+            List[int]: Users other than the user, the best first (and their scores)
+        """
+        ids, distances = self.search(
+            vector, fetch or 4 * n, exclude, mask, return_distances=True
+        )
+        ids, distances = np.asarray(ids, dtype=np.int64), np.asarray(distances)
+        # the user is the closest to itself in both scores
+        others = ids != user_id
+        ids, distances = ids[others], distances[others]
+        content = self.content_similarity(distances)
+        graph = self.ppr.scores(user_id, ids)
+        if len(graph) and graph.max() > 0:
+            graph /= graph.max()
+        scores = graph_weight * graph + content_weight * content
+        order = np.argsort(-scores, kind="stable")[:n]
+        return (
+            (ids[order].tolist(), scores[order].tolist())
+            if return_scores
+            else ids[order].tolist()
+        )
+
+    def content_similarity(self, distances) -> np.ndarray:
+        """Converts the distances of the searches into similarities in [-1, 1].
+
+        The cosine similarity is 1 - d / 2 for the squared L2 distance d of normalized vectors.
+        For binary codes it is 1 - d / (2 * number of fields), the share of equal answers.
+
+        Args:
+            :param distances: Distances returned by search
+
+        Returns:
+            np.ndarray: float32 similarities
+        """
+        distances = np.asarray(distances, dtype=np.float32)
+        if self.encoder is not None:
+            return 1 - distances / (2 * self.encoder.n_fields)
+        return 1 - distances / 2
+
+    def add_friend(self, user_id: int, friend_id: int) -> None:
+        """Adds the friendship to the graph.
+
+        The friend-of-friend products see the new edge, and the PPR vectors that went through
+        the user are dropped.
+
+        Args:
+            :param user_id: User id
+            :param friend_id: Accepted candidate
+        """
+        self.graph.add_edge(user_id, friend_id)
+
+    def added_adjacency(self) -> sparse.csr_matrix:
+        """Returns the 0/1 matrix of the edges added to the graph, rebuilt only after new edges."""
+        n_added, matrix = self._added_adjacency
+        if n_added != self.graph.n_added:
+            n_added = self.graph.n_added
+            sources, targets = self.graph.added_edges()
+            matrix = sparse.csr_matrix(
+                (np.ones(len(sources), dtype=np.int32), (sources, targets)),
+                shape=self.adjacency.shape,
+            )
+            self._added_adjacency = (n_added, matrix)
+        return matrix
+
+    def friends_of_friends_batch(
+        self,
+        user_ids,
+        n: int,
+        excludes: list = None,
+        friends: list = None,
+        return_counts: bool = False,
+    ):
+        """Ranks the friends of the friends of many users with one sparse product.
+
+        The friends of the users are the rows of a 0/1 sparse matrix F, their subscriptions,
+        the edges added to the graph and the extra friends. The product of F with the
+        subscriptions and the added edges holds, for every user and every user reachable in
+        two hops, the number of friends subscribed to the candidate. Candidates
+        are ranked by this number of common friends, ties by the smaller id. The user itself,
+        its friends and its excluded users are dropped.
+
+        Args:
+            :param user_ids: Indexed user ids
+            :param n: Number of candidates per user
+            :param excludes: Users that must not be returned, one Bitset or set per user
+            :param friends: Friends of every user that are not in the adjacency, e.g. accepted in a session
+            :param return_counts: Also return the numbers of common friends
+
+        Returns:
+            List[List[int]]: Candidates of every user, the most common friends first (and the counts)
+        """
+        rows = self.id_map.to_positions(user_ids, missing=None).reshape(-1)
+        if not len(rows):
+            return []
+        n_ids = len(self.ids)
+        added = self.added_adjacency()
+        # the added edges are never subscriptions, so the sum stays 0/1
+        friend_matrix = self.adjacency[rows] + added[rows]
+        if friends is not None:
+            lengths = np.array([len(f) for f in friends], dtype=np.int64)
+            columns = self.id_map.to_positions(
+                np.fromiter(
+                    chain.from_iterable(friends), dtype=np.int64, count=lengths.sum()
+                )
+            )
+            queries = np.repeat(np.arange(len(rows)), lengths)
+            keep = columns >= 0
+            friend_matrix = friend_matrix + sparse.csr_matrix(
+                (np.ones(keep.sum(), dtype=np.int32), (queries[keep], columns[keep])),
+                shape=friend_matrix.shape,
+            )
+            friend_matrix.data[:] = 1
+
+        products = (friend_matrix @ self.adjacency + friend_matrix @ added).tocoo()
+        query, candidate, count = products.row, products.col, products.data
+        # (query, user) keys of the users that must not be candidates of the query
+        friend_matrix = friend_matrix.tocoo()
+        dropped = [friend_matrix.row.astype(np.int64) * n_ids + friend_matrix.col]
+        for i, exclude in enumerate(excludes or []):
+            if exclude:
+                excluded = self.id_map.to_positions(
+                    exclude.to_array()
+                    if isinstance(exclude, Bitset)
+                    else np.fromiter(exclude, dtype=np.int64, count=len(exclude))
+                )
+                dropped.append(i * n_ids + excluded[excluded >= 0])
+        keep = (candidate != rows[query]) & ~np.isin(
+            query.astype(np.int64) * n_ids + candidate, np.concatenate(dropped)
+        )
+        query, candidate, count = query[keep], candidate[keep], count[keep]
+
+        order = np.lexsort((candidate, -count, query))
+        query, candidate, count = query[order], candidate[order], count[order]
+        starts = np.searchsorted(query, np.arange(len(rows)))
+        keep = np.arange(len(query)) - starts[query] < n
+        query, candidate, count = query[keep], candidate[keep], count[keep]
+
+        splits = np.cumsum(np.bincount(query, minlength=len(rows)))[:-1]
+        found = np.split(self.ids[candidate], splits)
+        if return_counts:
+            return [
+                (ids.tolist(), common.tolist())
+                for ids, common in zip(found, np.split(count, splits))
+            ]
+        return [ids.tolist() for ids in found]
+
+    def friends_of_friends(
+        self,
+        user_id: int,
+        n: int,
+        exclude: Bitset = None,
+        friends: List[int] = None,
+        return_counts: bool = False,
+    ):
+        """Returns the n friends of the friends of the user with the most common friends.
+
+        Args:
+            :param user_id: Indexed user id
+            :param n: Number of candidates
+            :param exclude: Users that must not be returned
+            :param friends: Friends of the user that are not in the adjacency
+            :param return_counts: Also return the numbers of common friends
+
+        Returns:
+            List[int]: Candidates, the most common friends first (and the counts)
+        """
+        return self.friends_of_friends_batch(
+            [user_id],
+            n,
+            [exclude],
+            None if friends is None else [friends],
+            return_counts,
+        )[0]
+
+    def _submit(self, background: bool, function, *args) -> Future:
+        if background:
+            return self.executor.submit(function, *args)
+        future = Future()
+        future.set_result(function(*args))
+        return future
+
+    def submit_search(
+        self,
+        vector: np.ndarray,
+        n: int,
+        exclude: Bitset = None,
+        background=True,
+        mask: np.ndarray = None,
+    ) -> Future:
+        """Runs search in the shared thread pool, or right away if background is False."""
+        return self._submit(background, self.search, vector, n, exclude, mask)
+
+    def submit_hybrid_search(
+        self,
+        user_id: int,
+        vector: np.ndarray,
+        n: int,
+        exclude: Bitset = None,
+        background=True,
+        mask: np.ndarray = None,
+        graph_weight: float = 0.7,
+        content_weight: float = 0.3,
+    ) -> Future:
+        """Runs hybrid_search in the shared thread pool, or right away if background is False."""
+        return self._submit(
+            background,
+            self.hybrid_search,
+            user_id,
+            vector,
+            n,
+            exclude,
+            mask,
+            graph_weight,
+            content_weight,
+        )
+
+    def submit_friends_of_friends(
+        self,
+        user_id: int,
+        n: int,
+        exclude: Bitset = None,
+        friends: List[int] = None,
+        background=True,
+    ) -> Future:
+        """Runs friends_of_friends in the shared thread pool, or right away if background is False."""
+        return self._submit(
+            background, self.friends_of_friends, user_id, n, exclude, friends
+        )
+
+    def close(self) -> None:
+        """Stops the shared thread pool and the precomputation of the PPR vectors."""
+        self._stop.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+__all__ = ("RecommendationModel",)
@@ -0,0 +1,164 @@
+import threading
+from collections import defaultdict, deque
+from typing import Dict, Iterable, Set, Tuple
+
+import numpy as np
+from rec_services.graph import Graph
+
+
+class PersonalizedPageRank:
+    """
+    Approximate personalized PageRank vectors over the subscription graph, cached per user.
+
+    A vector is computed with the push algorithm of Andersen, Chung and Lang: the source starts
+    with residual 1, a node whose residual exceeds epsilon times its out-degree keeps alpha of
+    it as score and spreads the rest evenly over its subscriptions. The residual of users
+    without subscriptions returns to the source. Only the nodes near the source are touched,
+    a vector costs O(1 / (alpha * epsilon)) pushes whatever the size of the graph.
+
+    The vectors are kept sparse (sorted positions, scores). They are pushed ahead of the
+    requests with precompute, or on the first request of a user. The cache remembers which
+    vectors touched which nodes, so an edge added with Graph.add_edge drops only the vectors
+    that pushed through its source, the others are still exact up to epsilon.
+
+    Args:
+        :param graph: Graph whose edges are followed, the cache listens to its add_edge
+        :param alpha: Teleport probability back to the source
+        :param epsilon: Residual per out-edge below which a node is not pushed
+
+    """
+
+    def __init__(self, graph: Graph, alpha: float = 0.15, epsilon: float = 1e-4):
+        self.graph = graph
+        self.alpha = alpha
+        self.epsilon = epsilon
+
+        self._vectors: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+        self._touched: Dict[int, Set[int]] = {}
+        self._touched_by: Dict[int, Set[int]] = defaultdict(set)
+        self._version = 0
+        self._lock = threading.Lock()
+        graph.edge_listeners.append(self.invalidate_edge)
+
+    def _push(self, source: int) -> (np.ndarray, np.ndarray, Set[int]):
+        """Computes the approximate PPR vector of a node.
+
+        Args:
+            :param source: Position of the source node
+
+        Returns:
+            (np.ndarray, np.ndarray, Set[int]): Sorted positions of the nodes with a score, their
+                float32 scores and all nodes the push reached
+        """
+        degrees = self.graph.degrees
+        scores = defaultdict(float)
+        residuals = defaultdict(float, {source: 1.0})
+        queue, queued = deque([source]), {source}
+        while queue:
+            node = queue.popleft()
+            queued.discard(node)
+            residual, residuals[node] = residuals[node], 0.0
+            scores[node] += self.alpha * residual
+            neighbors = self.graph.neighbor_positions(node)
+            # users without subscriptions send their residual back to the source
+            targets = neighbors.tolist() if len(neighbors) else [source]
+            share = (1 - self.alpha) * residual / len(targets)
+            for target in targets:
+                residuals[target] += share
+                if target not in queued and residuals[target] > self.epsilon * max(
+                    degrees[target], 1
+                ):
+                    queue.append(target)
+                    queued.add(target)
+
+        positions = np.fromiter(scores, dtype=np.int64, count=len(scores))
+        values = np.fromiter(scores.values(), dtype=np.float32, count=len(scores))
+        order = np.argsort(positions)
+        return positions[order], values[order], set(residuals)
+
+    def vector(self, user_id: int) -> (np.ndarray, np.ndarray):
+        """Returns the cached PPR vector of the user, it is pushed if it is not cached.
+
+        Args:
+            :param user_id: User id of the graph
+
+        Returns:
+            (np.ndarray, np.ndarray): Sorted positions and their scores
+        """
+        source = self.graph.id_map.to_position(user_id)
+        cached = self._vectors.get(source)
+        if cached is not None:
+            return cached
+        version = self._version
+        positions, values, touched = self._push(source)
+        with self._lock:
+            # an edge added during the push may have changed the vector
+            if version == self._version:
+                self._vectors[source] = (positions, values)
+                self._touched[source] = touched
+                for node in touched:
+                    self._touched_by[node].add(source)
+        return positions, values
+
+    def precompute(
+        self, user_ids: Iterable[int] = None, stop: threading.Event = None
+    ) -> int:
+        """Pushes the vectors of the users that are not cached yet.
+
+        Args:
+            :param user_ids: User ids of the graph, all users by default
+            :param stop: Event that interrupts the precomputation when it is set
+
+        Returns:
+            int: Number of vectors that were pushed
+        """
+        user_ids = self.graph.id_map.ids if user_ids is None else user_ids
+        pushed = 0
+        for user_id in user_ids:
+            if stop is not None and stop.is_set():
+                break
+            if self.graph.id_map.to_position(user_id) not in self._vectors:
+                self.vector(user_id)
+                pushed += 1
+        return pushed
+
+    def scores(self, user_id: int, candidate_ids) -> np.ndarray:
+        """Returns the PPR scores of the candidates from the sparse vector of the user.
+
+        Args:
+            :param user_id: User id of the graph
+            :param candidate_ids: User ids, the ids that are not in the graph score 0
+
+        Returns:
+            np.ndarray: float32 scores of the candidates
+        """
+        positions, values = self.vector(user_id)
+        candidates = self.graph.id_map.to_positions(candidate_ids)
+        if not len(positions):
+            return np.zeros(candidates.shape, dtype=np.float32)
+        found = np.minimum(np.searchsorted(positions, candidates), len(positions) - 1)
+        return np.where(positions[found] == candidates, values[found], 0).astype(
+            np.float32
+        )
+
+    def invalidate_edge(self, source: int, target: int) -> None:
+        """Drops the cached vectors that pushed through the source of the new edge.
+
+        Args:
+            :param source: Source user id
+            :param target: Target user id
+        """
+        position = self.graph.id_map.to_position(source)
+        with self._lock:
+            self._version += 1
+            for cached in self._touched_by.pop(position, ()):
+                del self._vectors[cached]
+                for node in self._touched.pop(cached):
+                    if node != position:
+                        self._touched_by[node].discard(cached)
+
+    def __len__(self) -> int:
+        return len(self._vectors)
+
+
+__all__ = ("PersonalizedPageRank",)
@@ -0,0 +1,152 @@
+from typing import List
+
+import numpy as np
+from rec_services.dataset import Dataset
+from rec_services.encoding import AnswerEncoder
+from rec_services.id_map import IdMap
+from rec_services.model import RecommendationModel
+
+
+class TopKTable:
+    """
+    Precomputed top-k recommendations of every participant, serving is a table lookup.
+
+    Args:
+        :param ids: Sorted user ids, one per row
+        :param recommendations: Recommended user ids of every user, padded with -1
+        :param distances: L2 distances between the answer vectors normalized over the shared questions, or Hamming distances of the answer codes, padded with inf
+
+    """
+
+    def __init__(
+        self, ids: np.ndarray, recommendations: np.ndarray, distances: np.ndarray
+    ):
+        self.ids = ids
+        self.id_map = IdMap(ids)
+        self.recommendations = recommendations
+        self.distances = distances
+
+    @classmethod
+    def from_dataset(
+        cls,
+        dataset: Dataset,
+        k: int = 10,
+        index_backend: str = "flat",
+        index_build_params: dict = None,
+        index_search_params: dict = None,
+        block_size: int = 4096,
+        encoder: AnswerEncoder = None,
+    ) -> "TopKTable":
+        """Builds a model of the dataset and computes the table with from_model.
+
+        Args:
+            :param dataset: Dataset object
+            :param k: Number of recommendations per user
+            :param index_backend: FAISS index backend, one of rec_services.index.INDEX_BACKENDS
+            :param index_build_params: Build parameters of the index backend
+            :param index_search_params: Search parameters of the index backend
+            :param block_size: Number of queries searched at once
+            :param encoder: Compare the answers as categories on binary codes, see RecommendationModel
+
+        Returns:
+            TopKTable: Table with a row for every participant of the answers pivot
+        """
+        model = RecommendationModel(
+            dataset,
+            index_backend,
+            index_build_params,
+            index_search_params,
+            encoder=encoder,
+            precompute_ppr=False,
+        )
+        try:
+            return cls.from_model(model, k, block_size)
+        finally:
+            model.close()
+
+    @classmethod
+    def from_model(
+        cls, model: RecommendationModel, k: int = 10, block_size: int = 4096
+    ) -> "TopKTable":
+        """Searches the whole answer matrix against the indexes of the model, block by block.
+        Every block over-fetches by its largest number of excluded users, so after dropping
+        the user itself and its subscriptions at least k candidates are left. Partial
+        respondents are compared on the questions they answered.
+
+        Args:
+            :param model: Shared RecommendationModel
+            :param k: Number of recommendations per user
+            :param block_size: Number of queries searched at once
+
+        Returns:
+            TopKTable: Table with a row for every user of the model
+        """
+        ids = model.ids
+        to_ids = model.id_map.to_ids
+        recommendations = np.full((len(ids), k), -1, dtype=np.int64)
+        distances = np.full((len(ids), k), np.inf, dtype=np.float32)
+        for start in range(0, len(ids), block_size):
+            stop = min(start + block_size, len(ids))
+            excludes = [
+                {
+                    int(ids[row]),
+                    *to_ids(
+                        model.indices[model.indptr[row] : model.indptr[row + 1]]
+                    ).tolist(),
+                }
+                for row in range(start, stop)
+            ]
+            results = model.search_batch(
+                model.vectors[start:stop],
+                k,
+                excludes,
+                model.masks[start:stop],
+                return_distances=True,
+            )
+            for row, (row_ids, row_distances) in enumerate(results, start):
+                recommendations[row, : len(row_ids)] = row_ids
+                distances[row, : len(row_ids)] = row_distances
+        return cls(ids, recommendations, distances)
+
+    def get(self, user_id: int) -> List[int]:
+        """Returns the recommendations of the user, an empty list for unknown users.
+
+        Args:
+            :param user_id: User id
+
+        Returns:
+            List[int]: Recommended user ids, the most similar first
+        """
+        row = self.id_map.to_positions([user_id])[0]
+        if row < 0:
+            return []
+        return [int(i) for i in self.recommendations[row] if i >= 0]
+
+    def save(self, path: str) -> None:
+        """Writes the table to a .npz file.
+
+        Args:
+            :param path: Output path
+        """
+        np.savez(
+            path,
+            ids=self.ids,
+            recommendations=self.recommendations,
+            distances=self.distances,
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "TopKTable":
+        """Reads a table written by save.
+
+        Args:
+            :param path: Path of the .npz file
+
+        Returns:
+            TopKTable: Loaded table
+        """
+        with np.load(path) as data:
+            return cls(data["ids"], data["recommendations"], data["distances"])
+
+
+__all__ = ("TopKTable",)
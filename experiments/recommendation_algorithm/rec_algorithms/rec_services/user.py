@@ -2,6 +2,8 @@ from typing import List
 
 import faiss
 import numpy as np
+from rec_services.bitset import Bitset
+from rec_services.index import search_index
 
 
 class User:
@@ -12,25 +14,32 @@ class User:
         :param user_id: User id
         :param user_vector: User vector
         :param subscription_ids: List of subscription ids from the participants' data
+        :param user_mask: Questions the user answered, all by default
+
+    The black list and the checked users are kept as bitsets of user ids.
     """
 
     def __init__(
-        self, user_id: int, user_vector: np.ndarray, subscription_ids: List[int]
+        self,
+        user_id: int,
+        user_vector: np.ndarray,
+        subscription_ids: List[int],
+        user_mask: np.ndarray = None,
     ):
         self.id = user_id
-        self.black_list = []
+        self.black_list = Bitset()
         self.user_vector = user_vector
-        self.checked = subscription_ids.append(user_id)
+        self.user_mask = (
+            np.ones(user_vector.shape[-1], dtype=bool) if user_mask is None else user_mask
+        )
+        self.checked = Bitset([*subscription_ids, user_id])
 
-    def get_similar_users(
-        self, index: faiss.IndexFlatL2, contiguous_to_custom: dict, n: int
-    ) -> List[int]:
-        """Returns the n most similar users to the user. If there is no similar user, FAISS returns -1.
-        This value is handled using try-except block.
+    def get_similar_users(self, index: faiss.Index, n: int) -> List[int]:
+        """Returns the n most similar users to the user, skipping the blacklisted and checked ones at search time.
+        The index must return custom user ids. If there is no similar user, FAISS returns -1, such ids are dropped.
 
         Args:
-            :param index: FAISS index
-            :param contiguous_to_custom: Dictionary that maps the contiguous index to the custom index
+            :param index: FAISS index built with custom ids
             :param n: Number of similar users to return
 
         Returns:
@@ -38,14 +47,10 @@ class User:
 
         """
 
-        distances, indices = index.search(self.user_vector, n)
-        lst = []
-        for i in indices[0]:
-            try:
-                lst.append(contiguous_to_custom[i])
-            except KeyError:
-                pass
-        return lst
+        distances, indices = search_index(
+            index, self.user_vector, n, self.black_list | self.checked
+        )
+        return [int(i) for i in indices[0] if i >= 0]
 
     def is_blacklisted(self, some_user_id) -> bool:
         """Checks if the user is blacklisted."""
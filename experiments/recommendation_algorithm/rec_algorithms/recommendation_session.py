@@ -0,0 +1,213 @@
+import asyncio
+import enum
+from collections import deque
+from typing import AsyncIterator, Iterator, List, Optional
+
+from rec_services.bitset import Bitset
+from rec_services.model import RecommendationModel
+from rec_services.user import User
+
+_PENDING = object()
+
+
+class StatusKind(enum.Enum):
+    """StatusKind enum class that holds the status of the users' flow now."""
+
+    COMMON = 1
+    FRIEND = 2
+
+
+class RecommendationSession:
+    """Recommendation session of one user that is driven by method calls instead of the console.
+    The session holds only the cursor and the exclusions of the user, the index, the vectors
+    and the adjacency belong to the shared model, so many sessions fit into one process.
+
+    Candidates are served page by page. A page holds the users ranked by the hybrid of the
+    graph proximity and the content similarity to the user (COMMON)
+    or the friends of its friends with the most common friends (FRIEND), the two kinds
+    alternate. The friends of friends of all friends, the subscriptions and the accepted
+    candidates, are ranked at once by a sparse product over the adjacency. As soon as a page is taken, the
+    next one is searched in the thread pool of the model, so the next candidate is usually
+    ready before the user answers. Users that were rejected, accepted or already queued are
+    excluded from the search, candidates that got feedback while their page was prefetched
+    are skipped.
+
+    When nobody is left, the rejected users get another chance, as in the console loop. The
+    session ends when there is nothing to retry.
+
+    Args:
+        :param model: Shared RecommendationModel
+        :param user: User object, its black list and checked users are the exclusions
+        :param page_size: Number of candidates searched at once
+        :param prefetch: Whether the next page is searched in the background
+        :param graph_weight: Weight of the PPR graph proximity in the COMMON pages, 0 ranks by content only
+        :param content_weight: Weight of the content similarity in the COMMON pages
+
+    """
+
+    def __init__(
+        self,
+        model: RecommendationModel,
+        user: User,
+        page_size: int = 10,
+        prefetch: bool = True,
+        graph_weight: float = 0.7,
+        content_weight: float = 0.3,
+    ):
+        self.model = model
+        self.user = user
+        self.page_size = page_size
+        self.prefetch = prefetch
+        self.graph_weight = graph_weight
+        self.content_weight = content_weight
+
+        self.status = StatusKind.COMMON
+        self.queued = Bitset()  # candidates served since the last restart
+        self.friends = []  # candidates accepted in this session
+        self.restarts = 0
+        self.current = None
+
+        self._page = deque()
+        self._pending = None
+        self._finished = False
+
+    def get_friends(self) -> List[int]:
+        """Returns the subscriptions of the user and the candidates accepted in this session."""
+        return self.model.get_subscriptions(self.user.id) + self.friends
+
+    def _submit(self) -> None:
+        """Starts the search of the next page, the exclusions are taken at this moment."""
+        status = self.status
+        exclude = self.user.black_list | self.user.checked | self.queued
+        if status == StatusKind.FRIEND:
+            future = self.model.submit_friends_of_friends(
+                self.user.id,
+                self.page_size,
+                exclude,
+                self.friends,
+                background=self.prefetch,
+            )
+        elif self.graph_weight:
+            future = self.model.submit_hybrid_search(
+                self.user.id,
+                self.user.user_vector,
+                self.page_size,
+                exclude,
+                background=self.prefetch,
+                mask=self.user.user_mask,
+                graph_weight=self.graph_weight,
+                content_weight=self.content_weight,
+            )
+        else:
+            future = self.model.submit_search(
+                self.user.user_vector,
+                self.page_size,
+                exclude,
+                background=self.prefetch,
+                mask=self.user.user_mask,
+            )
+        self._pending = (status, future)
+
+    def _restart(self) -> bool:
+        """Gives the rejected and unanswered users another chance, returns False if there are none."""
+        if not len(self.user.black_list) and not len(self.queued):
+            return False
+        self.user.black_list.clear()
+        self.queued.clear()
+        self.status = StatusKind.COMMON
+        self.restarts += 1
+        return True
+
+    def _take_page(self) -> bool:
+        """Moves the pending page into the queue, returns False when the session is over."""
+        if self._pending is None:
+            self._submit()
+        status, future = self._pending
+        page = future.result()
+        self._pending = None
+
+        if page:
+            for candidate in page:
+                self.queued.add(candidate)
+            self._page.extend(page)
+            self.status = (
+                StatusKind.FRIEND if status == StatusKind.COMMON else StatusKind.COMMON
+            )
+            self._submit()
+            return True
+        if status == StatusKind.FRIEND:  # no unseen friends of friends
+            self.status = StatusKind.COMMON
+            return True
+        # the user's own search is empty, so everybody is excluded
+        return self._restart()
+
+    def _next(self, block: bool):
+        """Returns the next candidate, None at the end or _PENDING if it would have to wait."""
+        while not self._finished:
+            while self._page:
+                candidate = self._page.popleft()
+                if not (
+                    self.user.is_checked(candidate)
+                    or self.user.is_blacklisted(candidate)
+                ):
+                    self.current = candidate
+                    return candidate
+            if not block:
+                if self._pending is None:
+                    self._submit()
+                if not self._pending[1].done():
+                    return _PENDING
+            if not self._take_page():
+                self.close()
+        self.current = None
+        return None
+
+    def next_candidate(self) -> Optional[int]:
+        """Returns the next candidate, blocks only if its page is not searched yet.
+
+        Returns:
+            Optional[int]: Candidate user id or None if the session is over
+        """
+        return self._next(block=True)
+
+    def accept(self, candidate: int) -> None:
+        """The user wants the candidate to be a friend, the friendship is added to the shared graph."""
+        self.friends.append(candidate)
+        self.user.checked.add(candidate)
+        self.model.add_friend(self.user.id, candidate)
+
+    def reject(self, candidate: int) -> None:
+        """The user does not want the candidate to be a friend."""
+        self.user.black_list.add(candidate)
+
+    def close(self) -> None:
+        """Ends the session and cancels its background search."""
+        self._finished = True
+        self._page.clear()
+        if self._pending is not None:
+            self._pending[1].cancel()
+            self._pending = None
+
+    def __iter__(self) -> Iterator[int]:
+        while (candidate := self.next_candidate()) is not None:
+            yield candidate
+
+    async def __aiter__(self) -> AsyncIterator[int]:
+        while True:
+            candidate = self._next(block=False)
+            if candidate is _PENDING:
+                # wait for the prefetched page without blocking the event loop
+                await asyncio.wrap_future(self._pending[1])
+                continue
+            if candidate is None:
+                return
+            yield candidate
+
+    def __enter__(self) -> "RecommendationSession":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+__all__ = ("StatusKind", "RecommendationSession")
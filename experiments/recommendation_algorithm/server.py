@@ -0,0 +1,222 @@
+import argparse
+import asyncio
+import json
+import os
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+from rec_algorithms.rec_services.dataset import Dataset
+from rec_algorithms.rec_services.encoding import AnswerEncoder
+from rec_algorithms.rec_services.micro_batcher import MicroBatcher
+from rec_algorithms.rec_services.model import RecommendationModel
+
+
+class RecommendationServer:
+    """
+    Asyncio HTTP server with the recommend and feedback endpoints over one shared model.
+
+        GET  /recommend?user_id=1&k=10   -> {"user_id": 1, "recommendations": [...]}
+        POST /feedback {"user_id": 1, "candidate_id": 2, "accepted": true}
+        GET  /stats                       -> queue depth, batch sizes and latencies
+
+    The searches of concurrent requests are collected into micro-batches. The users keep their
+    black list and checked users between requests, like in the console session.
+
+    Args:
+        :param model: Shared RecommendationModel
+        :param max_batch_size: Largest number of queries searched at once
+        :param max_wait: Longest time in seconds a query waits for the batch to fill up
+        :param k: Default number of recommendations
+
+    """
+
+    def __init__(
+        self,
+        model: RecommendationModel,
+        max_batch_size: int = 64,
+        max_wait: float = 0.002,
+        k: int = 10,
+    ):
+        self.model = model
+        self.batcher = MicroBatcher(model, max_batch_size, max_wait)
+        self.k = k
+        self.users = {}
+
+    def get_user(self, user_id: int):
+        """Returns the user with its exclusions, it is created on the first request."""
+        if user_id not in self.users:
+            self.users[user_id] = self.model.create_user(user_id)
+        return self.users[user_id]
+
+    async def recommend(self, user_id: int, k: int = None) -> dict:
+        """Returns the k most similar users that the user has neither rejected nor checked."""
+        k = self.k if k is None else k
+        if k <= 0:
+            raise ValueError(f"k must be positive, not {k}")
+        user = self.get_user(user_id)
+        recommendations = await self.batcher.search(
+            user.user_vector,
+            k,
+            user.black_list | user.checked,
+            user.user_mask,
+        )
+        return {"user_id": user_id, "recommendations": recommendations}
+
+    def feedback(self, user_id: int, candidate_id: int, accepted: bool) -> dict:
+        """Adds the candidate to the checked users or to the black list of the user.
+
+        An accepted candidate also becomes a friend in the shared graph of the model, like in
+        RecommendationSession.accept.
+        """
+        user = self.get_user(user_id)
+        if accepted:
+            self.model.add_friend(user_id, candidate_id)
+            user.checked.add(candidate_id)
+        else:
+            user.black_list.add(candidate_id)
+        return {"user_id": user_id, "candidate_id": candidate_id, "accepted": accepted}
+
+    def stats(self) -> dict:
+        """Returns the batching stats and the number of known users."""
+        return {**self.batcher.stats(), "users": len(self.users)}
+
+    async def route(self, method: str, target: str, body: bytes) -> (int, dict):
+        """Returns the status code and the JSON payload of the request."""
+        url = urlsplit(target)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            if method == "GET" and url.path == "/recommend":
+                return 200, await self.recommend(
+                    int(query["user_id"]), int(query.get("k", self.k))
+                )
+            if method == "POST" and url.path == "/feedback":
+                data = json.loads(body or b"{}")
+                return 200, self.feedback(
+                    int(data["user_id"]),
+                    int(data["candidate_id"]),
+                    bool(data["accepted"]),
+                )
+            if method == "GET" and url.path == "/stats":
+                return 200, self.stats()
+        except KeyError as e:
+            return 404, {"error": f"unknown user or missing field {e}"}
+        except ValueError as e:
+            return 400, {"error": str(e)}
+        return 404, {"error": f"no endpoint {method} {url.path}"}
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Serves the requests of one keep-alive connection."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode().split(" ", 2)
+                headers = {}
+                while (line := await reader.readline()) not in (
+                    b"\r\n",
+                    b"\n",
+                    b"",
+                ):
+                    name, _, value = line.decode().partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(
+                    int(headers.get("content-length", 0))
+                )
+
+                status, payload = await self.route(method, target, body)
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n\r\n".encode()
+                    + data
+                )
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8000) -> None:
+        self.batcher.start()
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Serving recommendations on http://{host}:{port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.batcher.stop()
+
+
+def main(
+    host: str,
+    port: int,
+    max_batch_size: int,
+    max_wait: float,
+    index_backend: str,
+    keep_partial: bool = False,
+    binary: bool = False,
+):
+    participants_path = os.path.join("..", "..", "data", "participants.json")
+    answers_path = os.path.join("..", "..", "data", "answers.json")
+    fields_path = os.path.join("..", "..", "data", "fields.json")
+
+    with open(participants_path, "r") as f:
+        participants = pd.read_json(f)
+    with open(answers_path, "r") as f:
+        answers = pd.read_json(f)
+    model = RecommendationModel(
+        Dataset(answers, participants, keep_partial),
+        index_backend,
+        encoder=AnswerEncoder.from_file(fields_path) if binary else None,
+        precompute_ppr=False,
+    )
+
+    server = RecommendationServer(model, max_batch_size, max_wait)
+    try:
+        asyncio.run(server.serve(host, port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        model.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Micro-batching recommendation server."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument(
+        "--max-wait-ms",
+        type=float,
+        default=2.0,
+        help="Longest time a query waits for its batch to fill up.",
+    )
+    parser.add_argument("--index-backend", default="flat")
+    parser.add_argument(
+        "--keep-partial",
+        action="store_true",
+        help="Also recommend late joiners, users are compared on the questions both answered.",
+    )
+    parser.add_argument(
+        "--binary",
+        action="store_true",
+        help="Compare the answers as categories on one-hot binary codes instead of normalized vectors.",
+    )
+    args = parser.parse_args()
+    main(
+        args.host,
+        args.port,
+        args.max_batch_size,
+        args.max_wait_ms / 1000,
+        args.index_backend,
+        args.keep_partial,
+        args.binary,
+    )
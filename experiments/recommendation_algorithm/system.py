@@ -1,32 +1,69 @@
+import argparse
 import os
 
 import pandas as pd
 from rec_algorithms.hybrid_rec_system import HybridRecommendationSystem
 
 from rec_algorithms.rec_services.dataset import Dataset
-from rec_algorithms.rec_services.user import User
+from rec_algorithms.rec_services.encoding import AnswerEncoder
+from rec_algorithms.rec_services.model import RecommendationModel
+from rec_algorithms.rec_services.top_k import TopKTable
 
 
-def main():
+def main(
+    batch: bool = False,
+    k: int = 10,
+    output: str = "recommendations.npz",
+    keep_partial: bool = False,
+    binary: bool = False,
+):
     participants_path = os.path.join("..", "..", "data", "participants.json")
     answers_path = os.path.join("..", "..", "data", "answers.json")
+    fields_path = os.path.join("..", "..", "data", "fields.json")
 
     with open(participants_path, "r") as f:
         participants = pd.read_json(f)
     with open(answers_path, "r") as f:
         answers = pd.read_json(f)
-    data = Dataset(answers, participants)
+    data = Dataset(answers, participants, keep_partial)
+    encoder = AnswerEncoder.from_file(fields_path) if binary else None
+
+    if batch:
+        table = TopKTable.from_dataset(data, k, encoder=encoder)
+        table.save(output)
+        print(f"Saved top-{k} recommendations of {len(table.ids)} users to {output}")
+        return
 
     user_id = int(input("Enter user id: "))
 
-    user = User(
-        user_id,
-        data.get_user_vector(user_id),
-        data.participants.loc[user_id]["subscription_ids"],
-    )
-    recommendation_system = HybridRecommendationSystem(user, data)
-    recommendation_system.process_user_recommendations()
+    model = RecommendationModel(data, encoder=encoder)
+    # the user gets the mask of its answered questions, late joiners are searched on them only
+    user = model.create_user(user_id)
+    recommendation_system = HybridRecommendationSystem(user, model=model)
+    try:
+        recommendation_system.process_user_recommendations()
+    finally:
+        model.close()
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Hybrid recommendation system.")
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Precompute the recommendations of every user instead of the interactive session.",
+    )
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--output", default="recommendations.npz")
+    parser.add_argument(
+        "--keep-partial",
+        action="store_true",
+        help="Also recommend late joiners, users are compared on the questions both answered.",
+    )
+    parser.add_argument(
+        "--binary",
+        action="store_true",
+        help="Compare the answers as categories on one-hot binary codes instead of normalized vectors.",
+    )
+    args = parser.parse_args()
+    main(args.batch, args.k, args.output, args.keep_partial, args.binary)